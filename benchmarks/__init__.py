@@ -0,0 +1,13 @@
+"""
+
+    Performance benchmarks of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: `benchmarks.synthetic` generates MovieLens-shaped
+    datasets of increasing size, and `benchmarks.run` measures the cold
+    start, latency, throughput and peak memory of each recommender on them
+    (and on the bundled data), optionally comparing against a saved
+    baseline.
+
+"""
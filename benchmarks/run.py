@@ -0,0 +1,368 @@
+"""
+
+    Latency, throughput and memory benchmarks of the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: For every dataset (see `benchmarks.synthetic`) and
+    engine, a fresh Python process is started with the dataset as working
+    directory, so each measurement includes a true cold start:
+
+      - `import_seconds`: importing the engine's module and loading its
+        data and model;
+      - `first_call_seconds`: the first request after that;
+      - `p50_ms`, `p95_ms`, `p99_ms`, `mean_ms`: warm latency over
+        `--requests` further requests with random favourites;
+      - `throughput_per_s`: requests per second of a batch of `--batch`
+        requests (through the batch entry point where the engine has one);
+      - `peak_rss_mb`: peak resident memory of the process.
+
+    The parsed data frames are cached on disk by a preparation process
+    first, so the engines are compared on equal footing. Recommenders are
+    called without their result cache. With `--repeat`, every measurement
+    is the median over that many processes.
+
+    Results are written as JSON (`--output`). `--compare` checks them
+    against an earlier results file and exits with status 1 when a metric
+    is worse than the baseline by more than `--tolerance` (and by more than
+    the metric's noise floor).
+
+    Usage (from the repository root):
+
+        python -m benchmarks.run --output bench.json
+        python -m benchmarks.run --datasets bundled --compare bench.json
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import (DATA_ROOT, DATASETS, DEFAULT_DATASETS,
+                                  REPO_ROOT, prepare_dataset)
+from utils.metrics import peak_rss_mb
+
+ENGINES = ['content_model', 'collab_model', 'prediction_item', 'load_movie_titles']
+MOVIES_PATH = 'resources/data/movies.csv'
+RATINGS_PATH = 'resources/data/ratings.csv'
+
+# Metrics compared against a baseline: whether higher is better, and the
+# smallest absolute change considered more than noise
+METRICS = {
+    'import_seconds': (False, 0.05),
+    'first_call_seconds': (False, 0.01),
+    'p50_ms': (False, 0.2),
+    'p95_ms': (False, 0.5),
+    'p99_ms': (False, 1.0),
+    'throughput_per_s': (True, 0.0),
+    'peak_rss_mb': (False, 10.0),
+}
+TOLERANCE = 0.2
+
+def _content_engine():
+    from recommenders.content_based import (content_model, content_model_batch,
+                                            movies)
+    pool = movies['title'].unique()
+    return content_model.uncached, content_model_batch, pool
+
+def _collab_engine():
+    from recommenders.collaborative_based import collab_catalogue, collab_model
+    from recommenders.model_registry import svd_registry
+    _, title_array, title_movie_ids, _ = collab_catalogue()
+    # App users pick movies they have heard of, i.e. rated ones
+    rated = np.isin(title_movie_ids, svd_registry.factors().item_raw_ids)
+    return collab_model.uncached, None, title_array[rated]
+
+def _prediction_engine():
+    from recommenders.collaborative_based import prediction_item, ratings_df
+    from recommenders.model_registry import svd_registry
+    factors = svd_registry.factors()
+
+    def predict(movie_ids, top_n):
+        return prediction_item(int(movie_ids[0]), factors, ratings_df)
+    return predict, None, factors.item_raw_ids
+
+def _titles_engine():
+    from utils.data_loader import load_movie_titles
+
+    def titles(movie_list, top_n):
+        return load_movie_titles(MOVIES_PATH)
+    return titles, None, np.arange(1)
+
+# Engine name to a loader returning (single call, batch call or None,
+# pool of favourites)
+_LOADERS = {
+    'content_model': _content_engine,
+    'collab_model': _collab_engine,
+    'prediction_item': _prediction_engine,
+    'load_movie_titles': _titles_engine,
+}
+
+def measure_engine(engine, requests=200, batch=200, top_n=10, favourites=3, seed=0):
+    """Benchmark one engine in the current (fresh) process.
+
+    Parameters
+    ----------
+    engine : str
+        Key of `ENGINES`.
+    requests : int
+        Number of warm requests timed.
+    batch : int
+        Number of requests of the throughput batch.
+    top_n : int
+        Recommendations per request.
+    favourites : int
+        Favourite movies per request (one for `prediction_item`).
+    seed : int
+        Seed of the random favourites.
+
+    Returns
+    -------
+    dict
+        The measurements described in the module docstring.
+
+    """
+    start = time.perf_counter()
+    single, batch_fn, pool = _LOADERS[engine]()
+    import_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    size = 1 if engine == 'prediction_item' else favourites
+    lists = [list(rng.choice(pool, min(size, len(pool)), replace=False))
+             for _ in range(1 + requests + batch)]
+
+    start = time.perf_counter()
+    single(lists[0], top_n)
+    first_call = time.perf_counter() - start
+
+    latencies = np.empty(requests)
+    for i, movie_list in enumerate(lists[1:requests + 1]):
+        start = time.perf_counter()
+        single(movie_list, top_n)
+        latencies[i] = time.perf_counter() - start
+
+    batch_lists = lists[requests + 1:]
+    start = time.perf_counter()
+    if batch_fn is not None:
+        batch_fn(batch_lists, top_n)
+    else:
+        for movie_list in batch_lists:
+            single(movie_list, top_n)
+    batch_seconds = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99]) if requests else [0] * 3
+    return {'import_seconds': import_seconds,
+            'first_call_seconds': first_call,
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99),
+            'mean_ms': float(latencies.mean() * 1000) if requests else 0.0,
+            'throughput_per_s': len(batch_lists) / batch_seconds if batch_seconds else 0.0,
+            'peak_rss_mb': peak_rss_mb()}
+
+def _worker_env():
+    env = {name: value for name, value in os.environ.items()
+           if not name.startswith('RECOMMENDER_')}
+    env['PYTHONPATH'] = os.pathsep.join(
+        [REPO_ROOT] + [p for p in env.get('PYTHONPATH', '').split(os.pathsep) if p])
+    return env
+
+def _run_worker(path, args, timeout):
+    """Run `main(args)` in a fresh process inside a dataset directory."""
+    completed = subprocess.run([sys.executable, '-m', 'benchmarks.run'] + args,
+                               cwd=path, env=_worker_env(), capture_output=True,
+                               text=True, timeout=timeout)
+    if completed.returncode != 0:
+        lines = completed.stderr.strip().splitlines() or ['exit status {}'.format(
+            completed.returncode)]
+        raise RuntimeError(lines[-1])
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def _prepare_cache():
+    """Parse the dataset once, so engines start from the on-disk cache."""
+    from utils.data_store import load_movies, load_ratings
+    load_movies(MOVIES_PATH)
+    load_ratings(RATINGS_PATH)
+    return {}
+
+def run_suite(datasets, engines=ENGINES, requests=200, batch=200, top_n=10,
+              repeat=1, root=DATA_ROOT, seed=0, timeout=3600, verbose=True):
+    """Benchmark engines on datasets, one fresh process per measurement.
+
+    Parameters
+    ----------
+    datasets : list (str)
+        'bundled' and/or keys of `benchmarks.synthetic.DATASETS`.
+    engines : list (str)
+        Engines to benchmark.
+    requests, batch, top_n : int
+        See `measure_engine`.
+    repeat : int
+        Processes per measurement; each metric is their median.
+    root : str
+        Directory of the generated datasets.
+    seed : int
+        Seed of the datasets and of the favourites.
+    timeout : float
+        Seconds allowed per process.
+    verbose : bool
+        Report progress on stderr.
+
+    Returns
+    -------
+    list (dict)
+        One record per dataset and engine, with the dataset size, the
+        metrics, or the `error` that stopped the engine.
+
+    """
+    results = []
+    for name in datasets:
+        info = prepare_dataset(name, root, seed, verbose)
+        _run_worker(info['path'], ['--prepare-cache'], timeout)
+        for engine in engines:
+            record = {'dataset': name, 'engine': engine,
+                      'n_movies': info['n_movies'], 'n_ratings': info['n_ratings']}
+            args = ['--worker', engine, '--requests', str(requests),
+                    '--batch', str(batch), '--top-n', str(top_n),
+                    '--seed', str(seed)]
+            try:
+                runs = [_run_worker(info['path'], args, timeout) for _ in range(repeat)]
+            except (RuntimeError, subprocess.TimeoutExpired) as error:
+                record['error'] = str(error)
+            else:
+                record.update({metric: float(np.median([run[metric] for run in runs]))
+                               for metric in runs[0]})
+            results.append(record)
+            if verbose:
+                print(format_record(record), file=sys.stderr, flush=True)
+    return results
+
+def format_record(record):
+    """One-line summary of a result record."""
+    head = '{:<8} {:<18}'.format(record['dataset'], record['engine'])
+    if 'error' in record:
+        return '{} error: {}'.format(head, record['error'])
+    return ('{} cold {:6.2f}s + {:7.1f}ms  p50 {:8.2f}ms  p95 {:8.2f}ms  '
+            'p99 {:8.2f}ms  {:9.1f}/s  {:7.1f}MB').format(
+                head, record['import_seconds'], 1000 * record['first_call_seconds'],
+                record['p50_ms'], record['p95_ms'], record['p99_ms'],
+                record['throughput_per_s'], record['peak_rss_mb'])
+
+def environment():
+    """Description of the machine and code the results were measured on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'commit': commit or None,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Metrics worse than the baseline by more than the tolerance.
+
+    Parameters
+    ----------
+    results, baseline : list (dict)
+        Result records of `run_suite`; records are matched on dataset and
+        engine.
+    tolerance : float
+        Allowed relative degradation, e.g. 0.2 for 20%.
+
+    Returns
+    -------
+    list (dict)
+        One entry per regression, with the dataset, engine, metric, the
+        baseline and current values and the relative change.
+
+    """
+    previous = {(r['dataset'], r['engine']): r for r in baseline if 'error' not in r}
+    regressions = []
+    for record in results:
+        before = previous.get((record['dataset'], record['engine']))
+        if before is None:
+            continue
+        if 'error' in record:
+            regressions.append({'dataset': record['dataset'],
+                                'engine': record['engine'], 'metric': 'error',
+                                'baseline': None, 'current': record['error'],
+                                'change': None})
+            continue
+        for metric, (higher_is_better, noise) in METRICS.items():
+            old, new = before.get(metric), record.get(metric)
+            if old is None or new is None:
+                continue
+            worse = old - new if higher_is_better else new - old
+            if worse > noise and worse > tolerance * abs(old):
+                regressions.append({'dataset': record['dataset'],
+                                    'engine': record['engine'], 'metric': metric,
+                                    'baseline': old, 'current': new,
+                                    'change': (new - old) / old if old else None})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the recommenders.')
+    parser.add_argument('--datasets', nargs='+', default=DEFAULT_DATASETS,
+                        choices=['bundled'] + list(DATASETS))
+    parser.add_argument('--engines', nargs='+', default=ENGINES, choices=ENGINES)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Warm requests timed per engine.')
+    parser.add_argument('--batch', type=int, default=200,
+                        help='Requests of the throughput batch.')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Processes per measurement (median reported).')
+    parser.add_argument('--root', default=DATA_ROOT,
+                        help='Directory of the generated datasets.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=3600,
+                        help='Seconds allowed per benchmark process.')
+    parser.add_argument('--output', default=None, help='JSON results file.')
+    parser.add_argument('--compare', default=None,
+                        help='Baseline JSON results file to check against.')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='Allowed relative degradation before a '
+                             'regression is reported.')
+    parser.add_argument('--worker', choices=ENGINES, help=argparse.SUPPRESS)
+    parser.add_argument('--prepare-cache', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.prepare_cache:
+        print(json.dumps(_prepare_cache()))
+        return 0
+    if args.worker:
+        print(json.dumps(measure_engine(args.worker, args.requests, args.batch,
+                                        args.top_n, seed=args.seed)))
+        return 0
+
+    results = run_suite(args.datasets, args.engines, args.requests, args.batch,
+                        args.top_n, args.repeat, args.root, args.seed, args.timeout)
+    report = {'environment': environment(),
+              'settings': {'requests': args.requests, 'batch': args.batch,
+                           'top_n': args.top_n, 'repeat': args.repeat,
+                           'seed': args.seed},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for r in regressions:
+            change = '' if r['change'] is None else ' ({:+.0%})'.format(r['change'])
+            values = ['-' if v is None else v if isinstance(v, str) else '{:.4g}'.format(v)
+                      for v in (r['baseline'], r['current'])]
+            print('REGRESSION {} {} {}: {} -> {}{}'.format(
+                r['dataset'], r['engine'], r['metric'], values[0], values[1], change))
+        if regressions:
+            return 1
+        print('No regressions against {}'.format(args.compare))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
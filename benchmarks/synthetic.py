@@ -0,0 +1,274 @@
+"""
+
+    Synthetic MovieLens-shaped datasets for benchmarking.
+
+    Author: Explore Data Science Academy.
+
+    Description: Generates a catalogue (`movies.csv`) and ratings
+    (`ratings.csv`) with the columns, value formats and rough statistics of
+    MovieLens: sparse movie IDs, titles with release years (some in the
+    'Name, The' form), pipe-separated genres with realistic frequencies,
+    half-star ratings, a long-tailed movie popularity and user activity,
+    and ratings ordered by user then time. Instead of training an SVD on
+    millions of ratings, a compact factor export (`SVD_factors.npz`) with
+    random factors and the generating biases is written for the rated
+    movies and their users, which the model registry serves like a trained
+    model.
+
+    Each dataset is written to its own directory laid out like the
+    repository (`resources/data`, `resources/models`), so the recommenders
+    run on it unchanged with that directory as working directory. A
+    directory is reused once complete (`dataset.json` is written last).
+
+    Usage (from the repository root):
+
+        python -m benchmarks.synthetic --datasets small medium
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_ROOT = 'resources/benchmarks'
+
+# Dataset presets: number of movies and of ratings. 'bundled' is the data
+# shipped in resources/data.
+DATASETS = {
+    'tiny': (10000, 10000),
+    'small': (25000, 100000),
+    'medium': (50000, 1000000),
+    'large': (100000, 10000000),
+    'xlarge': (100000, 25000000),
+}
+DEFAULT_DATASETS = ['bundled', 'tiny', 'small', 'medium']
+
+# Mean number of ratings per user, and latent factors of the exported model
+RATINGS_PER_USER = 100
+N_FACTORS = 100
+
+# MovieLens genres and the fraction of movies tagged with each
+GENRE_FREQUENCIES = {
+    'Drama': 0.41, 'Comedy': 0.27, 'Thriller': 0.13, 'Romance': 0.12,
+    'Action': 0.12, 'Horror': 0.09, 'Crime': 0.09, 'Documentary': 0.09,
+    'Adventure': 0.07, 'Sci-Fi': 0.06, 'Mystery': 0.04, 'Children': 0.04,
+    'Animation': 0.04, 'Fantasy': 0.04, 'War': 0.03, 'Western': 0.02,
+    'Musical': 0.02, 'Film-Noir': 0.006, 'IMAX': 0.003,
+}
+NO_GENRES = '(no genres listed)'
+
+_WORDS = ('Love Night Day Man Woman Life Death Dark Last First Story House '
+          'City Blood Black White Red Blue Dead Girl Boy King Queen Dream '
+          'Heart Lost Secret Return Rise Fall War Time World Game Star Sun '
+          'Moon Road River Island Ghost Shadow Fire Ice Wild Little Big '
+          'Great Silent Golden Broken Summer Winter Paris London Tokyo Home '
+          'Eyes Hand Street Family Brother Sister Kids Heaven Hell Power').split()
+_ARTICLES = ['The', 'A', 'An', 'La', 'Le', 'Les', 'Die', 'El']
+
+def generate_movies(n_movies, rng):
+    """Synthetic catalogue.
+
+    Parameters
+    ----------
+    n_movies : int
+        Number of movies.
+    rng : numpy.random.Generator
+        Source of randomness.
+
+    Returns
+    -------
+    Pandas Dataframe
+        `movieId`, `title` and `genres` columns, by ascending `movieId`.
+
+    """
+    # Sparse, ascending IDs, as in MovieLens
+    movie_ids = np.sort(rng.choice(np.arange(1, 3 * n_movies + 1), n_movies,
+                                   replace=False))
+    # Mostly recent release years
+    years = np.clip(2019 - rng.exponential(18, n_movies).astype(int), 1900, 2019)
+    lengths = rng.integers(1, 5, n_movies)
+    words = rng.integers(0, len(_WORDS), (n_movies, 4))
+    articles = rng.integers(0, len(_ARTICLES), n_movies)
+    trailing_article = rng.random(n_movies) < 0.08
+    titles = []
+    for i in range(n_movies):
+        name = ' '.join(_WORDS[w] for w in words[i, :lengths[i]])
+        if trailing_article[i]:
+            name = '{}, {}'.format(name, _ARTICLES[articles[i]])
+        titles.append('{} ({})'.format(name, years[i]))
+
+    names = list(GENRE_FREQUENCIES)
+    tagged = rng.random((n_movies, len(names))) < np.array(list(GENRE_FREQUENCIES.values()))
+    genres = ['|'.join(names[g] for g in np.flatnonzero(row)) or NO_GENRES
+              for row in tagged]
+    return pd.DataFrame({'movieId': movie_ids, 'title': titles, 'genres': genres})
+
+def generate_ratings(movie_ids, n_ratings, rng):
+    """Synthetic ratings with long-tailed movie and user activity.
+
+    Parameters
+    ----------
+    movie_ids : numpy.ndarray
+        MovieLens IDs of the catalogue.
+    n_ratings : int
+        Number of ratings; each (user, movie) pair is rated at most once.
+    rng : numpy.random.Generator
+        Source of randomness.
+
+    Returns
+    -------
+    tuple
+        Ratings frame (`userId`, `movieId`, `rating`, `timestamp`, ordered
+        by user then time), and the user and movie rating biases used to
+        generate it (indexed by user ID - 1 and catalogue row).
+
+    """
+    n_movies = len(movie_ids)
+    n_users = max(10, n_ratings // RATINGS_PER_USER)
+    if n_ratings > n_users * n_movies // 2:
+        raise ValueError('Too many ratings for {} users and {} movies'.format(
+            n_users, n_movies))
+    # Zipf-like popularity over a random order of movies and users
+    movie_weights = 1.0 / (rng.permutation(n_movies) + 10.0)
+    movie_weights /= movie_weights.sum()
+    user_weights = 1.0 / (rng.permutation(n_users) + n_users / 20.0)
+    user_weights /= user_weights.sum()
+
+    keys = np.empty(0, dtype=np.int64)
+    while keys.size < n_ratings:
+        missing = n_ratings - keys.size
+        draw = max(1024, int(missing * 1.1))
+        users = rng.choice(n_users, draw, p=user_weights)
+        rows = rng.choice(n_movies, draw, p=movie_weights)
+        keys = np.unique(np.concatenate([keys, users.astype(np.int64) * n_movies + rows]))
+    keys = rng.permutation(keys)[:n_ratings]
+    users, rows = keys // n_movies, keys % n_movies
+
+    user_bias = rng.normal(0, 0.4, n_users)
+    item_bias = rng.normal(0, 0.5, n_movies)
+    ratings = 3.5 + user_bias[users] + item_bias[rows] + rng.normal(0, 0.9, n_ratings)
+    ratings = np.clip(np.round(ratings * 2) / 2, 0.5, 5.0)
+    timestamps = rng.integers(828000000, 1560000000, n_ratings)
+
+    order = np.lexsort((timestamps, users))
+    frame = pd.DataFrame({'userId': users[order] + 1,
+                          'movieId': np.asarray(movie_ids)[rows[order]],
+                          'rating': ratings[order],
+                          'timestamp': timestamps[order]})
+    return frame, user_bias, item_bias
+
+def synthetic_factors(ratings, movie_ids, user_bias, item_bias, rng,
+                      n_factors=N_FACTORS):
+    """Factor export standing in for an SVD trained on the ratings.
+
+    Parameters
+    ----------
+    ratings : Pandas Dataframe
+        Ratings returned by `generate_ratings`.
+    movie_ids : numpy.ndarray
+        MovieLens IDs of the catalogue.
+    user_bias, item_bias : numpy.ndarray
+        Biases returned by `generate_ratings`.
+    rng : numpy.random.Generator
+        Source of randomness.
+    n_factors : int
+        Number of latent factors.
+
+    Returns
+    -------
+    recommenders.factor_model.FactorModel
+        Random factors and the generating biases of the rated users and
+        movies.
+
+    """
+    from recommenders.factor_model import FactorModel
+    user_ids = np.unique(ratings['userId'].to_numpy())
+    item_ids = np.unique(ratings['movieId'].to_numpy())
+    rows = np.searchsorted(movie_ids, item_ids)
+    return FactorModel(rng.normal(0, 0.1, (user_ids.size, n_factors)),
+                       rng.normal(0, 0.1, (item_ids.size, n_factors)),
+                       user_bias[user_ids - 1], item_bias[rows],
+                       ratings['rating'].mean(), (0.5, 5.0), user_ids, item_ids)
+
+def dataset_path(name, root=DATA_ROOT, seed=0):
+    """Working directory in which the recommenders run on a dataset."""
+    if name == 'bundled':
+        return REPO_ROOT
+    return os.path.abspath(os.path.join(root, '{}-seed{}'.format(name, seed)))
+
+def prepare_dataset(name, root=DATA_ROOT, seed=0, verbose=True):
+    """Generate a dataset preset, unless already complete.
+
+    Parameters
+    ----------
+    name : str
+        'bundled' or a key of `DATASETS`.
+    root : str
+        Directory holding the generated datasets.
+    seed : int
+        Random seed; each seed is a separate dataset.
+    verbose : bool
+        Report generation progress on stdout.
+
+    Returns
+    -------
+    dict
+        `path` of the dataset's working directory and its `n_movies` and
+        `n_ratings`.
+
+    """
+    path = dataset_path(name, root, seed)
+    if name == 'bundled':
+        data = os.path.join(path, 'resources', 'data')
+        with open(os.path.join(data, 'ratings.csv'), 'rb') as f:
+            n_ratings = sum(1 for _ in f) - 1
+        with open(os.path.join(data, 'movies.csv'), 'rb') as f:
+            n_movies = sum(1 for _ in f) - 1
+        return {'path': path, 'n_movies': n_movies, 'n_ratings': n_ratings}
+    info_path = os.path.join(path, 'dataset.json')
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            return dict(json.load(f), path=path)
+
+    n_movies, n_ratings = DATASETS[name]
+    start = time.perf_counter()
+    if verbose:
+        print('Generating {} ({} movies, {} ratings) in {}'.format(
+            name, n_movies, n_ratings, path), flush=True)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(path, 'resources', 'data'), exist_ok=True)
+    os.makedirs(os.path.join(path, 'resources', 'models'), exist_ok=True)
+    movies = generate_movies(n_movies, rng)
+    movies.to_csv(os.path.join(path, 'resources', 'data', 'movies.csv'), index=False)
+    movie_ids = movies['movieId'].to_numpy()
+    ratings, user_bias, item_bias = generate_ratings(movie_ids, n_ratings, rng)
+    ratings.to_csv(os.path.join(path, 'resources', 'data', 'ratings.csv'),
+                   index=False, float_format='%.1f', chunksize=1000000)
+    synthetic_factors(ratings, movie_ids, user_bias, item_bias, rng).save(
+        os.path.join(path, 'resources', 'models', 'SVD_factors.npz'))
+
+    info = {'name': name, 'seed': seed, 'n_movies': n_movies,
+            'n_ratings': n_ratings, 'n_users': int(ratings['userId'].nunique())}
+    with open(info_path, 'w') as f:
+        json.dump(info, f, indent=2)
+    if verbose:
+        print('Generated {} in {:.1f}s'.format(name, time.perf_counter() - start),
+              flush=True)
+    return dict(info, path=path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate benchmark datasets.')
+    parser.add_argument('--datasets', nargs='+', default=DEFAULT_DATASETS,
+                        choices=['bundled'] + list(DATASETS))
+    parser.add_argument('--root', default=DATA_ROOT)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    for name in args.datasets:
+        prepare_dataset(name, args.root, args.seed)
+
+if __name__ == '__main__':
+    main()
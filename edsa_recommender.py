@@ -29,13 +29,26 @@
 import streamlit as st
 
 # Data handling dependencies
+import os
 import pandas as pd
 import numpy as np
 
 # Custom Libraries
 from utils.data_loader import load_movie_titles
-from recommenders.collaborative_based import collab_model
-from recommenders.content_based import content_model
+from utils.metrics import metrics
+from utils.title_index import load_title_index
+# Recommenders run in-process, or in a shared recommendation service
+# (`python -m recommenders.service`) when RECOMMENDER_SERVICE_URL is set.
+# In-process engines are loaded on first use or warmed up in the
+# background, as set by RECOMMENDER_STARTUP (see `recommenders.lazy`).
+if os.environ.get('RECOMMENDER_SERVICE_URL'):
+    from recommenders.service_client import (collab_model, content_model,
+                                             hybrid_model)
+    from recommenders.service_client import client as recommender_service
+else:
+    recommender_service = None
+    from recommenders import lazy
+    from recommenders.lazy import collab_model, content_model, hybrid_model
 
 # image
 from PIL import Image
@@ -43,6 +56,70 @@ from PIL import Image
 # Data Loading
 title_list = load_movie_titles('resources/data/movies.csv')
 
+
+def movie_picker(label, key):
+    """Type-ahead movie selection over the full catalogue."""
+    query = st.text_input(label, key=key,
+                          placeholder='Type a title, e.g. matrix 1999')
+    # Built on first use, then shared by all sessions of the process
+    title_index = load_title_index('resources/data/movies.csv')
+    matches = title_index.search(query, limit=50) if query else []
+    if not matches:
+        if query:
+            st.caption('No matching movies.')
+        return None
+    return st.selectbox(label, matches, key=key + '_choice',
+                        label_visibility='collapsed')
+
+def performance_page():
+    """Stage timings, cache hit rates and memory of recent requests."""
+    st.write('# Performance')
+    if recommender_service is not None:
+        st.write('#### Metrics of the recommendation service')
+        st.caption('Recorded when the service runs with RECOMMENDER_METRICS=1.')
+        snapshot = recommender_service.metrics()
+    else:
+        st.write('#### Where the time of recent recommendations went')
+        # The metrics are process-wide, so no single session may switch them
+        st.caption('Metrics are shared by every session of this app process '
+                   'and recorded when it runs with RECOMMENDER_METRICS=1 '
+                   '(currently {}).'.format('on' if metrics.enabled else 'off'))
+        if st.button('Reset for all sessions'):
+            metrics.reset()
+        snapshot = metrics.snapshot()
+
+    memory = snapshot['memory']
+    col1, col2, col3 = st.columns(3)
+    col1.metric('Resident memory', '{:.0f} MB'.format(memory['rss_mb'] or 0))
+    col2.metric('Peak memory', '{:.0f} MB'.format(memory['peak_rss_mb']))
+    col3.metric('Traced requests', len(snapshot['requests']))
+    if recommender_service is None and lazy.load_times:
+        st.write('### Engine load times (s)')
+        st.dataframe(pd.DataFrame({'seconds': lazy.load_times}))
+
+    requests = snapshot['requests']
+    if requests:
+        st.write('### Recent requests')
+        st.dataframe(pd.DataFrame({
+            'time': pd.to_datetime([r['time'] for r in requests], unit='s'),
+            'request': [r['name'] for r in requests],
+            'ms': [1000 * r['seconds'] for r in requests],
+            'memory (MB)': [r['rss_mb'] for r in requests],
+            'error': [r.get('error', '') for r in requests]}))
+        st.write('### Stage breakdown (ms)')
+        breakdown = pd.DataFrame([r['stages'] for r in requests]).fillna(0) * 1000
+        breakdown.index = ['{} #{}'.format(r['name'], len(requests) - i)
+                           for i, r in enumerate(requests)]
+        st.bar_chart(breakdown)
+    if snapshot['hit_rates']:
+        st.write('### Cache hit rates')
+        st.dataframe(pd.DataFrame({'hit rate': snapshot['hit_rates']}))
+    if snapshot['stages']:
+        st.write('### All stages')
+        st.dataframe(pd.DataFrame.from_dict(snapshot['stages'], orient='index'))
+    if not requests and not snapshot['stages']:
+        st.write('No metrics recorded yet: ask for some recommendations.')
+
 # App declaration
 
 
@@ -50,7 +127,8 @@ def main():
 
     # DO NOT REMOVE the 'Recommender System' option below, however,
     # you are welcome to add more options to enrich your app.
-    page_options = ["Recommender System", "Solution Overview", "About Us"]
+    page_options = ["Recommender System", "Hybrid Recommender",
+                    "Performance", "Solution Overview", "About Us"]
     st.sidebar.write("## Autonomous Insights")
     image = Image.open("./resources/imgs/logo-bg.png")
     st.sidebar.image(image, width=200)
@@ -110,6 +188,35 @@ def main():
     # -------------------------------------------------------------------
 
     # ------------- SAFE FOR ALTERING/EXTENSION -------------------
+    if page_selection == "Hybrid Recommender":
+        st.write('# Hybrid Recommender')
+        st.write('#### Content and collaborative recommendations, blended')
+        content_weight = st.slider('Content weight (collaborative gets the rest)',
+                                   0.0, 1.0, 0.5, 0.05)
+        st.write('### Search For Your Three Favorite Movies')
+        fav_movies = [movie_picker('First Option', 'hybrid_movie_1'),
+                      movie_picker('Second Option', 'hybrid_movie_2'),
+                      movie_picker('Third Option', 'hybrid_movie_3')]
+        if st.button("Recommend"):
+            try:
+                if None in fav_movies:
+                    raise ValueError('Please choose three movies.')
+                with st.spinner('Crunching the numbers...'):
+                    top_recommendations = hybrid_model(
+                        movie_list=fav_movies, top_n=10,
+                        weights={'content': content_weight,
+                                 'collab': 1.0 - content_weight})
+                st.title("We think you'll like:")
+                for i, j in enumerate(top_recommendations):
+                    st.subheader(str(i+1)+'. '+j)
+            except Exception as e:
+                st.error("Oops! Looks like this algorithm does't work.\
+                          We'll need to fix it!")
+                st.error(f"Error: {e}")
+
+    if page_selection == "Performance":
+        performance_page()
+
     if page_selection == "Solution Overview":
         st.title("Solution Overview")
         # st.write("Describe your winning approach on this page")
@@ -256,6 +363,10 @@ def main():
 
         st.write("Our website - autonomousinsights.com")
 
+    # Load the engines once the page is out (see RECOMMENDER_STARTUP)
+    if recommender_service is None:
+        lazy.start()
+
 
 if __name__ == '__main__':
     main()
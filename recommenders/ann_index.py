@@ -0,0 +1,272 @@
+"""
+
+    Approximate nearest-neighbour index over SVD item factors.
+
+    Author: Explore Data Science Academy.
+
+    Description: A pure NumPy inverted-file (IVF) index. Item vectors are
+    clustered with k-means into `n_lists` cells; a query is scored against
+    the cell centroids and only the items of the `nprobe` best cells are
+    scored exactly. `nprobe` trades recall for latency: probing every cell
+    is exact brute force. The index supports batch queries, inner-product
+    (user-to-item) and cosine (item-to-item) retrieval, persistence as
+    memory-mappable columns, and a recall-vs-brute-force report.
+
+    Usage (from the repository root):
+
+        python -m recommenders.ann_index --queries 500 --k 10
+
+"""
+# Script dependencies
+import argparse
+import time
+import numpy as np
+from utils.columnar import load_columns, save_columns
+
+class IVFIndex:
+    """Inverted-file index over a set of item vectors.
+
+    Parameters
+    ----------
+    vectors : numpy.ndarray
+        (n, d) item vectors, already transformed for the metric.
+    centroids : numpy.ndarray
+        (n_lists, d) cell centroids.
+    list_offsets : numpy.ndarray
+        Cell `c` holds `list_items[list_offsets[c]:list_offsets[c + 1]]`.
+    list_items : numpy.ndarray
+        Item rows grouped by cell.
+    metric : str
+        'ip' (inner product) or 'cosine'.
+
+    """
+
+    def __init__(self, vectors, centroids, list_offsets, list_items, metric='ip'):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_items = list_items
+        self.metric = metric
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, metric='ip', n_iter=10, seed=0):
+        """Cluster item vectors into an IVF index.
+
+        Parameters
+        ----------
+        vectors : numpy.ndarray
+            (n, d) item vectors.
+        n_lists : int, optional
+            Number of cells; defaults to about sqrt(n).
+        metric : str
+            'ip' for maximum inner product, 'cosine' for cosine similarity
+            (vectors are L2-normalised).
+        n_iter : int
+            k-means iterations.
+        seed : int
+            Seed of the centroid initialisation.
+
+        Returns
+        -------
+        IVFIndex
+            The built index.
+
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if metric == 'cosine':
+            vectors = _normalise(vectors)
+        n = vectors.shape[0]
+        n_lists = max(1, min(n, n_lists or int(round(np.sqrt(n)))))
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)].copy()
+        sq_norms = np.einsum('ij,ij->i', vectors, vectors)
+        for _ in range(n_iter):
+            assign = _nearest(vectors, sq_norms, centroids)
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            if metric == 'cosine':
+                # Spherical k-means: cells are scored by cosine at query time
+                centroids = _normalise(centroids)
+        assign = _nearest(vectors, sq_norms, centroids)
+        list_items = np.argsort(assign, kind='stable').astype(np.int32)
+        list_offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=list_offsets[1:])
+        return cls(vectors, centroids, list_offsets, list_items, metric)
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    def search(self, queries, k=10, nprobe=8, exclude=None):
+        """Approximate top-k items for a batch of queries.
+
+        Parameters
+        ----------
+        queries : numpy.ndarray
+            (q, d) query vectors, or a single (d,) vector.
+        k : int
+            Results per query.
+        nprobe : int
+            Cells scored per query; `n_lists` gives exact search.
+        exclude : list, optional
+            Per query, item rows never returned.
+
+        Returns
+        -------
+        tuple
+            (q, k) item rows, best first and -1 padded, and their scores.
+
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == 'cosine':
+            queries = _normalise(queries)
+        nprobe = max(1, min(nprobe, self.n_lists))
+        cells = np.argpartition(-(queries @ self.centroids.T), nprobe - 1,
+                                axis=1)[:, :nprobe]
+        ids = np.full((queries.shape[0], k), -1, dtype=np.int64)
+        scores = np.full((queries.shape[0], k), -np.inf, dtype=np.float32)
+        for q, query in enumerate(queries):
+            candidates = np.concatenate([
+                self.list_items[self.list_offsets[c]:self.list_offsets[c + 1]]
+                for c in cells[q]])
+            if exclude is not None and len(exclude[q]):
+                candidates = candidates[~np.isin(candidates, exclude[q])]
+            if candidates.size == 0:
+                continue
+            sims = self.vectors[candidates] @ query
+            n = min(k, candidates.size)
+            top = np.argpartition(-sims, n - 1)[:n]
+            top = top[np.argsort(-sims[top], kind='stable')]
+            ids[q, :n] = candidates[top]
+            scores[q, :n] = sims[top]
+        return ids, scores
+
+    def brute_force(self, queries, k=10):
+        """Exact top-k by scoring every item (the recall reference)."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if self.metric == 'cosine':
+            queries = _normalise(queries)
+        sims = queries @ self.vectors.T
+        k = min(k, sims.shape[1])
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1,
+                           kind='stable')
+        return np.take_along_axis(top, order, axis=1)
+
+    def save(self, directory):
+        """Write the index as `.npy` columns."""
+        save_columns(directory, {'vectors': self.vectors,
+                                 'centroids': self.centroids,
+                                 'list_offsets': self.list_offsets,
+                                 'list_items': self.list_items,
+                                 'metric': np.array(self.metric)})
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """Open an index written by `save`, memory-mapped by default."""
+        columns = load_columns(directory, mmap_mode=mmap_mode)
+        return cls(columns['vectors'], columns['centroids'],
+                   columns['list_offsets'], columns['list_items'],
+                   str(columns['metric']))
+
+def _normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def _nearest(vectors, sq_norms, centroids):
+    """Index of the nearest centroid (squared L2) of every vector."""
+    distances = (sq_norms[:, None] - 2 * vectors @ centroids.T
+                 + np.einsum('ij,ij->i', centroids, centroids)[None, :])
+    return distances.argmin(axis=1)
+
+def item_vectors(factors, metric='ip'):
+    """Item vectors of a `FactorModel` for an index of the given metric.
+
+    For 'ip' the item bias is appended, so that a user query
+    `[pu, 1]` ranks items exactly like the SVD estimate. For 'cosine'
+    the raw item factors are used.
+
+    """
+    qi = np.asarray(factors.qi[:-1], dtype=np.float32)
+    if metric == 'ip':
+        bi = np.asarray(factors.bi[:-1], dtype=np.float32)
+        return np.hstack([qi, bi[:, None]])
+    return qi
+
+def user_query(pu):
+    """Inner-product query vector of a user's factors (see `item_vectors`)."""
+    return np.append(np.asarray(pu, dtype=np.float32), np.float32(1))
+
+def recall_report(index, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+    """Recall and latency of `index.search` against brute force.
+
+    Parameters
+    ----------
+    index : IVFIndex
+        Index to evaluate.
+    queries : numpy.ndarray
+        (q, d) query vectors.
+    k : int
+        Results per query.
+    nprobes : iterable (int)
+        Settings of `nprobe` to report.
+
+    Returns
+    -------
+    list (dict)
+        Per setting: nprobe, mean recall@k and mean latency per query
+        (ms), plus a brute-force row.
+
+    """
+    start = time.perf_counter()
+    exact = index.brute_force(queries, k)
+    brute_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        start = time.perf_counter()
+        found, _ = index.search(queries, k, nprobe)
+        ms = 1000 * (time.perf_counter() - start) / len(queries)
+        hits = [np.intersect1d(f, e).size for f, e in zip(found, exact)]
+        report.append({'nprobe': nprobe, 'recall': float(np.mean(hits)) / k,
+                       'ms_per_query': ms})
+    report.append({'nprobe': 'brute force', 'recall': 1.0,
+                   'ms_per_query': brute_ms})
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='IVF index recall report.')
+    parser.add_argument('--metric', choices=['ip', 'cosine'], default='ip')
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--save', default=None,
+                        help='Optional directory to write the index to.')
+    args = parser.parse_args(argv)
+
+    from recommenders.model_registry import svd_registry
+    factors = svd_registry.factors()
+    start = time.perf_counter()
+    index = IVFIndex.build(item_vectors(factors, args.metric), args.n_lists,
+                           args.metric)
+    print(f"Built {index.n_lists} lists over {index.vectors.shape[0]} items "
+          f"in {time.perf_counter() - start:.2f}s")
+    rng = np.random.default_rng(0)
+    if args.metric == 'ip':
+        users = rng.integers(0, factors.n_users, args.queries)
+        queries = np.hstack([factors.pu[users],
+                             np.ones((args.queries, 1))]).astype(np.float32)
+    else:
+        queries = index.vectors[rng.integers(0, index.vectors.shape[0], args.queries)]
+    print('nprobe       recall@{}  ms/query'.format(args.k))
+    for row in recall_report(index, queries, args.k):
+        print('{nprobe!s:<12} {recall:8.3f}  {ms_per_query:8.3f}'.format(**row))
+    if args.save:
+        index.save(args.save)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+"""
+
+    Batch recommendations for large lists of favourite movies.
+
+    Author: Explore Data Science Academy.
+
+    Description: Reads a file of movie lists (e.g. the favourite-triples
+    of an email campaign or A/B cohort), drops duplicate lists (order of
+    the titles does not matter, as for the result cache), and scores the
+    distinct lists in chunks across a process pool. Each chunk is scored
+    with one call of the algorithm's batch function where it has one
+    (e.g. all users of a collab chunk are scored in one matrix product).
+    The SVD factors are published once as memory-mapped columns (see
+    `recommenders.model_registry`), so every worker shares one read-only
+    page-cache copy of the model; on platforms that fork, the parsed
+    catalogue and indexes are also inherited copy-on-write. Results are
+    streamed to CSV or JSONL as chunks complete, with progress and
+    throughput reported on stderr.
+
+    Input formats (by extension):
+      - `.jsonl`: one JSON list of titles, or an object with a `movies`
+        list, per line.
+      - `.csv`: one list per row, one title per column (quote titles that
+        contain commas); an optional header row starting with `movie`
+        is skipped.
+
+    Usage (from the repository root):
+
+        python -m recommenders.batch lists.csv recommendations.jsonl \\
+            --algorithm content --top-n 10 --workers 4
+
+"""
+# Script dependencies
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+SHARED_ROOT = 'resources/models/shared'
+CHUNK_SIZE = 64
+
+# Recommenders available to batches, as (module, function, batch function)
+ALGORITHMS = {
+    'content': ('recommenders.content_based', 'content_model', 'content_model_batch'),
+    'collab': ('recommenders.collaborative_based', 'collab_model', 'collab_model_batch'),
+    'hybrid': ('recommenders.hybrid', 'hybrid_model', None),
+}
+
+# Per-worker state, set up once by `_init_worker`
+_worker = {}
+
+def read_movie_lists(path):
+    """Yield the movie lists of a CSV or JSONL file.
+
+    Parameters
+    ----------
+    path : str
+        Input file; `.jsonl`/`.json` files are read as JSON lines,
+        anything else as CSV.
+
+    Yields
+    ------
+    list (str)
+        Titles of one list, blanks removed.
+
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.json')):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    movies = record['movies'] if isinstance(record, dict) else record
+                    yield [title for title in movies if title]
+        else:
+            for i, row in enumerate(csv.reader(f)):
+                if i == 0 and row and row[0].strip().lower().startswith('movie'):
+                    continue
+                movies = [title.strip() for title in row if title.strip()]
+                if movies:
+                    yield movies
+
+def deduplicate(movie_lists):
+    """Distinct movie lists, ignoring title order.
+
+    Parameters
+    ----------
+    movie_lists : iterable (list)
+        Movie lists, possibly repeated.
+
+    Returns
+    -------
+    tuple
+        The first-seen occurrence of each distinct list, with its titles
+        in their input order, and how often each occurred.
+
+    """
+    first, counts = {}, {}
+    for movies in movie_lists:
+        key = tuple(sorted(movies))
+        if key not in first:
+            first[key] = list(movies)
+        counts[key] = counts.get(key, 0) + 1
+    return list(first.values()), list(counts.values())
+
+def load_algorithm(name):
+    """The uncached `*_model(movie_list, top_n)` function of an algorithm.
+
+    Returns
+    -------
+    tuple
+        The function and the algorithm's `*_model_batch(movie_lists,
+        top_n)` function, or None if it has none.
+
+    """
+    import importlib
+    module_name, function, batch_function = ALGORITHMS[name]
+    module = importlib.import_module(module_name)
+    model = getattr(module, function)
+    # Lists are already distinct, so the result cache would only fill up
+    return (getattr(model, 'uncached', model),
+            batch_function and getattr(module, batch_function))
+
+def _init_worker(algorithm):
+    _worker['model'], _worker['batch'] = load_algorithm(algorithm)
+
+def _score_chunk(chunk, top_n):
+    model, batch = _worker['model'], _worker['batch']
+    if batch is not None:
+        try:
+            found = batch([list(movies) for movies in chunk], top_n)
+            return [(list(movies), titles, None) for movies, titles in zip(chunk, found)]
+        except Exception:
+            # Scored one by one below, so only the failing lists report errors
+            pass
+    results = []
+    for movies in chunk:
+        try:
+            results.append((list(movies), model(list(movies), top_n), None))
+        except Exception as error:
+            results.append((list(movies), None, repr(error)))
+    return results
+
+class ResultWriter:
+    """Stream batch results to a CSV or JSONL file.
+
+    CSV rows hold the input titles joined by '|', the number of times the
+    list occurred in the input, the recommendations joined by '|' and any
+    error; JSONL records hold the same fields as lists.
+
+    """
+
+    def __init__(self, path):
+        self.jsonl = path.endswith(('.jsonl', '.json'))
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        if not self.jsonl:
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(['movies', 'count', 'recommendations', 'error'])
+
+    def write(self, movies, count, recommendations, error):
+        if self.jsonl:
+            self._file.write(json.dumps({'movies': movies, 'count': count,
+                                         'recommendations': recommendations,
+                                         'error': error}) + '\n')
+        else:
+            self._csv.writerow(['|'.join(movies), count,
+                                '|'.join(recommendations or []), error or ''])
+
+    def close(self):
+        self._file.close()
+
+def run_batch(movie_lists, output_path, algorithm='content', top_n=10,
+              workers=None, chunk_size=CHUNK_SIZE, report_every=5.0):
+    """Score movie lists on a process pool and stream the results.
+
+    Parameters
+    ----------
+    movie_lists : iterable (list)
+        Movie lists to score; duplicates are scored once.
+    output_path : str
+        CSV or JSONL destination.
+    algorithm : str
+        Key of `ALGORITHMS`.
+    top_n : int
+        Recommendations per list.
+    workers : int, optional
+        Pool size; defaults to the number of cores. With 1, lists are
+        scored in this process.
+    chunk_size : int
+        Lists per task, amortising inter-process overhead.
+    report_every : float
+        Seconds between progress lines on stderr.
+
+    Returns
+    -------
+    dict
+        Input, distinct and failed list counts, wall-clock seconds and
+        throughput (distinct lists per second).
+
+    """
+    start = time.perf_counter()
+    movie_lists = list(movie_lists)
+    distinct, counts = deduplicate(movie_lists)
+    count_of = {tuple(movies): count for movies, count in zip(distinct, counts)}
+    chunks = [distinct[i:i + chunk_size] for i in range(0, len(distinct), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    writer = ResultWriter(output_path)
+    done = failed = 0
+    last_report = time.perf_counter()
+
+    def collect(results):
+        nonlocal done, failed, last_report
+        for movies, recommendations, error in results:
+            writer.write(movies, count_of[tuple(movies)], recommendations, error)
+            failed += error is not None
+        done += len(results)
+        now = time.perf_counter()
+        if now - last_report >= report_every or done == len(distinct):
+            last_report = now
+            print('{}/{} lists ({:.1f} lists/s)'.format(
+                done, len(distinct), done / (now - start)),
+                file=sys.stderr, flush=True)
+
+    try:
+        if workers == 1:
+            _init_worker(algorithm)
+            for chunk in chunks:
+                collect(_score_chunk(chunk, top_n))
+        else:
+            # Load the engines before forking, so children inherit them
+            if 'fork' in multiprocessing.get_all_start_methods():
+                load_algorithm(algorithm)
+                context = multiprocessing.get_context('fork')
+            else:
+                context = None
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                     initializer=_init_worker,
+                                     initargs=(algorithm,)) as pool:
+                # Keep a bounded number of chunks in flight
+                pending, queued = set(), iter(chunks)
+                for chunk in queued:
+                    pending.add(pool.submit(_score_chunk, chunk, top_n))
+                    if len(pending) >= 2 * workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for task in finished:
+                            collect(task.result())
+                for task in wait(pending).done:
+                    collect(task.result())
+    finally:
+        writer.close()
+    seconds = time.perf_counter() - start
+    return {'lists': len(movie_lists), 'distinct': len(distinct),
+            'failed': failed, 'seconds': seconds,
+            'lists_per_second': len(distinct) / seconds if seconds else 0.0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch movie recommendations.')
+    parser.add_argument('input', help='CSV or JSONL file of movie lists.')
+    parser.add_argument('output', help='CSV or JSONL destination.')
+    parser.add_argument('--algorithm', choices=sorted(ALGORITHMS), default='content')
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--shared-dir', default=None,
+                        help='Memory-mapped model artifact root shared by the '
+                             'workers (default: $RECOMMENDER_SHARED_DIR or '
+                             f'{SHARED_ROOT}).')
+    args = parser.parse_args(argv)
+
+    # Must be set before the model registry is imported
+    os.environ['RECOMMENDER_SHARED_DIR'] = (
+        args.shared_dir or os.environ.get('RECOMMENDER_SHARED_DIR') or SHARED_ROOT)
+    if args.algorithm != 'content':
+        # Publish the shared factors once, before the workers open them
+        from recommenders.model_registry import svd_registry
+        svd_registry.factors()
+    report = run_batch(read_movie_lists(args.input), args.output,
+                       args.algorithm, args.top_n, args.workers, args.chunk_size)
+    print('Scored {distinct} distinct of {lists} lists ({failed} failed) '
+          'in {seconds:.1f}s: {lists_per_second:.1f} lists/s'.format(**report))
+
+if __name__ == '__main__':
+    main()
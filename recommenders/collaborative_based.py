@@ -32,18 +32,354 @@ import pandas as pd
 import numpy as np
 import pickle
 import copy
-from surprise import Reader, Dataset
+import os
+from concurrent.futures import ThreadPoolExecutor
+from scipy import sparse
+from surprise import Reader, Dataset, Prediction
 from surprise import SVD, NormalPredictor, BaselineOnly, KNNBasic, NMF
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
-
-# Importing data
-movies_df = pd.read_csv('resources/data/movies.csv',sep = ',')
-ratings_df = pd.read_csv('resources/data/ratings.csv')
+from recommenders.factor_model import FactorModel, top_n_indices
+from recommenders.model_registry import svd_registry
+from recommenders.fold_in import recommend_for_ratings
+from recommenders.neighbours import neighbour_tables
+from recommenders.popularity import popularity_tables
+from recommenders.ann_index import IVFIndex, item_vectors
+from utils.metrics import metrics
+from utils.result_cache import cached_recommender, recommendation_cache
+from utils.ratings_matrix import load_ratings_matrix
+from utils.data_store import file_hash, load_ratings
+from utils.title_index import load_title_index
+
+MOVIES_PATH = 'resources/data/movies.csv'
+
+# Importing data (shared, read-only frame)
+ratings_df = load_ratings('resources/data/ratings.csv')
 # ratings_df.drop(['timestamp'], axis=1,inplace=True)
 
-# We make use of an SVD model trained on a subset of the MovieLens 10k dataset.
-# model=pickle.load(open('resources/models/SVD.pkl', 'rb'))
+# (title index, unique titles, their movie IDs, movie ID to title)
+_catalogue = (None, None, None, None)
+
+def collab_catalogue():
+    """Title lookups of the current catalogue, rebuilt when it changes.
+
+    Like `content_catalogue` they follow `movies.csv` through the data
+    store, so both recommenders serve the same catalogue.
+
+    Returns
+    -------
+    tuple
+        The catalogue's `TitleIndex` (titles are resolved through it in
+        O(1)), an object array of its unique titles, the MovieLens ID of
+        each title's first occurrence and a dict of movie ID to title.
+
+    """
+    global _catalogue
+    title_index = load_title_index(MOVIES_PATH)
+    if _catalogue[0] is not title_index:
+        with metrics.stage('collab.catalogue'):
+            titles = np.array(title_index.titles, dtype=object)
+            _catalogue = (
+                title_index, titles[title_index.first_rows],
+                title_index.movie_ids[title_index.first_rows].astype(np.int64),
+                dict(zip(title_index.movie_ids.tolist(), title_index.titles)))
+    return _catalogue
+
+# Building the title lookups at import, so the first request does not pay
+# for them
+collab_catalogue()
+
+def titles_for(movie_ids):
+    """Titles of some MovieLens IDs, skipping IDs not in the catalogue.
+
+    Artifacts built from another catalogue may hold unknown IDs.
+    """
+    movie_id_to_title = collab_catalogue()[3]
+    return [movie_id_to_title[i] for i in np.asarray(movie_ids).tolist()
+            if i in movie_id_to_title]
+
+# How collab_model finds recommendations: 'neighbours' scores movies for
+# dataset users similar to the app user, 'item_neighbours' merges the
+# favourites' item-factor neighbours from the precomputed neighbour tables
+# (see `recommenders.neighbours`; 'neighbours' is used while no table
+# matching the served model and catalogue is published),
+# 'fold_in' solves a latent vector for the app user from their favourites,
+# 'ann_items' retrieves the movies closest to the favourites' item factors,
+# 'item_knn' sums the favourites' rows of an item-item similarity matrix.
+COLLAB_STRATEGY = 'neighbours'
+# Whether 'fold_in' retrieves candidates through the approximate index,
+# and how many of its cells are probed per query ('ann_items' probes more:
+# cosine cells over item factors are less selective than inner-product ones)
+USE_ANN = False
+ANN_NPROBE = 8
+ANN_ITEM_NPROBE = 32
+# Number of best-scored movies (see `recommenders.popularity`) scored in
+# full by the 'neighbours' strategy; None scores every movie
+CANDIDATE_POOL = 5000
+
+# We make use of an SVD model trained on a subset of the MovieLens 10k dataset,
+# served through `recommenders.model_registry.svd_registry`.
+
+# Number of leading ratings whose users are candidate neighbours
+PREDICTION_SUBSET = 20000
+
+# Per-process caches of the prediction trainset and model factors
+_prediction_cache = {}
+_factor_cache = {}
+
+def prediction_trainset(ratings_df):
+    """Build (once per ratings frame) the trainset of candidate users.
+
+    Parameters
+    ----------
+    ratings_df : Pandas Dataframe
+        MovieLens ratings with `userId`, `movieId` and `rating` columns.
+
+    Returns
+    -------
+    tuple
+        The Surprise trainset built from the first `PREDICTION_SUBSET`
+        ratings, and an array of its raw user IDs in inner-id order.
+    """
+    cached = _prediction_cache.get(id(ratings_df))
+    if cached is not None and cached[0] is ratings_df:
+        metrics.count('collab.trainset.hit')
+        return cached[1], cached[2]
+    metrics.count('collab.trainset.miss')
+    with metrics.stage('collab.build_trainset'):
+        tests = ratings_df[['userId', 'movieId', 'rating']].head(PREDICTION_SUBSET)
+        reader = Reader(rating_scale=(0.5, 5))
+        a_train = Dataset.load_from_df(tests, reader).build_full_trainset()
+        users = np.array([a_train.to_raw_uid(ui) for ui in a_train.all_users()],
+                         dtype=np.int64)
+    _prediction_cache[id(ratings_df)] = (ratings_df, a_train, users)
+    return a_train, users
+
+def model_factors(model):
+    """Return the cached `FactorModel` view of a trained SVD model."""
+    if isinstance(model, FactorModel):
+        return model
+    cached = _factor_cache.get(id(model))
+    if cached is None or cached[0] is not model:
+        _factor_cache.clear()
+        cached = (model, FactorModel.from_surprise(model))
+        _factor_cache[id(model)] = cached
+    return cached[1]
+
+_ann_cache = {}
+
+def ann_index(metric='ip'):
+    """Approximate index over the served model's item factors.
+
+    Built on first use and rebuilt whenever the registry serves a new
+    model.
+
+    Parameters
+    ----------
+    metric : str
+        'ip' for user-to-item, 'cosine' for item-to-item retrieval.
+
+    Returns
+    -------
+    IVFIndex
+        Index whose rows are the model's inner item ids.
+    """
+    key = (svd_registry.model_key(), metric)
+    index = _ann_cache.get(key)
+    if index is None:
+        factors = svd_registry.factors()
+        index = IVFIndex.build(item_vectors(factors, metric), metric=metric)
+        _ann_cache.clear()
+        _ann_cache[key] = index
+    return index
+
+def ann_similar_items(movie_list, top_n=10):
+    """Recommend the movies nearest to the favourites' item factors.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+    """
+    factors = svd_registry.factors()
+    items = factors.item_index(movie_ids_for(movie_list))
+    items = items[items >= 0]
+    if items.size == 0:
+        return []
+    index = ann_index('cosine')
+    query = index.vectors[items].sum(axis=0)
+    found, _ = index.search(query, top_n, ANN_ITEM_NPROBE, exclude=[items])
+    found = found[0][found[0] >= 0]
+    return titles_for(factors.item_raw_ids[found])
+
+def build_item_similarities(ratings, k=50, block_size=256, workers=None):
+    """Top-k mean-centred cosine similarities between all rated items.
+
+    Ratings are centred on each user's mean (adjusted cosine), item
+    vectors are L2-normalised, and similarities are computed for blocks
+    of item rows on a thread pool (SciPy's sparse products release the
+    GIL). Only the k most similar positive neighbours of each item are
+    kept, so memory is bounded by block_size x n_items floats during the
+    build and n_items x k entries afterwards.
+
+    Parameters
+    ----------
+    ratings : RatingsMatrix
+        Sparse user-item ratings.
+    k : int
+        Neighbours kept per item.
+    block_size : int
+        Item rows per block.
+    workers : int, optional
+        Threads; defaults to the number of cores.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (n_items, n_items) float32 similarities in the ratings matrix's
+        column order.
+    """
+    csr = ratings.csr.astype(np.float32)
+    counts = np.diff(csr.indptr)
+    means = np.asarray(csr.sum(axis=1)).ravel() / np.maximum(counts, 1)
+    csr.data -= np.repeat(means, counts).astype(np.float32)
+    items = csr.T.tocsr()
+    norms = np.sqrt(np.asarray(items.multiply(items).sum(axis=1)).ravel())
+    items = sparse.diags(np.divide(1, norms, out=np.zeros_like(norms),
+                                   where=norms > 0)) @ items
+    items = items.astype(np.float32).tocsr()
+    users = items.T.tocsr()
+    n = items.shape[0]
+    k = min(k, n - 1)
+    indices = np.full((n, k), -1, dtype=np.int32)
+    data = np.zeros((n, k), dtype=np.float32)
+
+    def run(start):
+        stop = min(start + block_size, n)
+        sims = (items[start:stop] @ users).toarray()
+        rows = np.arange(stop - start)
+        sims[rows, rows + start] = 0
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        top[top_sims <= 0] = -1
+        indices[start:stop] = top
+        data[start:stop] = np.maximum(top_sims, 0)
+
+    if k > 0:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(run, range(0, n, block_size)))
+    keep = indices >= 0
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(keep.sum(axis=1), out=indptr[1:])
+    similarities = sparse.csr_matrix((data[keep], indices[keep], indptr),
+                                     shape=(n, n))
+    similarities.sort_indices()
+    return similarities
+
+_item_knn = {}
+
+def item_knn_model(path='resources/data/ratings.csv', k=50):
+    """Ratings matrix and item similarities, built once per ratings file.
+
+    Parameters
+    ----------
+    path : str
+        Ratings CSV.
+    k : int
+        Neighbours kept per item.
+
+    Returns
+    -------
+    tuple
+        The `RatingsMatrix` and its item similarity matrix.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, k)
+    model = _item_knn.get(key)
+    if model is None:
+        ratings = load_ratings_matrix(path)
+        model = (ratings, build_item_similarities(ratings, k))
+        _item_knn.clear()
+        _item_knn[key] = model
+    return model
+
+def item_knn_recommendations(movie_list, top_n=10):
+    """Recommend movies by summing the favourites' item-similarity rows.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+    """
+    ratings, similarities = item_knn_model()
+    items = ratings.item_index(movie_ids_for(movie_list))
+    items = items[items >= 0]
+    rows = similarities[items]
+    keep = ~np.isin(rows.indices, items)
+    candidates, weights = rows.indices[keep], rows.data[keep]
+    if candidates.size == 0:
+        return []
+    unique, inverse = np.unique(candidates, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights)
+    top = unique[top_n_indices(totals, top_n)]
+    return titles_for(ratings.item_ids[top])
+
+def movie_ids_for(movie_list):
+    """Map titles (or MovieLens IDs) to MovieLens IDs, -1 when unknown."""
+    title_index = collab_catalogue()[0]
+    return np.array([i if isinstance(i, (int, np.integer))
+                     else title_index.movie_id(i) for i in movie_list],
+                    dtype=np.int64)
+
+def best_users_for_items(item_ids, model, ratings_df, n=10):
+    """Find the candidate users with the highest predicted rating for each item.
+
+    All candidate users are scored against all items in one vectorized
+    operation.
+
+    Parameters
+    ----------
+    item_ids : array-like (int)
+        MovieLens Movie IDs.
+    model : surprise.SVD or FactorModel
+        Trained SVD model.
+    ratings_df : Pandas Dataframe
+        Ratings from which candidate users are drawn.
+    n : int
+        Number of users to return per item.
+
+    Returns
+    -------
+    tuple
+        Array of shape (len(item_ids), n) of raw user IDs, best first, and
+        the matching array of predicted ratings.
+    """
+    factors = model_factors(model)
+    _, users = prediction_trainset(ratings_df)
+    n = min(n, users.shape[0])
+    if n <= 0:
+        # No candidate users (or none requested): nothing to rank
+        shape = (len(item_ids), 0)
+        return np.empty(shape, dtype=users.dtype), np.empty(shape, dtype=factors.qi.dtype)
+    est = factors.score(factors.user_index(users),
+                        factors.item_index(item_ids)).T
+    top = np.argpartition(-est, n - 1, axis=1)[:, :n]
+    top_est = np.take_along_axis(est, top, axis=1)
+    order = np.argsort(-top_est, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    return users[top], np.take_along_axis(top_est, order, axis=1)
 
 def prediction_item(item_id, model, ratings_df):
     """Map a given favourite movie to users within the MovieLens dataset with the same preference.
@@ -56,21 +392,14 @@ def prediction_item(item_id, model, ratings_df):
     Returns
     -------
     list
-        User IDs of users with similar high ratings for the given movie.
-    """
-    # Data preprosessing
-    tests = ratings_df.copy()
-    tests.drop(['timestamp'], axis=1, inplace=True)
-    tests = tests.head(20000)
-    
-    reader = Reader(rating_scale=(0.5, 5))
-    load_df = Dataset.load_from_df(tests[['userId', 'movieId', 'rating']], reader)
-    a_train = load_df.build_full_trainset()
-
-    predictions = []
-    for ui in a_train.all_users():
-        predictions.append(model.predict(iid=item_id,uid=ui, verbose=False))
-    return predictions
+        Predictions of the given movie for every candidate user.
+    """
+    factors = model_factors(model)
+    _, users = prediction_trainset(ratings_df)
+    est = factors.score(factors.user_index(users),
+                        factors.item_index([item_id]))[:, 0]
+    return [Prediction(uid, item_id, None, r, {})
+            for uid, r in zip(users.tolist(), est.tolist())]
 
 def pred_movies(movie_list, model, ratings_df):
     """Maps the given favourite movies selected within the app to corresponding users within the MovieLens dataset.
@@ -85,74 +414,255 @@ def pred_movies(movie_list, model, ratings_df):
     list
         User-ID's of users with similar high ratings for each movie.
     """
-    # Store the id of users
-    id_store=[]
-    # For each movie selected by a user of the app,
-    # predict a corresponding user within the dataset with the highest rating
-    for i in movie_list:
-        predictions = prediction_item(item_id=i, model=model, ratings_df=ratings_df)
-        predictions.sort(key=lambda x: x.est, reverse=True)
-        # Take the top 10 user id's from each movie with highest rankings
-        for pred in predictions[:10]:
-            id_store.append(pred.uid)
+    # Take the top 10 user id's from each movie with highest rankings
+    top_users, _ = best_users_for_items(movie_ids_for(movie_list), model,
+                                        ratings_df, n=10)
     # Return a list of user id's
-    return id_store
+    return top_users.ravel().tolist()
 
-def collab_model(movie_list,top_n=10):
-    """Performs Collaborative filtering based upon a list of movies supplied
-       by the app user.
+def fold_in_recommendations(movie_list, top_n=10):
+    """Recommend movies by folding the app user into the SVD model.
+
+    The favourites are treated as top-of-scale ratings, the user's latent
+    vector is solved against the frozen item factors, and every movie is
+    scored with a single matrix-vector product.
 
     Parameters
     ----------
     movie_list : list (str)
         Favorite movies chosen by the app user.
-    top_n : type
+    top_n : int
         Number of top recommendations to return to the user.
 
     Returns
     -------
     list (str)
         Titles of the top-n movie recommendations to the user.
-
     """
+    factors = svd_registry.factors()
+    movie_ids = movie_ids_for(movie_list)
+    ratings = np.full(movie_ids.shape, factors.rating_scale[1])
+    index = ann_index('ip') if USE_ANN else None
+    recommended_ids, _ = recommend_for_ratings(factors, movie_ids, ratings,
+                                               top_n + len(movie_list),
+                                               index=index, nprobe=ANN_NPROBE)
+    titles = titles_for(recommended_ids)
+    return [t for t in titles if t not in movie_list][:top_n]
+
+_candidate_cache = {}
+
+def candidate_positions(catalogue=None):
+    """Positions among the catalogue's unique titles (see `collab_catalogue`)
+    of the `CANDIDATE_POOL` best-scored movies."""
+    title_index, title_array, title_movie_ids, _ = catalogue or collab_catalogue()
+    if CANDIDATE_POOL is None:
+        return np.arange(title_array.size)
+    key = (title_index, popularity_tables.version, CANDIDATE_POOL)
+    cached = _candidate_cache.get(key)
+    if cached is None:
+        cached = np.flatnonzero(np.isin(title_movie_ids,
+                                        popularity_tables.candidates(CANDIDATE_POOL)))
+        _candidate_cache.clear()
+        _candidate_cache[key] = cached
+    return cached
+
+def popular_fallback(movie_list, titles, top_n=10):
+    """Top up recommendations with popular movies of the favourites' genres.
 
-    # Loading SVD model
-    svd_model = pickle.load(open('resources/models/SVD.pkl', 'rb'))
-
-    # Get the list of all movie titles
-    all_movie_titles = movies_df['title'].unique()
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    titles : list (str)
+        Recommendations found so far.
+    top_n : int
+        Number of recommendations wanted.
 
-    # Get the movie IDs for the movies in movie_list
-    movie_ids = []
-    for title in movie_list:
-        if title in movies_df['title'].values:
-            movie_id = movies_df[movies_df['title'] == title]['movieId'].values[0]
-            movie_ids.append(movie_id)
+    Returns
+    -------
+    list (str)
+        `titles` followed by enough popular titles to make `top_n`.
 
-    print(f"Movie IDs: {movie_ids}") # Debug line
+    """
+    if len(titles) >= top_n:
+        return titles
+    exclude = movie_ids_for(titles)
+    extra = popularity_tables.recommend(movie_ids_for(movie_list),
+                                        top_n - len(titles), exclude=exclude)
+    return titles + titles_for(extra)
+
+def _collab_version():
+    ratings_mtime = os.stat('resources/data/ratings.csv').st_mtime_ns
+    return '{}-{}-{}-{}-{}-{}-{}-{}-{}'.format(
+        COLLAB_STRATEGY, svd_registry.model_key(), neighbour_tables.version,
+        ANN_NPROBE if USE_ANN else 'exact', ANN_ITEM_NPROBE, ratings_mtime,
+        file_hash(MOVIES_PATH), popularity_tables.version, CANDIDATE_POOL)
+
+# Drop cached results of other models as soon as a new model is served
+svd_registry.add_listener(lambda registry: recommendation_cache.invalidate(
+    lambda key: key[0] == 'collab' and key[3] != _collab_version()))
+
+@cached_recommender('collab', _collab_version)
+def collab_model(movie_list,top_n=10):
+    """Performs Collaborative filtering based upon a list of movies supplied
+       by the app user.
 
-    # Find the users who have the highest rating for the movies in movie_list
-    user_ids = pred_movies(movie_list, model=svd_model, ratings_df=ratings_df)
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : type
+        Number of top recommendations to return to the user.
 
-    print(f"User IDs: {user_ids}") # Debug line
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user. When the
+        model has too little to go on (e.g. favourites without ratings),
+        the list is topped up with popular movies of the same genres.
 
-    # Predict the ratings for all movies
-    predicted_ratings = []
-    for title in all_movie_titles:
-        if title in movie_list or title not in all_movie_titles:
-            continue
-        movie_id = movies_df[movies_df['title'] == title]['movieId'].values[0]
-        for user_id in user_ids:
-            if user_id in svd_model.trainset.all_users(): # ensure the user ID exists in the model's training data
-                predicted_rating = svd_model.predict(user_id, movie_id).est
-                predicted_ratings.append((title, predicted_rating))
+    """
+    titles = _collab_recommendations(movie_list, top_n)
+    with metrics.stage('collab.fallback'):
+        return popular_fallback(movie_list, list(titles), top_n)
+
+def _collab_recommendations(movie_list, top_n):
+    if COLLAB_STRATEGY == 'fold_in':
+        return fold_in_recommendations(movie_list, top_n)
+    if COLLAB_STRATEGY == 'ann_items':
+        return ann_similar_items(movie_list, top_n)
+    if COLLAB_STRATEGY == 'item_knn':
+        return item_knn_recommendations(movie_list, top_n)
+    if COLLAB_STRATEGY == 'item_neighbours':
+        titles = table_recommendations(movie_list, top_n)
+        if titles is not None:
+            return titles
+    return user_based_recommendations([movie_list], top_n)[0]
+
+def table_recommendations(movie_list, top_n=10):
+    """Merge the favourites' item-factor neighbours from the published tables.
 
-    # Sort the predicted ratings in descending order
-    predicted_ratings.sort(key=lambda x: x[1], reverse=True)
+    Returns
+    -------
+    list (str) or None
+        Titles of the top-n recommendations, or None when no table built
+        from the served model and catalogue is published.
+    """
+    with metrics.stage('collab.neighbour_tables'):
+        recommended_ids = neighbour_tables.recommend(
+            'collab', movie_ids_for(movie_list), top_n,
+            catalogue=file_hash(MOVIES_PATH),
+            model_key=svd_registry.model_key())
+    if recommended_ids is None or not len(recommended_ids):
+        return None
+    return titles_for(recommended_ids)
+
+def user_based_recommendations(movie_lists, top_n=10):
+    """Score movies for the dataset users most similar to each app user.
+
+    The best users of every favourite of every list are found in one
+    vectorized lookup, and all of those users are scored against the
+    candidate movies with a single `FactorModel.score` call; each list
+    then takes the maximum over its own users' rows.
 
-    # Get the top n movie titles
-    recommended_movies = [title for title, rating in predicted_ratings[:top_n]]
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies of each app user.
+    top_n : int
+        Number of top recommendations per list.
 
-    return list(set(recommended_movies))
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each list (empty when the
+        model knows none of its favourites).
+    """
+    # Loading SVD model factors (cached, reloaded when SVD.pkl changes)
+    factors = svd_registry.factors()
+
+    # Only favourites known to the model say anything about its users
+    known = []
+    for movie_list in movie_lists:
+        movie_ids = movie_ids_for(movie_list)
+        known.append(movie_ids[factors.item_index(movie_ids) >= 0])
+    if sum(movie_ids.size for movie_ids in known) == 0:
+        return [[] for _ in movie_lists]
+    # Find the users who have the highest rating for the movies in each list
+    with metrics.stage('collab.find_users'):
+        top_users, _ = best_users_for_items(np.concatenate(known), factors,
+                                            ratings_df, n=10)
+        user_lists, start = [], 0
+        for movie_ids in known:
+            user_ids = top_users[start:start + movie_ids.size]
+            start += movie_ids.size
+            # Keep only users that exist in the model's training data
+            users = factors.user_index(np.unique(user_ids))
+            user_lists.append(users[users >= 0])
+    all_users, inverse = np.unique(np.concatenate(user_lists), return_inverse=True)
+    if all_users.size == 0:
+        return [[] for _ in movie_lists]
+
+    # Predict the ratings of the plausible candidate movies for all users
+    # of all lists at once
+    catalogue = collab_catalogue()
+    title_index, title_array, title_movie_ids, _ = catalogue
+    with metrics.stage('collab.score'):
+        positions = candidate_positions(catalogue)
+        items = factors.item_index(title_movie_ids[positions])
+        scores = factors.score(all_users, items)
+
+    results, start = [], 0
+    for movie_list, users in zip(movie_lists, user_lists):
+        rows = inverse.ravel()[start:start + users.size]
+        start += users.size
+        if rows.size == 0:
+            results.append([])
+            continue
+        predicted_ratings = scores[rows].max(axis=0)
+        # Removing chosen movies
+        chosen = [row for row in map(title_index.get, movie_list) if row is not None]
+        chosen = np.searchsorted(title_index.first_rows, chosen)
+        predicted_ratings[np.isin(positions, chosen)] = -np.inf
+        # Get the top n movie titles
+        with metrics.stage('collab.sort'):
+            top_indexes = positions[top_n_indices(predicted_ratings, top_n)]
+        results.append([title_array[i] for i in top_indexes])
+    return results
+
+def collab_model_batch(movie_lists, top_n=10):
+    """Collaborative recommendations for several movie lists at once.
+
+    Gives the same results as calling `collab_model` on each list. With
+    the 'neighbours' strategy (and for lists 'item_neighbours' finds no
+    table for), the users of all lists are scored in one matrix product,
+    e.g. for batch jobs and requests coalesced by `recommenders.service`;
+    the other strategies score each list on its own.
 
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
 
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
+    """
+    results = [None] * len(movie_lists)
+    for j, movie_list in enumerate(movie_lists):
+        if COLLAB_STRATEGY == 'item_neighbours':
+            results[j] = table_recommendations(movie_list, top_n)
+        elif COLLAB_STRATEGY != 'neighbours':
+            results[j] = _collab_recommendations(movie_list, top_n)
+    unresolved = [j for j, titles in enumerate(results) if titles is None]
+    if unresolved:
+        found = user_based_recommendations([movie_lists[j] for j in unresolved],
+                                           top_n)
+        for j, titles in zip(unresolved, found):
+            results[j] = titles
+    with metrics.stage('collab.fallback'):
+        return [popular_fallback(movie_list, list(titles), top_n)
+                for movie_list, titles in zip(movie_lists, results)]
@@ -23,44 +23,135 @@
     ---------------------------------------------------------------------
 
     Description: Provided within this file is a baseline content-based
-    filtering algorithm for rating predictions on Movie data.
+    filtering algorithm for rating predictions on Movie data. Movies are
+    compared by the cosine of their hashed genre, title and release year
+    features, held in the incremental index of
+    `recommenders.content_index`, which covers the whole catalogue and
+    takes in new movies without a refit. Alternatively (`CONTENT_ENGINE`)
+    movies are compared by genre only, with the bitset engine of
+    `recommenders.genre_bitset`, which ranks exactly as the original
+    `CountVectorizer` genre cosine.
 
 """
 
 # Script dependencies
-import os
-import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import CountVectorizer
+from utils.data_store import file_hash, load_movies
+from utils.metrics import metrics
+from utils.result_cache import cached_recommender
+from utils.title_index import load_title_index
+from recommenders.content_index import load_content_index
+from recommenders.factor_model import build_id_lookup, lookup_ids, top_n_indices
+from recommenders.genre_bitset import GenreBitset, ranking
+from recommenders.neighbours import neighbour_tables
+
+MOVIES_PATH = 'resources/data/movies.csv'
+# Similarity used by `content_model`: 'index' compares hashed genre, title
+# and year features (with the precomputed neighbour tables when they match
+# the catalogue), 'genre_bitset' the genre cosine of the original model.
+CONTENT_ENGINE = 'index'
+
+# Importing data (shared, read-only frame)
+movies = load_movies(MOVIES_PATH)
+
+# (title index, content index version), the title of every index row and
+# the hash of the catalogue they were built from
+_row_titles = (None, None, None)
+# (catalogue frame, its `GenreBitset`)
+_genre_engine = (None, None)
+
+def content_catalogue():
+    """Content index of the current catalogue and the title of each row.
+
+    Both follow `movies.csv`: movies added to it are featurised and
+    appended to the index on the next call.
 
-# Importing data
-movies = pd.read_csv('resources/data/movies.csv', sep = ',')
-ratings = pd.read_csv('resources/data/ratings.csv')
-movies.dropna(inplace=True)
+    Returns
+    -------
+    tuple
+        `ContentIndex`, an object array with the title of each of its rows
+        (None for rows of movies no longer in the catalogue) and the hash
+        of the catalogue file.
 
-def data_preprocessing(subset_size):
-    """Prepare data for use within Content filtering algorithm.
+    """
+    global _row_titles
+    index = load_content_index(MOVIES_PATH)
+    title_index = load_title_index(MOVIES_PATH)
+    key, titles, catalogue = _row_titles
+    if key != (title_index, index.version):
+        with metrics.stage('content.row_titles'):
+            rows = lookup_ids(build_id_lookup(title_index.movie_ids), index.movie_ids)
+            titles = np.array(title_index.titles + [None], dtype=object)[rows]
+        catalogue = file_hash(MOVIES_PATH)
+        _row_titles = ((title_index, index.version), titles, catalogue)
+    return index, titles, catalogue
+
+def content_rows(movie_list):
+    """Content index rows of the chosen titles, resolved in O(1).
+
+    Raises
+    ------
+    KeyError
+        If a title is not in the catalogue.
 
-    Parameters
-    ----------
-    subset_size : int
-        Number of movies to use within the algorithm.
+    """
+    title_index = load_title_index(MOVIES_PATH)
+    movie_ids = title_index.movie_ids[title_index.rows(movie_list)]
+    rows = load_content_index(MOVIES_PATH).rows(movie_ids)
+    for title, row in zip(movie_list, rows):
+        if row < 0:
+            raise KeyError(title)
+    return rows
 
-    Returns
-    -------
-    Pandas Dataframe
-        Subset of movies selected for content-based filtering.
+def genre_engine():
+    """`GenreBitset` of the current catalogue, rebuilt when it changes.
+
+    Its rows are the rows of `load_movies` and of the title index.
+
+    """
+    global _genre_engine
+    frame = load_movies(MOVIES_PATH)
+    key, engine = _genre_engine
+    if key is not frame:
+        with metrics.stage('content.build_bitset'):
+            engine = GenreBitset(frame['genre_mask'].to_numpy(),
+                                 frame.attrs['genre_vocabulary'])
+        _genre_engine = (frame, engine)
+    return engine
+
+def genre_recommendations(movie_lists, top_n=10):
+    """Top-n titles by summed genre cosine, for each movie list.
+
+    Ties are broken by catalogue row, so the ranking is the one of the
+    `CountVectorizer` cosine (see `recommenders.genre_bitset.ranking`).
 
     """
-    # Split genre data into individual words.
-    movies['keyWords'] = movies['genres'].str.replace('|', ' ')
-    # Subset of the data
-    movies_subset = movies[:subset_size]
-    return movies_subset
+    title_index = load_title_index(MOVIES_PATH)
+    row_lists = [title_index.rows(movie_list) for movie_list in movie_lists]
+    engine = genre_engine()
+    titles = np.array(title_index.titles, dtype=object)
+    with metrics.stage('content.genre_similarity'):
+        if len(row_lists) == 1:
+            scores = engine.cosine(row_lists[0])[None, :]
+        else:
+            scores = engine.cosine_many(row_lists)
+    with metrics.stage('content.sort'):
+        return [titles[ranking(row, rows, top_n)].tolist()
+                for row, rows in zip(scores, row_lists)]
+
+# Syncing the content index and building the title index at import, so
+# the first request does not pay for them
+with metrics.stage('content.build_index'):
+    content_catalogue()
+
+def _content_version():
+    index, _, catalogue = content_catalogue()
+    return '{}-{}-{}-{}'.format(CONTENT_ENGINE, catalogue, index.version,
+                                neighbour_tables.version)
 
 # !! DO NOT CHANGE THIS FUNCTION SIGNATURE !!
 # You are, however, encouraged to change its content.  
+@cached_recommender('content', _content_version)
 def content_model(movie_list,top_n=10):
     """Performs Content filtering based upon a list of movies supplied
        by the app user.
@@ -78,35 +169,69 @@ def content_model(movie_list,top_n=10):
         Titles of the top-n movie recommendations to the user.
 
     """
-    # Initializing the empty list of recommended movies
-    recommended_movies = []
-    data = data_preprocessing(27000)
-    # Instantiating and generating the count matrix
-    count_vec = CountVectorizer()
-    count_matrix = count_vec.fit_transform(data['keyWords'])
-    indices = pd.Series(data['title'])
-    cosine_sim = cosine_similarity(count_matrix, count_matrix)
-    # Getting the index of the movie that matches the title
-    idx_1 = indices[indices == movie_list[0]].index[0]
-    idx_2 = indices[indices == movie_list[1]].index[0]
-    idx_3 = indices[indices == movie_list[2]].index[0]
-    # Creating a Series with the similarity scores in descending order
-    rank_1 = cosine_sim[idx_1]
-    rank_2 = cosine_sim[idx_2]
-    rank_3 = cosine_sim[idx_3]
-    # Calculating the scores
-    score_series_1 = pd.Series(rank_1).sort_values(ascending = False)
-    score_series_2 = pd.Series(rank_2).sort_values(ascending = False)
-    score_series_3 = pd.Series(rank_3).sort_values(ascending = False)
-    # Getting the indexes of the 10 most similar movies
-    listings = score_series_1.append(score_series_1).append(score_series_3).sort_values(ascending = False)
-
-    # Store movie names
-    recommended_movies = []
-    # Appending the names of movies
-    top_50_indexes = list(listings.iloc[1:50].index)
+    if CONTENT_ENGINE == 'genre_bitset':
+        return genre_recommendations([movie_list], top_n)[0]
+    # Getting the index of the movies that match the titles
+    with metrics.stage('content.resolve'):
+        idx = content_rows(movie_list)
+        index, titles, catalogue = content_catalogue()
+    # Merging the precomputed neighbour lists, when published for this
+    # catalogue (movies added since are only in the index)
+    movie_ids = index.movie_ids[idx]
+    with metrics.stage('content.neighbour_tables'):
+        recommended_ids = neighbour_tables.recommend('content', movie_ids, top_n,
+                                                     catalogue=catalogue)
+    if recommended_ids is not None and len(recommended_ids):
+        rows = index.rows(recommended_ids)
+        return titles[rows[rows >= 0]].tolist()
+    # Summed cosine similarity of every movie against the chosen movies
+    with metrics.stage('content.similarity'):
+        scores = index.scores(idx)
     # Removing chosen movies
-    top_indexes = np.setdiff1d(top_50_indexes,[idx_1,idx_2,idx_3])
-    for i in top_indexes[:top_n]:
-        recommended_movies.append(list(movies['title'])[i])
-    return recommended_movies
+    scores[idx] = -np.inf
+    with metrics.stage('content.sort'):
+        top_indexes = top_n_indices(scores, top_n)
+    return titles[top_indexes].tolist()
+
+def content_model_batch(movie_lists, top_n=10):
+    """Content recommendations for several movie lists at once.
+
+    Gives the same results as calling `content_model` on each list, but
+    the similarities of all lists are computed in one sparse product,
+    e.g. for requests coalesced by `recommenders.service`.
+
+    Parameters
+    ----------
+    movie_lists : list (list (str))
+        Favorite movies of each request.
+    top_n : int
+        Number of top recommendations per request.
+
+    Returns
+    -------
+    list (list (str))
+        Titles of the top-n recommendations of each request.
+
+    """
+    if CONTENT_ENGINE == 'genre_bitset':
+        return genre_recommendations(movie_lists, top_n)
+    idx_lists = [content_rows(movie_list) for movie_list in movie_lists]
+    index, titles, catalogue = content_catalogue()
+    results = [None] * len(idx_lists)
+    unresolved = []
+    for j, idx in enumerate(idx_lists):
+        movie_ids = index.movie_ids[idx]
+        recommended_ids = neighbour_tables.recommend('content', movie_ids, top_n,
+                                                     catalogue=catalogue)
+        if recommended_ids is not None and len(recommended_ids):
+            rows = index.rows(recommended_ids)
+            results[j] = titles[rows[rows >= 0]].tolist()
+        else:
+            unresolved.append(j)
+    if unresolved:
+        with metrics.stage('content.similarity_batch'):
+            scores = index.scores_many([idx_lists[j] for j in unresolved])
+        for row, j in zip(scores, unresolved):
+            row[idx_lists[j]] = -np.inf
+            results[j] = titles[top_n_indices(row, top_n)].tolist()
+    return results
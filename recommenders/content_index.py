@@ -0,0 +1,505 @@
+"""
+
+    Incremental hashed-feature index for content-based filtering.
+
+    Author: Explore Data Science Academy.
+
+    Description: Each movie is described by weighted tokens: its genre
+    tags, the words of its title and its release year and decade. Tokens
+    are hashed (CRC32) into a fixed space of `N_FEATURES` columns, so no
+    vocabulary is fitted and a new movie's features never depend on the
+    rest of the catalogue. Rows are L2-normalised, so the dot product of
+    two rows is the cosine similarity of the movies.
+
+    The index is append-only: rows are added in segments, each a CSR
+    matrix with the MovieLens ID of every row. Adding movies costs
+    featurising and writing those movies only. A movie added again
+    supersedes its earlier row, and a removed movie gets an empty row
+    flagged in the segment's `removed` column (a tombstone). Segments are
+    persisted as columnar artifacts (see `utils.columnar`) listed in a
+    `SEGMENTS` file that is replaced atomically, and are opened
+    memory-mapped. `compact` rewrites the live rows as one segment once
+    many small segments or superseded rows have piled up.
+
+    `load_content_index` keeps the index of a catalogue in step with
+    `movies.csv`: when the file changes, only movies with new IDs or an
+    edited title or genres (told apart by a checksum stored per row) are
+    featurised and appended, and deleted ones are tombstoned.
+
+    Usage (from the repository root):
+
+        python -m recommenders.content_index --compact
+
+"""
+# Script dependencies
+import argparse
+import os
+import shutil
+import threading
+import time
+import zlib
+import numpy as np
+from scipy import sparse
+from recommenders.factor_model import lookup_ids
+from utils.columnar import load_columns, save_columns
+from utils.data_store import load_movies
+from utils.metrics import metrics
+from utils.title_index import split_year, title_keys
+
+CONTENT_INDEX_ROOT = 'resources/models/content_index'
+SEGMENTS_FILE = 'SEGMENTS'
+N_FEATURES = 2 ** 20
+
+# Token weights, before row normalisation: genres dominate, title words
+# and release period refine
+GENRE_WEIGHT = 1.0
+TITLE_WEIGHT = 0.4
+YEAR_WEIGHT = 0.25
+DECADE_WEIGHT = 0.5
+STOP_WORDS = frozenset('the a an of and in on to for with at from by de la le '
+                       'les el il der die das du des'.split())
+
+_buckets = {}
+
+def feature_tokens(title, genres):
+    """Weighted content tokens of a movie.
+
+    Parameters
+    ----------
+    title : str
+        Catalogue title, e.g. 'Matrix, The (1999)'.
+    genres : str
+        Pipe-separated genre tags.
+
+    Returns
+    -------
+    list (tuple)
+        (token, weight) pairs, e.g. ('genre:Action', 1.0),
+        ('title:matrix', 0.4), ('decade:1990', 0.5).
+
+    """
+    name, year = split_year(title)
+    tokens = [('genre:' + tag, GENRE_WEIGHT) for tag in genres.split('|') if tag]
+    words = set(title_keys(name)[-1].split()) - STOP_WORDS
+    tokens.extend(('title:' + word, TITLE_WEIGHT) for word in sorted(words)
+                  if len(word) > 1)
+    if year:
+        tokens.append(('year:{}'.format(year), YEAR_WEIGHT))
+        tokens.append(('decade:{}'.format(year // 10 * 10), DECADE_WEIGHT))
+    return tokens
+
+def _bucket(token, n_features):
+    key = (token, n_features)
+    bucket = _buckets.get(key)
+    if bucket is None:
+        bucket = _buckets[key] = zlib.crc32(token.encode('utf-8')) % n_features
+    return bucket
+
+def hash_features(titles, genres, n_features=N_FEATURES):
+    """L2-normalised hashed feature rows of some movies.
+
+    Parameters
+    ----------
+    titles, genres : iterable (str)
+        Title and pipe-separated genres of each movie.
+    n_features : int
+        Size of the hashed feature space.
+
+    Returns
+    -------
+    tuple
+        CSR `indptr` (int64), `indices` (int32) and `data` (float32).
+
+    """
+    indptr, indices, data = [0], [], []
+    for title, tags in zip(titles, genres):
+        row = {}
+        for token, weight in feature_tokens(str(title), str(tags)):
+            bucket = _bucket(token, n_features)
+            row[bucket] = row.get(bucket, 0.0) + weight
+        for bucket in sorted(row):
+            indices.append(bucket)
+            data.append(row[bucket])
+        indptr.append(len(indices))
+    indptr = np.array(indptr, dtype=np.int64)
+    data = np.array(data, dtype=np.float32)
+    lengths = np.diff(indptr)
+    norms = np.sqrt(np.add.reduceat(data ** 2, indptr[:-1][lengths > 0])) \
+        if data.size else np.empty(0, dtype=np.float32)
+    data /= np.repeat(norms, lengths[lengths > 0]).astype(np.float32)
+    return indptr, np.array(indices, dtype=np.int32), data
+
+def content_checksums(titles, genres):
+    """CRC32 of each movie's title and genres, to detect edited movies."""
+    return np.array([zlib.crc32('{}\n{}'.format(title, tags).encode('utf-8'))
+                     for title, tags in zip(titles, genres)], dtype=np.uint32)
+
+def _segment_matrix(columns, n_features):
+    return sparse.csr_matrix((columns['data'], columns['indices'], columns['indptr']),
+                             shape=(len(columns['movie_ids']), n_features), copy=False)
+
+class ContentIndex:
+    """Append-only, persisted hashed content features of a catalogue.
+
+    Only one process should write to a persisted index at a time; other
+    processes pick its changes up with `refresh`.
+
+    Parameters
+    ----------
+    root : str, optional
+        Directory of the persisted segments; the index is kept in memory
+        only when None.
+    n_features : int
+        Size of the hashed feature space.
+
+    """
+
+    def __init__(self, root=None, n_features=N_FEATURES):
+        self.root = root
+        self.n_features = n_features
+        self._lock = threading.RLock()
+        # (segment names, segment matrices, row offsets, movie ids, live
+        # rows, movie id to row, row checksums), replaced as a whole so
+        # readers always see a consistent index
+        self._state = _build_state([], [], [], [], [])
+        self._manifest_mtime = None
+
+    def __len__(self):
+        """Number of live (current, non-removed) movies."""
+        return int(self._state[4].sum())
+
+    @property
+    def version(self):
+        """Changes whenever rows are added, removed or compacted."""
+        names, matrices, offsets = self._state[:3]
+        return '{}-{}-{}'.format(int(offsets[-1]), len(matrices),
+                                 names[-1] if names else '')
+
+    @property
+    def movie_ids(self):
+        """MovieLens ID of every row, including superseded ones."""
+        return self._state[3]
+
+    @property
+    def n_segments(self):
+        return len(self._state[1])
+
+    def live_ids(self):
+        """MovieLens IDs of the live movies, in row order."""
+        return self._state[3][self._state[4]]
+
+    def rows(self, movie_ids):
+        """Current rows of some movies, -1 for unknown or removed ones."""
+        live, lookup = self._state[4], self._state[5]
+        rows = lookup_ids(lookup, movie_ids)
+        known = rows >= 0
+        rows[known] = np.where(live[rows[known]], rows[known], -1)
+        return rows
+
+    def add(self, movie_ids, titles, genres):
+        """Append movies, superseding earlier rows with the same IDs.
+
+        Parameters
+        ----------
+        movie_ids : array-like (int)
+            MovieLens IDs.
+        titles, genres : iterable (str)
+            Title and pipe-separated genres of each movie.
+
+        Returns
+        -------
+        int
+            Number of rows added.
+
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        if movie_ids.size == 0:
+            return 0
+        titles, genres = list(titles), list(genres)
+        with metrics.stage('content_index.featurise'):
+            indptr, indices, data = hash_features(titles, genres, self.n_features)
+        self._append({'movie_ids': movie_ids, 'indptr': indptr,
+                      'indices': indices, 'data': data,
+                      'removed': np.zeros(movie_ids.size, dtype=bool),
+                      'checksum': content_checksums(titles, genres)})
+        return int(movie_ids.size)
+
+    def remove(self, movie_ids):
+        """Tombstone movies, so they are no longer scored or recommended."""
+        movie_ids = np.asarray(movie_ids, dtype=np.int32)
+        if movie_ids.size:
+            self._append({'movie_ids': movie_ids,
+                          'indptr': np.zeros(movie_ids.size + 1, dtype=np.int64),
+                          'indices': np.empty(0, dtype=np.int32),
+                          'data': np.empty(0, dtype=np.float32),
+                          'removed': np.ones(movie_ids.size, dtype=bool),
+                          'checksum': np.zeros(movie_ids.size, dtype=np.uint32)})
+
+    def sync(self, movies):
+        """Bring the index in step with a catalogue.
+
+        Movies whose ID is not indexed yet are added, movies whose title
+        or genres changed are re-featurised (their new row supersedes the
+        old one) and indexed movies that left the catalogue are removed.
+
+        Parameters
+        ----------
+        movies : Pandas Dataframe
+            Catalogue with `movieId`, `title` and `genres` columns.
+
+        Returns
+        -------
+        tuple
+            Number of movies added, updated and removed.
+
+        """
+        with self._lock:
+            self.refresh()
+            ids = movies['movieId'].to_numpy(dtype=np.int32)
+            titles = movies['title'].to_numpy()
+            genres = movies['genres'].to_numpy()
+            rows = self.rows(ids)
+            new = rows < 0
+            with metrics.stage('content_index.checksum'):
+                checksums = content_checksums(titles, genres)
+            edited = ~new
+            edited[~new] = self._state[6][rows[~new]] != checksums[~new]
+            changed = new | edited
+            current = self.live_ids()
+            removed = current[~np.isin(current, ids)]
+            self.add(ids[changed], titles[changed], genres[changed])
+            self.remove(removed)
+            return int(new.sum()), int(edited.sum()), int(removed.size)
+
+    def scores_many(self, row_lists):
+        """Summed cosine similarity of every row against each list of rows.
+
+        Parameters
+        ----------
+        row_lists : list (list (int))
+            Rows of each query, e.g. of a user's favourite movies.
+
+        Returns
+        -------
+        numpy.ndarray
+            (len(row_lists), n_rows) float32 scores; superseded and removed
+            rows score -inf.
+
+        """
+        _, matrices, offsets, _, live = self._state[:5]
+        # Each query is the sum of its rows' feature vectors
+        query_rows = np.concatenate([np.asarray(rows, dtype=np.int64)
+                                     for rows in row_lists])
+        segments = np.searchsorted(offsets, query_rows, side='right') - 1
+        picked = sparse.vstack([matrices[s][int(r - offsets[s])]
+                                for s, r in zip(segments, query_rows)], format='csr')
+        owners = np.repeat(np.arange(len(row_lists)), [len(r) for r in row_lists])
+        summed = sparse.csr_matrix(
+            (np.ones(query_rows.size, dtype=np.float32),
+             (owners, np.arange(query_rows.size))),
+            shape=(len(row_lists), query_rows.size)) @ picked
+        queries = summed.T.tocsr()
+        scores = np.hstack([(matrix @ queries).toarray().T for matrix in matrices])
+        scores[:, ~live] = -np.inf
+        return scores
+
+    def scores(self, rows):
+        """Summed cosine similarity of every row against `rows`."""
+        return self.scores_many([rows])[0]
+
+    def compact(self):
+        """Rewrite the live rows as a single segment.
+
+        Returns
+        -------
+        bool
+            Whether anything was rewritten.
+
+        """
+        with self._lock:
+            self.refresh()
+            names, matrices, _, movie_ids, live, _, checksums = self._state
+            if len(matrices) <= 1 and live.all():
+                return False
+            keep = np.flatnonzero(live)
+            with metrics.stage('content_index.compact'):
+                matrix = sparse.vstack(matrices, format='csr')[keep]
+            self._append({'movie_ids': movie_ids[keep],
+                          'indptr': matrix.indptr.astype(np.int64),
+                          'indices': matrix.indices.astype(np.int32),
+                          'data': matrix.data.astype(np.float32),
+                          'removed': np.zeros(keep.size, dtype=bool),
+                          'checksum': checksums[keep]}, replace=True)
+            return True
+
+    def refresh(self):
+        """Load segments written by other processes since the last look."""
+        if self.root is None:
+            return
+        with self._lock:
+            path = os.path.join(self.root, SEGMENTS_FILE)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                return
+            if mtime == self._manifest_mtime:
+                return
+            with open(path) as f:
+                names = f.read().split()
+            base = self._state
+            if names[:len(base[0])] != base[0]:
+                # Compacted by another process: reload every segment
+                base = None
+            loaded = [] if base is None else base[0]
+            matrices, ids, removed, checksums = [], [], [], []
+            for name in names[len(loaded):]:
+                columns = load_columns(os.path.join(self.root, name), mmap_mode='r')
+                if int(columns['n_features']) != self.n_features:
+                    raise ValueError(
+                        'Content index {} has {} features, not {}; rebuild it with '
+                        '`python -m recommenders.content_index --rebuild`'.format(
+                            self.root, int(columns['n_features']), self.n_features))
+                matrices.append(_segment_matrix(columns, self.n_features))
+                ids.append(np.asarray(columns['movie_ids']))
+                # Segments written before tombstones were flagged
+                removed.append(np.asarray(columns['removed']) if 'removed' in columns
+                               else np.diff(columns['indptr']) == 0)
+                # Segments written before checksums were stored: their movies
+                # are re-featurised once by the next `sync`
+                checksums.append(np.asarray(columns['checksum']) if 'checksum' in columns
+                                 else np.zeros(len(ids[-1]), dtype=np.uint32))
+            self._state = _build_state(names, matrices, ids, removed, checksums, base)
+            self._manifest_mtime = mtime
+
+    def _append(self, columns, replace=False):
+        """Add a segment, persisting it first; `replace` drops all others."""
+        with self._lock:
+            names = self._state[0]
+            name = None if self.root is None else self._write_segment(columns, replace)
+            matrix = _segment_matrix(columns, self.n_features)
+            if replace:
+                self._state = _build_state([name], [matrix], [columns['movie_ids']],
+                                           [columns['removed']], [columns['checksum']])
+            else:
+                self._state = _build_state(names + [name], [matrix],
+                                           [columns['movie_ids']], [columns['removed']],
+                                           [columns['checksum']], self._state)
+            if replace and self.root is not None:
+                for old in names:
+                    shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+    def _write_segment(self, columns, replace):
+        """Write a segment, then list it in the manifest; returns its name."""
+        names = [] if replace else list(self._state[0])
+        number = max([int(n.split('-')[1]) for n in self._state[0]], default=-1) + 1
+        name = 'seg-{:06d}'.format(number)
+        os.makedirs(self.root, exist_ok=True)
+        with metrics.stage('content_index.write'):
+            tmp_path = os.path.join(self.root, '{}.{}.tmp'.format(name, os.getpid()))
+            save_columns(tmp_path, dict(columns, n_features=np.int64(self.n_features)))
+            os.replace(tmp_path, os.path.join(self.root, name))
+            manifest = os.path.join(self.root, SEGMENTS_FILE)
+            tmp_manifest = '{}.{}.tmp'.format(manifest, os.getpid())
+            with open(tmp_manifest, 'w') as f:
+                f.write('\n'.join(names + [name]) + '\n')
+            os.replace(tmp_manifest, manifest)
+        self._manifest_mtime = os.stat(manifest).st_mtime_ns
+        return name
+
+def _build_state(names, matrices, ids, removed, checksums, base=None):
+    """Index state of `base`'s segments followed by some new segments.
+
+    Only the new segments' rows are visited, so appending costs the size
+    of the delta (plus a copy of the per-row arrays).
+
+    """
+    if base is None:
+        base = ([], [], np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=bool), np.empty(0, dtype=np.int32),
+                np.empty(0, dtype=np.uint32))
+    _, old_matrices, old_offsets, old_ids, old_live, old_lookup, old_checksums = base
+    ids = [np.asarray(segment, dtype=np.int32) for segment in ids]
+    offsets = np.concatenate([old_offsets, old_offsets[-1] + np.cumsum(
+        [segment.size for segment in ids], dtype=np.int64)])
+    movie_ids = np.concatenate([old_ids] + ids)
+    # Tombstones are flagged explicitly: a movie without any token also
+    # has an empty row, but is live
+    live = np.concatenate([old_live] + [~np.asarray(flags, dtype=bool)
+                                        for flags in removed])
+    size = max(old_lookup.size, int(movie_ids.max()) + 1 if movie_ids.size else 0)
+    lookup = np.full(size, -1, dtype=np.int32)
+    lookup[:old_lookup.size] = old_lookup
+    for start, segment in zip(offsets[len(old_matrices):-1], ids):
+        rows = np.arange(start, start + segment.size, dtype=np.int32)
+        # Later rows of a movie supersede earlier ones
+        _, last = np.unique(segment[::-1], return_index=True)
+        current = np.zeros(segment.size, dtype=bool)
+        current[segment.size - 1 - last] = True
+        live[rows[~current]] = False
+        previous = lookup[segment[current]]
+        live[previous[previous >= 0]] = False
+        lookup[segment[current]] = rows[current]
+    row_checksums = np.concatenate([old_checksums] + [
+        np.asarray(segment, dtype=np.uint32) for segment in checksums])
+    return (list(names), list(old_matrices) + list(matrices), offsets, movie_ids,
+            live, lookup, row_checksums)
+
+_indexes = {}
+_lock = threading.Lock()
+
+def load_content_index(path='resources/data/movies.csv', root=None):
+    """Content index of a catalogue, synced whenever the catalogue changes.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+    root : str, optional
+        Directory of the persisted index; defaults to
+        `RECOMMENDER_CONTENT_INDEX_DIR` or `CONTENT_INDEX_ROOT`.
+
+    Returns
+    -------
+    ContentIndex
+        Index holding every movie of `load_movies(path)`.
+
+    """
+    root = root or os.environ.get('RECOMMENDER_CONTENT_INDEX_DIR', CONTENT_INDEX_ROOT)
+    movies = load_movies(path)
+    with _lock:
+        cached = _indexes.get((path, root))
+        if cached is None:
+            cached = _indexes[(path, root)] = [None, ContentIndex(root)]
+        if cached[0] is not movies:
+            with metrics.stage('content_index.sync'):
+                cached[1].sync(movies)
+            cached[0] = movies
+        return cached[1]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Update the content index.')
+    parser.add_argument('--movies', default='resources/data/movies.csv')
+    parser.add_argument('--root', default=CONTENT_INDEX_ROOT)
+    parser.add_argument('--compact', action='store_true',
+                        help='Rewrite the live rows as a single segment.')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Discard the persisted index and featurise every movie.')
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        shutil.rmtree(args.root, ignore_errors=True)
+    start = time.perf_counter()
+    index = ContentIndex(args.root)
+    added, updated, removed = index.sync(load_movies(args.movies))
+    print(f"Synced {args.root}: {added} added, {updated} updated, {removed} removed "
+          f"in {time.perf_counter() - start:.2f}s")
+    if args.compact:
+        start = time.perf_counter()
+        index.compact()
+        print(f"Compacted in {time.perf_counter() - start:.2f}s")
+    print(f"{len(index)} movies in {index.n_segments} segment(s), "
+          f"{len(index.movie_ids)} rows")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+"""
+
+    Offline ranking evaluation of the recommendation engines.
+
+    Author: Explore Data Science Academy.
+
+    Description: Splits `ratings.csv` into train/test folds, either by
+    time (rolling cut-offs: train on everything before a cut-off, test on
+    the next window) or leave-k-out (k random ratings of every user held
+    out), fits each engine on the train ratings and generates the top-k
+    unseen items of every test user in batched matrix form. Precision@k,
+    recall@k, NDCG@k and catalogue coverage are computed vectorized over
+    users; folds run in parallel on a process pool. Fit and recommendation
+    times are reported next to the quality metrics, so speed and quality
+    of the engines can be compared side by side.
+
+    Every engine implements the same small interface (`Engine`): `fit`
+    on a `RatingsMatrix`, and `scores` for a block of its users. The app's
+    own `content_model`/`collab_model` functions can be evaluated too,
+    through `FunctionEngine`, which feeds each test user's favourite train
+    movies to the function. Those use the served models, which were
+    trained on all ratings, so their scores are optimistic.
+
+    Usage (from the repository root):
+
+        python -m recommenders.evaluation --engines popularity content svd \\
+            --split leave_k_out --folds 3 --k 10
+
+"""
+# Script dependencies
+import argparse
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy import sparse
+from utils.data_store import load_movies, load_ratings
+from utils.ratings_matrix import build_ratings_matrix
+
+# Test ratings at or above this count as relevant
+RELEVANCE_THRESHOLD = 4.0
+# Users scored per dense block
+BLOCK_USERS = 1024
+
+def time_splits(timestamps, folds=3, test_fraction=0.1):
+    """Rolling time-based test masks.
+
+    Fold `f` tests on the ratings between two time quantiles and trains on
+    everything before the first, so the last fold tests on the latest
+    `test_fraction` of ratings.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        Timestamp of every rating.
+    folds : int
+        Number of folds.
+    test_fraction : float
+        Fraction of the ratings in each test window.
+
+    Returns
+    -------
+    list (tuple)
+        Per fold, boolean train and test masks over the ratings.
+
+    """
+    splits = []
+    for fold in range(folds):
+        start = 1 - (folds - fold) * test_fraction
+        low, high = np.quantile(timestamps, [start, start + test_fraction])
+        test = (timestamps >= low) & ((timestamps < high) if fold < folds - 1 else True)
+        splits.append((timestamps < low, test))
+    return splits
+
+def leave_k_out_splits(users, k=5, folds=3, seed=0):
+    """Leave-k-out test masks: k random ratings of each user per fold.
+
+    Users with k ratings or fewer are kept entirely in train.
+
+    Parameters
+    ----------
+    users : numpy.ndarray
+        User ID of every rating.
+    k : int
+        Ratings held out per user.
+    folds : int
+        Number of folds, each with its own random draw.
+    seed : int
+        Seed of the first fold.
+
+    Returns
+    -------
+    list (tuple)
+        Per fold, boolean train and test masks over the ratings.
+
+    """
+    splits = []
+    for fold in range(folds):
+        keys = np.random.default_rng(seed + fold).random(users.size)
+        order = np.lexsort((keys, users))
+        sorted_users = users[order]
+        starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+        counts = np.diff(np.r_[starts, users.size])
+        # Rank of every rating within its user's random order
+        ranks = np.arange(users.size) - np.repeat(starts, counts)
+        test = np.zeros(users.size, dtype=bool)
+        test[order] = (ranks < k) & (np.repeat(counts, counts) > k)
+        splits.append((~test, test))
+    return splits
+
+def top_k_unseen(scores, seen, k):
+    """Top-k columns of every row of a score block, skipping seen items.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        (b, n_items) scores; modified in place.
+    seen : scipy.sparse.csr_matrix
+        (b, n_items) items to exclude (any stored entry).
+    k : int
+        Items per row.
+
+    Returns
+    -------
+    numpy.ndarray
+        (b, k) columns, best first; ties go to the lower column.
+
+    """
+    rows = np.repeat(np.arange(seen.shape[0]), np.diff(seen.indptr))
+    scores[rows, seen.indices] = -np.inf
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.lexsort((top, -top_scores), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top[np.take_along_axis(top_scores, order, axis=1) == -np.inf] = -1
+    return top
+
+def ranking_metrics(recommended, test_users, test_items, k, n_items):
+    """Precision, recall and NDCG at k, and catalogue coverage.
+
+    Parameters
+    ----------
+    recommended : numpy.ndarray
+        (n, k) recommended item columns per evaluated user, -1 padded.
+    test_users : numpy.ndarray
+        Position (0..n-1) of the user of every relevant test rating.
+    test_items : numpy.ndarray
+        Item column of every relevant test rating (-1 when the item is
+        unknown to the engine; it still counts as relevant).
+    k : int
+        Cut-off.
+    n_items : int
+        Size of the catalogue the engine recommends from.
+
+    Returns
+    -------
+    dict
+        Metrics averaged over users with at least one relevant item.
+
+    """
+    n = recommended.shape[0]
+    relevant = np.bincount(test_users, minlength=n)
+    known = test_items >= 0
+    test_keys = np.unique(test_users[known].astype(np.int64) * n_items + test_items[known])
+    rec_keys = np.arange(n, dtype=np.int64)[:, None] * n_items + recommended
+    hits = np.isin(rec_keys, test_keys) & (recommended >= 0)
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    ideal = np.cumsum(discounts)[np.clip(relevant, 1, k) - 1]
+    users = relevant > 0
+    n_hits = hits.sum(axis=1)
+    return {
+        'users': int(users.sum()),
+        'precision': float(np.mean(n_hits[users] / k)),
+        'recall': float(np.mean(n_hits[users] / relevant[users])),
+        'ndcg': float(np.mean((hits @ discounts)[users] / ideal[users])),
+        'coverage': float(np.unique(recommended[recommended >= 0]).size / n_items),
+    }
+
+class Engine:
+    """Interface of an evaluated engine.
+
+    Subclasses implement `fit` and `scores`; `recommend` turns scores
+    into top-k unseen items block by block.
+
+    """
+
+    name = 'engine'
+
+    def fit(self, train):
+        """Learn from a `RatingsMatrix` of train ratings."""
+        self.train = train
+        return self
+
+    def scores(self, users):
+        """(len(users), n_items) scores of train matrix rows `users`."""
+        raise NotImplementedError
+
+    def recommend(self, users, k=10):
+        """(len(users), k) top-k unseen item columns, -1 padded."""
+        out = np.full((len(users), k), -1, dtype=np.int64)
+        for start in range(0, len(users), BLOCK_USERS):
+            block = users[start:start + BLOCK_USERS]
+            scores = np.asarray(self.scores(block), dtype=np.float64)
+            top = top_k_unseen(scores, self.train.csr[block], k)
+            out[start:start + len(block), :top.shape[1]] = top
+        return out
+
+class PopularityEngine(Engine):
+    """Same Bayesian-damped popularity ranking for every user."""
+
+    name = 'popularity'
+
+    def fit(self, train):
+        from recommenders.popularity import movie_aggregates
+        super().fit(train)
+        users, items, ratings = train.entries()
+        self._score = movie_aggregates(train.item_ids, items, ratings)['score']
+        return self
+
+    def scores(self, users):
+        return np.broadcast_to(self._score, (len(users), self._score.size)).copy()
+
+class ContentEngine(Engine):
+    """Summed content cosine between each item and a user's rated items.
+
+    Items are described by the hashed features of the content index (see
+    `recommenders.content_index`); scores of all users of a block are the
+    sparse product of their summed profiles with the item features.
+
+    """
+
+    name = 'content'
+
+    def fit(self, train):
+        from recommenders.content_index import N_FEATURES, hash_features
+        from recommenders.factor_model import build_id_lookup, lookup_ids
+        super().fit(train)
+        movies = load_movies()
+        rows = lookup_ids(build_id_lookup(movies['movieId'].to_numpy()), train.item_ids)
+        # Items missing from the catalogue get an empty feature row
+        titles = np.append(movies['title'].to_numpy(), '')[rows]
+        genres = np.append(movies['genres'].to_numpy(), '')[rows]
+        indptr, indices, data = hash_features(titles, genres)
+        self._features = sparse.csr_matrix((data, indices, indptr),
+                                           shape=(rows.size, N_FEATURES))
+        self._features_t = self._features.T.tocsr()
+        return self
+
+    def scores(self, users):
+        rated = self.train.csr[users].astype(bool).astype(np.float32)
+        profiles = rated @ self._features
+        return (profiles @ self._features_t).toarray()
+
+class SVDEngine(Engine):
+    """Surprise SVD fitted on the train ratings, scored as factor products."""
+
+    name = 'svd'
+
+    def __init__(self, **params):
+        self.params = dict({'n_factors': 100, 'n_epochs': 20}, **params)
+
+    def fit(self, train):
+        from surprise import SVD
+        from recommenders.factor_model import FactorModel
+        super().fit(train)
+        model = SVD(random_state=0, **self.params).fit(train.to_surprise_trainset())
+        self._factors = FactorModel.from_surprise(model)
+        self._items = self._factors.item_index(train.item_ids)
+        return self
+
+    def scores(self, users):
+        # Unclipped, so items past the top of the scale keep their order
+        return self._factors.score(self._factors.user_index(self.train.user_ids[users]),
+                                   self._items, clip=False)
+
+class ItemKNNEngine(Engine):
+    """Ratings times top-k adjusted-cosine item similarities."""
+
+    name = 'item_knn'
+
+    def __init__(self, k=50):
+        self.k = k
+
+    def fit(self, train):
+        from recommenders.collaborative_based import build_item_similarities
+        super().fit(train)
+        self._similarities = build_item_similarities(train, self.k)
+        return self
+
+    def scores(self, users):
+        return (self.train.csr[users] @ self._similarities).toarray()
+
+class FunctionEngine(Engine):
+    """Adapter for a `*_model(movie_list, top_n)` recommender function.
+
+    Each user's `favourites` highest-rated train movies are passed as the
+    movie list; recommended titles are mapped back to item columns. Calls
+    are per user, so at most `max_users` users are evaluated.
+
+    """
+
+    def __init__(self, module, function, favourites=3, max_users=200, seed=0):
+        self.module, self.function = module, function
+        self.name = function
+        self.favourites = favourites
+        self.max_users = max_users
+        self.seed = seed
+
+    def fit(self, train):
+        from utils.title_index import load_title_index
+        super().fit(train)
+        model = getattr(importlib.import_module(self.module), self.function)
+        self._model = getattr(model, 'uncached', model)
+        self._titles = load_title_index()
+        movies = load_movies()
+        self._movie_titles = dict(zip(movies['movieId'].tolist(), movies['title']))
+        return self
+
+    def sample(self, users):
+        """The users actually evaluated (a seeded sample of `max_users`)."""
+        if len(users) <= self.max_users:
+            return users
+        rng = np.random.default_rng(self.seed)
+        return np.sort(rng.choice(users, self.max_users, replace=False))
+
+    def recommend(self, users, k=10):
+        csr = self.train.csr
+        out = np.full((len(users), k), -1, dtype=np.int64)
+        for j, user in enumerate(users):
+            row = slice(csr.indptr[user], csr.indptr[user + 1])
+            best = csr.indices[row][np.argsort(-csr.data[row], kind='stable')]
+            titles = [self._movie_titles[i] for i in self.train.item_ids[best].tolist()
+                      if i in self._movie_titles][:self.favourites]
+            try:
+                found = self._model(titles, k + self.favourites)
+            except KeyError:
+                continue
+            ids = [self._titles.movie_id(title) for title in found]
+            items = self.train.item_index(ids)
+            items = items[(items >= 0) & ~np.isin(items, csr.indices[row])][:k]
+            out[j, :items.size] = items
+        return out
+
+# Engines selectable by name
+ENGINES = {
+    'popularity': PopularityEngine,
+    'content': ContentEngine,
+    'svd': SVDEngine,
+    'item_knn': ItemKNNEngine,
+    'content_model': lambda: FunctionEngine('recommenders.content_based', 'content_model'),
+    'collab_model': lambda: FunctionEngine('recommenders.collaborative_based', 'collab_model'),
+}
+
+def make_splits(ratings, split='leave_k_out', folds=3, holdout=5,
+                test_fraction=0.1, seed=0):
+    """Train/test masks of a ratings frame (see the split functions)."""
+    if split == 'time':
+        return time_splits(ratings['timestamp'].to_numpy(), folds, test_fraction)
+    if split == 'leave_k_out':
+        return leave_k_out_splits(ratings['userId'].to_numpy(), holdout, folds, seed)
+    raise ValueError('Unknown split: {}'.format(split))
+
+def evaluate_fold(engine_names, fold, split='leave_k_out', folds=3, k=10,
+                  holdout=5, test_fraction=0.1, seed=0,
+                  ratings_path='resources/data/ratings.csv'):
+    """Fit and evaluate engines on one fold.
+
+    Returns
+    -------
+    list (dict)
+        Per engine: metrics, fit and recommendation seconds, and users
+        scored per second.
+
+    """
+    ratings = load_ratings(ratings_path)
+    train_mask, test_mask = make_splits(ratings, split, folds, holdout,
+                                        test_fraction, seed)[fold]
+    users, items = ratings['userId'].to_numpy(), ratings['movieId'].to_numpy()
+    values = ratings['rating'].to_numpy()
+    train = build_ratings_matrix([(users[train_mask], items[train_mask],
+                                   values[train_mask])])
+    relevant = test_mask & (values >= RELEVANCE_THRESHOLD)
+    rows = train.user_index(users[relevant])
+    known = rows >= 0
+    test_rows, test_items = rows[known], items[relevant][known]
+    eval_users = np.unique(test_rows)
+
+    results = []
+    for name in engine_names:
+        engine = ENGINES[name]()
+        start = time.perf_counter()
+        engine.fit(train)
+        fit_seconds = time.perf_counter() - start
+        scored = engine.sample(eval_users) if hasattr(engine, 'sample') else eval_users
+        start = time.perf_counter()
+        recommended = engine.recommend(scored, k)
+        rec_seconds = time.perf_counter() - start
+        position = np.searchsorted(scored, test_rows)
+        in_sample = (position < scored.size) & \
+            (scored[np.minimum(position, scored.size - 1)] == test_rows)
+        metrics = ranking_metrics(recommended, position[in_sample],
+                                  train.item_index(test_items[in_sample]), k,
+                                  train.item_ids.size)
+        results.append(dict(metrics, engine=name, fold=fold,
+                            fit_seconds=fit_seconds, recommend_seconds=rec_seconds,
+                            users_per_second=scored.size / rec_seconds if rec_seconds else 0.0))
+    return results
+
+def evaluate(engine_names, split='leave_k_out', folds=3, k=10, holdout=5,
+             test_fraction=0.1, seed=0, workers=None,
+             ratings_path='resources/data/ratings.csv'):
+    """Evaluate engines on every fold, folds in parallel.
+
+    Parameters
+    ----------
+    engine_names : list (str)
+        Keys of `ENGINES`.
+    split : str
+        'leave_k_out' or 'time'.
+    folds : int
+        Number of folds.
+    k : int
+        Recommendation list length.
+    holdout : int
+        Ratings held out per user ('leave_k_out').
+    test_fraction : float
+        Fraction of the ratings per test window ('time').
+    seed : int
+        Seed of the leave-k-out draws.
+    workers : int, optional
+        Processes; defaults to one per fold, up to the number of cores.
+    ratings_path : str
+        Ratings to split.
+
+    Returns
+    -------
+    tuple
+        Per-fold results, and per-engine means over the folds.
+
+    """
+    workers = workers or min(folds, os.cpu_count() or 1)
+    args = (split, folds, k, holdout, test_fraction, seed, ratings_path)
+    results = []
+    if workers == 1:
+        for fold in range(folds):
+            results.extend(evaluate_fold(engine_names, fold, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            tasks = [pool.submit(evaluate_fold, engine_names, fold, *args)
+                     for fold in range(folds)]
+            for task in as_completed(tasks):
+                results.extend(task.result())
+    results.sort(key=lambda r: (engine_names.index(r['engine']), r['fold']))
+    summary = []
+    for name in engine_names:
+        runs = [r for r in results if r['engine'] == name]
+        summary.append(dict(engine=name, **{
+            metric: float(np.mean([r[metric] for r in runs]))
+            for metric in ('precision', 'recall', 'ndcg', 'coverage', 'users',
+                           'fit_seconds', 'recommend_seconds', 'users_per_second')}))
+    return results, summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline ranking evaluation.')
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES),
+                        default=['popularity', 'content', 'svd', 'item_knn'])
+    parser.add_argument('--split', choices=['leave_k_out', 'time'], default='leave_k_out')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--holdout', type=int, default=5,
+                        help='Ratings held out per user (leave_k_out).')
+    parser.add_argument('--test-fraction', type=float, default=0.1,
+                        help='Fraction of ratings per test window (time).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--ratings', default='resources/data/ratings.csv')
+    parser.add_argument('--json', default=None, help='Optional results file.')
+    args = parser.parse_args(argv)
+
+    results, summary = evaluate(args.engines, args.split, args.folds, args.k,
+                                args.holdout, args.test_fraction, args.seed,
+                                args.workers, args.ratings)
+    print('engine          P@{0}    R@{0}    NDCG@{0}  coverage  fit s   users/s'
+          .format(args.k))
+    for row in summary:
+        print('{engine:<14} {precision:6.4f}  {recall:6.4f}  {ndcg:7.4f}  '
+              '{coverage:8.4f}  {fit_seconds:6.2f}  {users_per_second:8.1f}'.format(**row))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': vars(args), 'folds': results,
+                       'summary': summary}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+"""
+
+    Vectorized scoring with the factors of a trained SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Pulls the user/item factors, biases and global mean out
+    of a trained Surprise SVD once, and scores whole blocks of
+    (user, movie) pairs as a single NumPy matrix product. Estimates follow
+    the semantics of `SVD.predict(...).est`, including the handling of
+    unknown users/items and clipping to the rating scale.
+
+"""
+# Script dependencies
+import os
+import numpy as np
+
+def build_id_lookup(raw_ids):
+    """Build a dense raw-id to inner-id lookup array.
+
+    Parameters
+    ----------
+    raw_ids : numpy.ndarray
+        Raw (MovieLens) integer ids, ordered by inner id.
+
+    Returns
+    -------
+    numpy.ndarray
+        int32 array where position `raw_id` holds the inner id, or -1 for
+        ids unknown to the model.
+
+    """
+    raw_ids = np.asarray(raw_ids, dtype=np.int64)
+    size = int(raw_ids.max()) + 1 if raw_ids.size else 0
+    lookup = np.full(size, -1, dtype=np.int32)
+    lookup[raw_ids] = np.arange(raw_ids.size, dtype=np.int32)
+    return lookup
+
+def lookup_ids(lookup, raw_ids):
+    """Map raw ids to inner ids with a dense lookup array.
+
+    Parameters
+    ----------
+    lookup : numpy.ndarray
+        Array returned by `build_id_lookup`.
+    raw_ids : array-like (int)
+        Raw ids to translate.
+
+    Returns
+    -------
+    numpy.ndarray
+        Inner ids, with -1 for ids unknown to the model.
+
+    """
+    raw_ids = np.asarray(raw_ids, dtype=np.int64)
+    inner = np.full(raw_ids.shape, -1, dtype=np.int32)
+    valid = (raw_ids >= 0) & (raw_ids < lookup.shape[0])
+    inner[valid] = lookup[raw_ids[valid]]
+    return inner
+
+class FactorModel:
+    """Factor matrices, biases and id maps of a trained SVD model.
+
+    Each factor/bias array carries one extra trailing zero row, so inner
+    id -1 (unknown user or item) indexes a neutral entry. This reproduces
+    Surprise's fallback of dropping the unknown side's bias and the dot
+    product without any per-pair branching.
+
+    """
+
+    def __init__(self, pu, qi, bu, bi, global_mean, rating_scale,
+                 user_raw_ids, item_raw_ids, padded=False,
+                 user_lookup=None, item_lookup=None):
+        if not padded:
+            pu, qi, bu, bi = _pad(pu), _pad(qi), _pad(bu), _pad(bi)
+        self.pu, self.qi, self.bu, self.bi = pu, qi, bu, bi
+        self.global_mean = float(global_mean)
+        self.rating_scale = tuple(float(r) for r in rating_scale)
+        self.user_raw_ids = np.asarray(user_raw_ids)
+        self.item_raw_ids = np.asarray(item_raw_ids)
+        if user_lookup is None:
+            user_lookup = build_id_lookup(self.user_raw_ids)
+        if item_lookup is None:
+            item_lookup = build_id_lookup(self.item_raw_ids)
+        self.user_lookup = user_lookup
+        self.item_lookup = item_lookup
+
+    @classmethod
+    def from_surprise(cls, model):
+        """Extract the factors of a trained Surprise SVD.
+
+        Parameters
+        ----------
+        model : surprise.SVD
+            Fitted SVD model with its trainset attached.
+
+        Returns
+        -------
+        FactorModel
+            Scoring view over the model's parameters.
+
+        """
+        trainset = model.trainset
+        user_raw_ids = np.array([trainset.to_raw_uid(u)
+                                 for u in range(trainset.n_users)], dtype=np.int64)
+        item_raw_ids = np.array([trainset.to_raw_iid(i)
+                                 for i in range(trainset.n_items)], dtype=np.int64)
+        if getattr(model, 'biased', True):
+            bu, bi = model.bu, model.bi
+            global_mean = trainset.global_mean
+        else:
+            bu = np.zeros(trainset.n_users)
+            bi = np.zeros(trainset.n_items)
+            global_mean = 0.0
+        return cls(model.pu, model.qi, bu, bi, global_mean,
+                   trainset.rating_scale, user_raw_ids, item_raw_ids)
+
+    @classmethod
+    def load(cls, path):
+        """Load factors written by `save`.
+
+        Parameters
+        ----------
+        path : str
+            Path of the `.npz` factor archive.
+
+        Returns
+        -------
+        FactorModel
+            Scoring view over the stored parameters.
+
+        """
+        with np.load(path) as data:
+            return cls(data['pu'], data['qi'], data['bu'], data['bi'],
+                       data['global_mean'], data['rating_scale'],
+                       data['user_raw_ids'], data['item_raw_ids'])
+
+    def save(self, path):
+        """Write the factor arrays and id maps to a compact `.npz` archive.
+
+        The archive is written to a temporary file and moved into place, so
+        readers never observe a partially written file.
+
+        Parameters
+        ----------
+        path : str
+            Destination path, ending in `.npz`.
+
+        """
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, pu=self.pu[:-1], qi=self.qi[:-1],
+                 bu=self.bu[:-1], bi=self.bi[:-1],
+                 global_mean=np.float64(self.global_mean),
+                 rating_scale=np.asarray(self.rating_scale),
+                 user_raw_ids=self.user_raw_ids,
+                 item_raw_ids=self.item_raw_ids)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Wrap arrays produced by `to_columns` without copying them.
+
+        Parameters
+        ----------
+        columns : dict
+            Column name to array, typically memory-mapped with
+            `utils.columnar.load_columns`.
+
+        Returns
+        -------
+        FactorModel
+            Scoring view sharing the given arrays.
+
+        """
+        return cls(columns['pu'], columns['qi'], columns['bu'], columns['bi'],
+                   columns['global_mean'], columns['rating_scale'],
+                   columns['user_raw_ids'], columns['item_raw_ids'],
+                   padded=True, user_lookup=columns['user_lookup'],
+                   item_lookup=columns['item_lookup'])
+
+    def to_columns(self):
+        """Columnar float32 form of the model for shared, mapped storage.
+
+        Factors are stored already padded, and the id lookups are stored
+        too, so `from_columns` can serve straight from mapped pages.
+
+        Returns
+        -------
+        dict
+            Column name to array.
+
+        """
+        return {'pu': self.pu.astype(np.float32),
+                'qi': self.qi.astype(np.float32),
+                'bu': self.bu.astype(np.float32),
+                'bi': self.bi.astype(np.float32),
+                'global_mean': np.float64(self.global_mean),
+                'rating_scale': np.asarray(self.rating_scale),
+                'user_raw_ids': self.user_raw_ids.astype(np.int32),
+                'item_raw_ids': self.item_raw_ids.astype(np.int32),
+                'user_lookup': self.user_lookup,
+                'item_lookup': self.item_lookup}
+
+    @property
+    def n_users(self):
+        return self.user_raw_ids.shape[0]
+
+    @property
+    def n_items(self):
+        return self.item_raw_ids.shape[0]
+
+    def user_index(self, raw_ids):
+        """Inner ids for raw user ids (-1 when unknown)."""
+        return lookup_ids(self.user_lookup, raw_ids)
+
+    def item_index(self, raw_ids):
+        """Inner ids for raw movie ids (-1 when unknown)."""
+        return lookup_ids(self.item_lookup, raw_ids)
+
+    def score(self, users, items, clip=True):
+        """Estimate ratings for every (user, item) pair.
+
+        Parameters
+        ----------
+        users : array-like (int)
+            Inner user ids, -1 for unknown users.
+        items : array-like (int)
+            Inner item ids, -1 for unknown items.
+        clip : bool
+            Whether to clip estimates to the model's rating scale.
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix of shape (len(users), len(items)) of rating estimates.
+
+        """
+        users = np.asarray(users, dtype=np.intp)
+        items = np.asarray(items, dtype=np.intp)
+        est = self.pu[users] @ self.qi[items].T
+        est += self.bu[users][:, None]
+        est += self.bi[items][None, :]
+        est += self.global_mean
+        if clip:
+            np.clip(est, self.rating_scale[0], self.rating_scale[1], out=est)
+        return est
+
+    def score_pairs(self, users, items, clip=True):
+        """Estimate ratings for aligned (user, item) pairs.
+
+        Parameters
+        ----------
+        users : array-like (int)
+            Inner user ids, -1 for unknown users.
+        items : array-like (int)
+            Inner item ids of the same length, -1 for unknown items.
+        clip : bool
+            Whether to clip estimates to the model's rating scale.
+
+        Returns
+        -------
+        numpy.ndarray
+            Estimate for each pair.
+
+        """
+        users = np.asarray(users, dtype=np.intp)
+        items = np.asarray(items, dtype=np.intp)
+        est = np.einsum('ij,ij->i', self.pu[users], self.qi[items])
+        est += self.bu[users] + self.bi[items] + self.global_mean
+        if clip:
+            np.clip(est, self.rating_scale[0], self.rating_scale[1], out=est)
+        return est
+
+def _pad(values):
+    """Append a trailing zero row used for unknown (-1) ids."""
+    values = np.asarray(values)
+    pad = np.zeros((1,) + values.shape[1:], dtype=values.dtype)
+    return np.concatenate([values, pad])
+
+def top_n_indices(scores, n):
+    """Indices of the `n` highest scores, best first.
+
+    Parameters
+    ----------
+    scores : numpy.ndarray
+        One-dimensional array of scores.
+    n : int
+        Number of indices to return.
+
+    Returns
+    -------
+    numpy.ndarray
+        Positions of the top-n scores in descending score order.
+
+    """
+    n = min(n, scores.shape[0])
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+    top = np.argpartition(-scores, n - 1)[:n]
+    return top[np.argsort(-scores[top], kind='stable')]
@@ -0,0 +1,199 @@
+"""
+
+    Online fold-in of new users and ratings into a trained SVD model.
+
+    Author: Explore Data Science Academy.
+
+    Description: Instead of retraining the whole SVD when ratings arrive,
+    a new user's latent vector and bias are solved in closed form against
+    the frozen item factors (a single small ridge-regression solve), after
+    which personalised recommendations cost one matrix-vector product.
+    Batches of new ratings can also be applied with a few SGD passes over
+    only the affected user and item rows, using the same update rule as
+    Surprise's SVD.
+
+"""
+# Script dependencies
+import numpy as np
+from recommenders.factor_model import FactorModel, top_n_indices
+
+def fold_in_user(factors, movie_ids, ratings, reg=0.02):
+    """Solve a user's latent vector and bias against frozen item factors.
+
+    Minimises the regularised squared error of the SVD rating model over
+    the given ratings, keeping item factors and biases fixed.
+
+    Parameters
+    ----------
+    factors : FactorModel
+        Trained model.
+    movie_ids : array-like (int)
+        MovieLens IDs rated by the user.
+    ratings : array-like (float)
+        The user's ratings of those movies.
+    reg : float
+        L2 regularisation of the user's factors and bias.
+
+    Returns
+    -------
+    tuple
+        The user's factor vector and bias. Movies unknown to the model are
+        ignored; with none known, both are zero.
+
+    """
+    items = factors.item_index(movie_ids)
+    known = items >= 0
+    items = items[known]
+    ratings = np.asarray(ratings, dtype=np.float64)[known]
+    k = factors.qi.shape[1]
+    if items.size == 0:
+        return np.zeros(k), 0.0
+    # Augment the item factors with a constant column for the user bias
+    X = np.hstack([factors.qi[items], np.ones((items.size, 1))])
+    y = ratings - factors.global_mean - factors.bi[items]
+    w = np.linalg.solve(X.T @ X + reg * np.eye(k + 1), X.T @ y)
+    return w[:k], float(w[k])
+
+def score_user_vector(factors, pu, bu, clip=True):
+    """Estimate the ratings of every known item for a folded-in user.
+
+    Parameters
+    ----------
+    factors : FactorModel
+        Trained model.
+    pu : numpy.ndarray
+        User factor vector.
+    bu : float
+        User bias.
+    clip : bool
+        Whether to clip estimates to the model's rating scale.
+
+    Returns
+    -------
+    numpy.ndarray
+        Estimate per item, in the model's inner item order.
+
+    """
+    est = factors.qi[:-1] @ pu
+    est += factors.bi[:-1] + bu + factors.global_mean
+    if clip:
+        np.clip(est, factors.rating_scale[0], factors.rating_scale[1], out=est)
+    return est
+
+def recommend_for_ratings(factors, movie_ids, ratings, top_n=10, reg=0.02,
+                          index=None, nprobe=8):
+    """Top-n unseen movies for a new user described by a few ratings.
+
+    Parameters
+    ----------
+    factors : FactorModel
+        Trained model.
+    movie_ids : array-like (int)
+        MovieLens IDs rated by the user.
+    ratings : array-like (float)
+        The user's ratings of those movies.
+    top_n : int
+        Number of recommendations.
+    reg : float
+        L2 regularisation of the fold-in solve.
+    index : IVFIndex, optional
+        Inner-product index over `ann_index.item_vectors(factors)`; when
+        given, only the items it retrieves are scored.
+    nprobe : int
+        Cells probed in `index`.
+
+    Returns
+    -------
+    tuple
+        MovieLens IDs of the recommendations, best first, and their
+        estimated ratings.
+
+    """
+    pu, bu = fold_in_user(factors, movie_ids, ratings, reg)
+    rated = factors.item_index(movie_ids)
+    rated = rated[rated >= 0]
+    if index is not None:
+        from recommenders.ann_index import user_query
+        found, _ = index.search(user_query(pu), top_n, nprobe, exclude=[rated])
+        top = found[0][found[0] >= 0]
+        est = factors.qi[top] @ pu + factors.bi[top] + bu + factors.global_mean
+        np.clip(est, factors.rating_scale[0], factors.rating_scale[1], out=est)
+        return factors.item_raw_ids[top], est
+    # Rank on unclipped estimates, so items past the top of the scale
+    # keep their order instead of tying
+    est = score_user_vector(factors, pu, bu, clip=False)
+    est[rated] = -np.inf
+    top = top_n_indices(est, top_n)
+    return factors.item_raw_ids[top], np.clip(est[top], *factors.rating_scale)
+
+def update_factors(factors, user_ids, movie_ids, ratings, n_epochs=5,
+                   lr=0.005, reg=0.02, init_std_dev=0.1, seed=0):
+    """Apply a batch of new ratings with SGD over the affected rows only.
+
+    Users and movies not yet in the model are appended: new users are
+    first folded in against the frozen item factors, new movies start
+    from small random factors. Only the rows touched by the batch change.
+
+    Parameters
+    ----------
+    factors : FactorModel
+        Current model; it is not modified.
+    user_ids, movie_ids : array-like (int)
+        Raw ids of the new ratings.
+    ratings : array-like (float)
+        The new ratings.
+    n_epochs : int
+        SGD passes over the batch.
+    lr, reg : float
+        SGD learning rate and regularisation, as in Surprise's SVD.
+    init_std_dev : float
+        Standard deviation of new movies' initial factors.
+    seed : int
+        Random seed for new movies' factors.
+
+    Returns
+    -------
+    FactorModel
+        Updated model, ready to be swapped in (e.g. with
+        `ModelRegistry.swap`).
+
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    ratings = np.asarray(ratings, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    k = factors.qi.shape[1]
+
+    # Copies of the unpadded parameters, grown for unseen ids
+    new_users = np.unique(user_ids[factors.user_index(user_ids) < 0])
+    new_items = np.unique(movie_ids[factors.item_index(movie_ids) < 0])
+    pu = np.vstack([factors.pu[:-1], np.zeros((new_users.size, k))])
+    bu = np.concatenate([factors.bu[:-1], np.zeros(new_users.size)])
+    qi = np.vstack([factors.qi[:-1],
+                    rng.normal(0, init_std_dev, (new_items.size, k))])
+    bi = np.concatenate([factors.bi[:-1], np.zeros(new_items.size)])
+    updated = FactorModel(pu, qi, bu, bi, factors.global_mean,
+                          factors.rating_scale,
+                          np.concatenate([factors.user_raw_ids, new_users]),
+                          np.concatenate([factors.item_raw_ids, new_items]))
+
+    # Warm-start new users from the closed-form fold-in
+    for raw_id in new_users:
+        mine = user_ids == raw_id
+        u = updated.user_index([raw_id])[0]
+        updated.pu[u], updated.bu[u] = fold_in_user(updated, movie_ids[mine],
+                                                    ratings[mine], reg)
+
+    users = updated.user_index(user_ids)
+    items = updated.item_index(movie_ids)
+    mu = updated.global_mean
+    pu, qi, bu, bi = updated.pu, updated.qi, updated.bu, updated.bi
+    for _ in range(n_epochs):
+        for u, i, r in zip(users.tolist(), items.tolist(), ratings.tolist()):
+            err = r - (mu + bu[u] + bi[i] + qi[i] @ pu[u])
+            bu[u] += lr * (err - reg * bu[u])
+            bi[i] += lr * (err - reg * bi[i])
+            pu_u = pu[u].copy()
+            pu[u] += lr * (err * qi[i] - reg * pu[u])
+            qi[i] += lr * (err * pu_u - reg * qi[i])
+    return updated
@@ -0,0 +1,158 @@
+"""
+
+    Hybrid recommender blending content and collaborative candidates.
+
+    Author: Explore Data Science Academy.
+
+    Description: The content-based and collaborative recommenders are run
+    concurrently on a shared thread pool (their heavy lifting happens in
+    NumPy/SciPy, which releases the GIL), so a hybrid request costs about
+    as much as the slower engine rather than the sum of both. Each engine
+    has its own latency budget: an engine that has not answered within
+    its budget, or that fails, is left out and the blend degrades to the
+    engines that did answer. Its work keeps running in the background, so
+    the result still lands in the recommendation cache for the next
+    request.
+
+    The engines return ranked titles, so each candidate list is normalised
+    to rank scores in (0, 1] (1 for the best candidate, falling linearly),
+    and the lists are blended with configurable per-engine weights.
+
+"""
+# Script dependencies
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from recommenders.content_based import content_model
+from recommenders.collaborative_based import collab_model
+from utils.metrics import metrics
+
+# Candidate generators and their default blend weights and budgets (s)
+ENGINES = {'content': content_model, 'collab': collab_model}
+HYBRID_WEIGHTS = {'content': 0.5, 'collab': 0.5}
+HYBRID_TIMEOUTS = {'content': 2.0, 'collab': 10.0}
+# Candidates requested from each engine per recommendation returned
+CANDIDATE_FACTOR = 3
+
+# Pool shared by hybrid requests of this process
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('RECOMMENDER_HYBRID_WORKERS', 4)),
+    thread_name_prefix='hybrid')
+
+def rank_scores(titles):
+    """Normalised scores of a ranked list: 1 for the best, then linear."""
+    n = len(titles)
+    return {title: (n - rank) / n for rank, title in enumerate(titles)}
+
+def blend(candidates, weights, top_n=10):
+    """Blend several engines' normalised candidate scores.
+
+    Parameters
+    ----------
+    candidates : dict
+        Engine name to {title: normalised score}.
+    weights : dict
+        Engine name to blend weight; engines without a weight count 0.
+    top_n : int
+        Number of recommendations.
+
+    Returns
+    -------
+    list (str)
+        Titles with the highest weighted score sum, best first. Ties keep
+        the order in which titles were first seen.
+
+    """
+    totals = {}
+    for name, scores in candidates.items():
+        weight = weights.get(name, 0.0)
+        for title, score in scores.items():
+            totals[title] = totals.get(title, 0.0) + weight * score
+    return sorted(totals, key=totals.get, reverse=True)[:top_n]
+
+def run_engines(movie_list, n_candidates, timeouts=None, engines=None):
+    """Run the engines concurrently, each within its latency budget.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    n_candidates : int
+        Candidates requested from each engine.
+    timeouts : dict, optional
+        Engine name to budget in seconds, counted from submission;
+        defaults to `HYBRID_TIMEOUTS`.
+    engines : dict, optional
+        Engine name to `*_model(movie_list, top_n)` function; defaults to
+        `ENGINES`.
+
+    Returns
+    -------
+    tuple
+        Engine name to ranked titles for the engines that answered in
+        time, and engine name to the reason ('timeout' or the error) for
+        those that did not.
+
+    """
+    engines = engines or ENGINES
+    timeouts = timeouts or HYBRID_TIMEOUTS
+    start = time.monotonic()
+    # Each engine runs in a copy of the caller's context, so its stages are
+    # recorded in the caller's request trace
+    futures = {name: _executor.submit(contextvars.copy_context().run, engine,
+                                      movie_list, n_candidates)
+               for name, engine in engines.items()}
+    results, skipped = {}, {}
+    # Shortest budget first, so each wait ends at that engine's deadline
+    for name in sorted(futures, key=lambda n: timeouts.get(n, float('inf'))):
+        remaining = start + timeouts.get(name, float('inf')) - time.monotonic()
+        try:
+            results[name] = futures[name].result(timeout=max(0.0, remaining))
+        except FutureTimeout:
+            skipped[name] = 'timeout'
+        except Exception as error:
+            skipped[name] = repr(error)
+    return results, skipped
+
+def hybrid_model(movie_list, top_n=10, weights=None, timeouts=None):
+    """Performs hybrid filtering based upon a list of movies supplied
+       by the app user.
+
+    Parameters
+    ----------
+    movie_list : list (str)
+        Favorite movies chosen by the app user.
+    top_n : int
+        Number of top recommendations to return to the user.
+    weights : dict, optional
+        Engine name to blend weight; defaults to `HYBRID_WEIGHTS`.
+    timeouts : dict, optional
+        Engine name to latency budget in seconds; defaults to
+        `HYBRID_TIMEOUTS`.
+
+    Returns
+    -------
+    list (str)
+        Titles of the top-n movie recommendations to the user.
+
+    Raises
+    ------
+    RuntimeError
+        If no engine answered within its budget.
+
+    """
+    weights = weights or HYBRID_WEIGHTS
+    engines = {name: engine for name, engine in ENGINES.items()
+               if weights.get(name, 0.0) > 0}
+    with metrics.request('hybrid'):
+        results, skipped = run_engines(movie_list, top_n * CANDIDATE_FACTOR,
+                                       timeouts, engines)
+        for name in skipped:
+            metrics.count('hybrid.skipped.' + name)
+        if not results:
+            raise RuntimeError('No recommender answered in time: {}'.format(skipped))
+        candidates = {name: rank_scores(titles) for name, titles in results.items()}
+        with metrics.stage('hybrid.blend'):
+            return blend(candidates, weights, top_n)
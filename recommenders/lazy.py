@@ -0,0 +1,129 @@
+"""
+
+    Lazily loaded recommenders for a fast app cold start.
+
+    Author: Explore Data Science Academy.
+
+    Description: Importing `recommenders.content_based` or
+    `recommenders.collaborative_based` loads the rating and movie frames,
+    builds the content index and title index and pulls in the modelling
+    libraries. This module offers drop-in replacements for
+    `content_model`, `collab_model` and `hybrid_model` that import their
+    engine only when first called, so pages that recommend nothing (e.g.
+    'About Us') render without paying for it.
+
+    `start()` applies the startup mode set by `RECOMMENDER_STARTUP`:
+
+      - 'warm' (default): load every engine in a background thread, so the
+        first page renders immediately and the engines are usually ready
+        by the time the user asks for recommendations;
+      - 'lazy': load each engine on its first call only;
+      - 'eager': load every engine before returning.
+
+    How long each engine took to load is kept in `load_times`; see also
+    `python -m utils.import_report` for a per-module import breakdown.
+
+"""
+# Script dependencies
+import importlib
+import os
+import threading
+import time
+from utils.metrics import metrics
+
+STARTUP_MODE = os.environ.get('RECOMMENDER_STARTUP', 'warm')
+
+# Engine name to the module and function implementing it
+ENGINES = {
+    'content_model': ('recommenders.content_based', 'content_model'),
+    'collab_model': ('recommenders.collaborative_based', 'collab_model'),
+    'hybrid_model': ('recommenders.hybrid', 'hybrid_model'),
+}
+
+# Seconds each engine took to load, in the order they were loaded
+load_times = {}
+_engines = {}
+_lock = threading.Lock()
+_warm_up = None
+
+def engine(name):
+    """The recommender function `name`, importing its module on first use.
+
+    Concurrent first calls are safe: the import system lets one thread
+    execute the module while the others wait for it.
+
+    """
+    func = _engines.get(name)
+    if func is None:
+        module_name, attribute = ENGINES[name]
+        start = time.perf_counter()
+        with metrics.stage('startup.load.' + name):
+            func = getattr(importlib.import_module(module_name), attribute)
+        with _lock:
+            load_times.setdefault(name, time.perf_counter() - start)
+            _engines[name] = func
+    return func
+
+def loaded():
+    """Names of the engines loaded so far."""
+    return list(_engines)
+
+def warm_up(names=None, background=True):
+    """Load engines ahead of their first call.
+
+    Parameters
+    ----------
+    names : list (str), optional
+        Engines to load, in order; defaults to all of `ENGINES`.
+    background : bool
+        Load in a daemon thread (started once per process) instead of
+        before returning.
+
+    Returns
+    -------
+    threading.Thread or None
+        The warm-up thread when loading in the background.
+
+    """
+    global _warm_up
+    names = list(names or ENGINES)
+    if not background:
+        for name in names:
+            engine(name)
+        return None
+    with _lock:
+        if _warm_up is None:
+            _warm_up = threading.Thread(target=_load_quietly, args=(names,),
+                                        name='recommender-warm-up', daemon=True)
+            _warm_up.start()
+        return _warm_up
+
+def _load_quietly(names):
+    for name in names:
+        try:
+            engine(name)
+        except Exception:
+            # Left for the first call, which reports the error to the user
+            pass
+
+def start(mode=None):
+    """Apply a startup mode ('warm', 'lazy' or 'eager', see above)."""
+    mode = mode or STARTUP_MODE
+    if mode == 'eager':
+        warm_up(background=False)
+    elif mode == 'warm':
+        warm_up(background=True)
+    elif mode != 'lazy':
+        raise ValueError('Unknown startup mode {!r}'.format(mode))
+
+def content_model(movie_list, top_n=10):
+    """`recommenders.content_based.content_model`, loaded on first use."""
+    return engine('content_model')(movie_list, top_n)
+
+def collab_model(movie_list, top_n=10):
+    """`recommenders.collaborative_based.collab_model`, loaded on first use."""
+    return engine('collab_model')(movie_list, top_n)
+
+def hybrid_model(movie_list, top_n=10, weights=None, timeouts=None):
+    """`recommenders.hybrid.hybrid_model`, loaded on first use."""
+    return engine('hybrid_model')(movie_list, top_n, weights, timeouts)
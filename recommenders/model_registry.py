@@ -0,0 +1,222 @@
+"""
+
+    Registry for the trained SVD model used by the recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Loads the model once per process and serves its factor
+    view to the collaborative recommender. The source pickle is watched
+    for modification: a request that notices a change starts a reload in
+    a background thread and, like the requests after it, keeps being
+    served by the old model until the new one is swapped in atomically.
+    Only the very first load happens on a request's path. A compact
+    `.npz` export holding only the factor arrays and id maps is kept next
+    to the pickle so that cold starts and reloads avoid unpickling the
+    full model and trainset.
+
+    In shared-artifact mode (`RECOMMENDER_SHARED_DIR` set, or a
+    `shared_root` passed explicitly) the factors are published as float32
+    `.npy` columns and opened memory-mapped, so every app process on the
+    host shares one page-cache copy of the model.
+
+"""
+# Script dependencies
+import os
+import pickle
+import threading
+import time
+from recommenders.factor_model import FactorModel
+from utils.metrics import metrics
+from utils.columnar import current_version, open_columns, publish_columns
+
+def _file_signature(path):
+    """Modification time and size of a file, or None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+class ModelRegistry:
+    """Lazily loaded, hot-reloadable SVD factors.
+
+    Parameters
+    ----------
+    model_path : str
+        Path of the pickled Surprise model.
+    factors_path : str, optional
+        Path of the compact factor export. When it is at least as new as
+        the pickle it is loaded instead; otherwise it is (re)written after
+        the pickle has been loaded.
+    check_interval : float
+        Minimum number of seconds between checks of the source file.
+    shared_root : str, optional
+        Root of a memory-mapped columnar export (see `utils.columnar`).
+        When set it takes precedence over `factors_path`.
+
+    """
+
+    def __init__(self, model_path, factors_path=None, check_interval=1.0,
+                 shared_root=None):
+        self.model_path = model_path
+        self.factors_path = factors_path
+        self.shared_root = shared_root
+        self.check_interval = check_interval
+        self.version = 0
+        self._state = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._reloader = None
+        self._reloader_lock = threading.Lock()
+
+    def factors(self):
+        """Return the current `FactorModel`, loading it on first use.
+
+        When the source has changed, a background reload is started and
+        the current model is returned meanwhile.
+
+        """
+        state = self._state
+        if state is None:
+            return self._refresh()[1]
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            if self._signature() != state[0]:
+                self._reload_in_background()
+        return state[1]
+
+    def model_key(self):
+        """Identifier of the served model that is stable across processes.
+
+        Derived from the source file's signature, so caches persisted on
+        disk can tell which model produced a result.
+
+        """
+        self.factors()
+        return self._state[3]
+
+    def add_listener(self, callback):
+        """Call `callback(registry)` after every reload or swap."""
+        self._listeners.append(callback)
+
+    def reload(self):
+        """Force a reload from disk and return the new `FactorModel`."""
+        return self._refresh(force=True)[1]
+
+    def swap(self, factors):
+        """Install an in-memory model, e.g. one updated by `fold_in`.
+
+        The swapped-in model is served until the source file next changes.
+
+        Parameters
+        ----------
+        factors : FactorModel
+            Model to serve.
+
+        """
+        with self._lock:
+            self.version += 1
+            key = 'swap-{}-{}'.format(os.getpid(), time.time_ns())
+            self._state = (self._signature(), factors, self.version, key)
+        self._notify()
+
+    def export(self, path=None):
+        """Write the compact factor export for the current model.
+
+        Parameters
+        ----------
+        path : str, optional
+            Destination; defaults to `factors_path`.
+
+        """
+        self.factors().save(path or self.factors_path)
+
+    def _reload_in_background(self):
+        """Start a reload thread, unless one is already running."""
+        with self._reloader_lock:
+            if self._reloader is not None and self._reloader.is_alive():
+                return
+            self._reloader = threading.Thread(target=self._reload_quietly,
+                                              name='model-reload', daemon=True)
+            self._reloader.start()
+
+    def _reload_quietly(self):
+        try:
+            self._refresh()
+        except Exception:
+            # E.g. a half-written pickle: the old model stays in service and
+            # the next check retries
+            pass
+
+    def _refresh(self, force=False):
+        with self._lock:
+            state = self._state
+            signature = self._signature()
+            if state is not None and not force and state[0] == signature:
+                return state
+            with metrics.stage('model.load'):
+                factors = self._load()
+            if self.shared_root:
+                # Include the version this load may have just published, or
+                # the next check would take it for another process's export
+                signature = (signature[0], current_version(self.shared_root))
+            metrics.count('model.loads')
+            self.version += 1
+            # Single assignment, so readers see either the old or new model
+            self._state = state = (signature, factors, self.version,
+                                   repr(signature))
+        self._notify()
+        return state
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            callback(self)
+
+    def _signature(self):
+        signature = _file_signature(self.model_path)
+        if self.shared_root:
+            # Pick up exports published by other processes as well
+            return (signature, current_version(self.shared_root))
+        return signature
+
+    def _load(self):
+        model_sig = _file_signature(self.model_path)
+        if self.shared_root:
+            return self._load_shared(model_sig)
+        compact = self.factors_path and _file_signature(self.factors_path)
+        if compact and (model_sig is None or
+                        os.path.getmtime(self.factors_path) >=
+                        os.path.getmtime(self.model_path)):
+            with metrics.stage('model.load_factors'):
+                return FactorModel.load(self.factors_path)
+        factors = self._unpickle()
+        if self.factors_path:
+            try:
+                factors.save(self.factors_path)
+            except OSError:
+                pass
+        return factors
+
+    def _load_shared(self, model_sig):
+        version, columns = open_columns(self.shared_root)
+        if version is not None and (
+                model_sig is None or
+                int(version.split('-')[0]) >= model_sig[0]):
+            return FactorModel.from_columns(columns)
+        factors = self._unpickle()
+        publish_columns(self.shared_root, factors.to_columns())
+        _, columns = open_columns(self.shared_root)
+        return FactorModel.from_columns(columns)
+
+    def _unpickle(self):
+        with metrics.stage('model.unpickle'), open(self.model_path, 'rb') as f:
+            model = pickle.load(f)
+        with metrics.stage('model.extract_factors'):
+            return FactorModel.from_surprise(model)
+
+# Registry of the model served by the app
+svd_registry = ModelRegistry('resources/models/SVD.pkl',
+                             'resources/models/SVD_factors.npz',
+                             shared_root=os.environ.get('RECOMMENDER_SHARED_DIR'))
@@ -0,0 +1,308 @@
+"""
+
+    Offline top-K neighbour tables for every movie in the catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: A batch job precomputes, for every movie in `movies.csv`,
+    its K most similar movies under the hashed content features of
+    `recommenders.content_index` and under the SVD item factors. The
+    tables are stored as int32 neighbour row / float16 score arrays and
+    published as a versioned columnar artifact whose `CURRENT` pointer is
+    swapped atomically, so running app processes never read a
+    half-written table. At request time the three favourites' neighbour
+    lists are merged, which costs O(K) instead of a scan of the catalogue.
+
+    Each table records the hash of the `movies.csv` it was built from and
+    the registry key of the SVD model behind its collaborative table.
+    Recommenders pass the catalogue and model they serve, and a table
+    built from anything else is ignored rather than served stale.
+
+    Usage (from the repository root):
+
+        python -m recommenders.neighbours --k 50
+
+"""
+# Script dependencies
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import sparse
+from recommenders.content_index import N_FEATURES, hash_features
+from recommenders.factor_model import build_id_lookup, lookup_ids
+from utils.columnar import current_version, open_columns, publish_columns
+from utils.data_store import file_hash, load_movies
+
+NEIGHBOURS_ROOT = 'resources/models/neighbours'
+BLOCK_SIZE = 256
+
+def content_features(movies):
+    """Sparse hashed content vectors of every catalogue row.
+
+    The rows the content index holds for these movies, so dot products
+    are the content model's cosine similarities.
+
+    """
+    indptr, indices, data = hash_features(movies['title'], movies['genres'])
+    return sparse.csr_matrix((data, indices, indptr),
+                             shape=(len(movies), N_FEATURES))
+
+def top_k_neighbours(features, k, block_size=BLOCK_SIZE, workers=None):
+    """Top-k cosine neighbours of every row of a normalised feature matrix.
+
+    Identical rows (e.g. movies sharing a genre combination) are scored
+    once, and all-zero rows (e.g. movies unknown to the SVD) are skipped
+    entirely. Blocks of distinct rows are processed on a thread pool; the
+    matrix products and partial sorts run in NumPy, which releases the GIL.
+
+    Parameters
+    ----------
+    features : numpy.ndarray or scipy.sparse.csr_matrix
+        Row-normalised (n, d) features; all-zero rows get no neighbours.
+        Sparse rows are not deduplicated.
+    k : int
+        Neighbours kept per row.
+    block_size : int
+        Rows scored per block; bounds memory at block_size x n floats.
+    workers : int, optional
+        Threads; defaults to the number of cores.
+
+    Returns
+    -------
+    tuple
+        (n, k) int32 neighbour rows, best first and -1 padded, and the
+        matching float16 similarities.
+
+    """
+    n = features.shape[0]
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    scores = np.zeros((n, k), dtype=np.float16)
+    if sparse.issparse(features):
+        features = features.tocsr()
+        rows = np.flatnonzero(np.diff(features.indptr))
+    else:
+        rows = np.flatnonzero(features.any(axis=1))
+    # One extra neighbour, so that a row's own entry can be dropped
+    m = min(k + 1, rows.size)
+    if m < 2:
+        return neighbours, scores
+    dense = features[rows]
+    if sparse.issparse(dense):
+        distinct, inverse = dense, np.arange(rows.size)
+    else:
+        distinct, inverse = np.unique(dense, axis=0, return_inverse=True)
+    transposed = dense.T.tocsr() if sparse.issparse(dense) else dense.T
+    top = np.empty((distinct.shape[0], m), dtype=np.int64)
+    top_sims = np.empty((distinct.shape[0], m), dtype=np.float32)
+
+    def run(start):
+        stop = min(start + block_size, distinct.shape[0])
+        sims = distinct[start:stop] @ transposed
+        if sparse.issparse(sims):
+            sims = sims.toarray()
+        block = np.argpartition(-sims, m - 1, axis=1)[:, :m]
+        block_sims = np.take_along_axis(sims, block, axis=1)
+        order = np.lexsort((block, -block_sims), axis=1)
+        top[start:stop] = np.take_along_axis(block, order, axis=1)
+        top_sims[start:stop] = np.take_along_axis(block_sims, order, axis=1)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(run, range(0, distinct.shape[0], block_size)))
+
+    # Drop each row's own entry, or the weakest one if it is not listed
+    own = np.arange(rows.size)
+    lists, sims = top[inverse.ravel()], top_sims[inverse.ravel()]
+    drop = lists == own[:, None]
+    drop[~drop.any(axis=1), -1] = True
+    lists = lists[~drop].reshape(rows.size, m - 1)
+    sims = sims[~drop].reshape(rows.size, m - 1)
+    neighbours[rows, :m - 1] = rows[lists]
+    scores[rows, :m - 1] = sims
+    return neighbours, scores
+
+def factor_features(factors, movie_ids):
+    """L2-normalised SVD item factors aligned with catalogue rows.
+
+    Movies unknown to the model get an all-zero row.
+
+    """
+    items = factors.item_index(movie_ids)
+    qi = np.asarray(factors.qi, dtype=np.float32)
+    features = qi[items]
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    np.divide(features, norms, out=features, where=norms > 0)
+    features[items < 0] = 0
+    return features
+
+def build_neighbour_tables(movies, factors=None, k=50, workers=None,
+                           catalogue='', model_key=''):
+    """Compute the content and collaborative neighbour tables.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Catalogue with `movieId`, `title` and `genres` columns.
+    factors : FactorModel, optional
+        Trained SVD factors; the collaborative table is skipped if None.
+    k : int
+        Neighbours kept per movie.
+    workers : int, optional
+        Threads used per table.
+    catalogue : str
+        Hash of the catalogue file `movies` was loaded from.
+    model_key : str
+        `svd_registry.model_key()` of `factors`.
+
+    Returns
+    -------
+    dict
+        Columns ready for `utils.columnar.publish_columns`.
+
+    """
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int32)
+    columns = {'movie_ids': movie_ids, 'catalogue': np.asarray(catalogue)}
+    columns['content_neighbours'], columns['content_scores'] = \
+        top_k_neighbours(content_features(movies), k, workers=workers)
+    if factors is not None:
+        columns['collab_neighbours'], columns['collab_scores'] = \
+            top_k_neighbours(factor_features(factors, movie_ids), k,
+                             workers=workers)
+        columns['model_key'] = np.asarray(model_key)
+    return columns
+
+def merge_neighbours(neighbours, scores, rows, top_n, exclude=()):
+    """Merge the neighbour lists of several rows by summed similarity.
+
+    Parameters
+    ----------
+    neighbours, scores : numpy.ndarray
+        A neighbour table and its scores.
+    rows : array-like (int)
+        Table rows of the query movies (-1 entries are ignored).
+    top_n : int
+        Number of merged neighbours to return.
+    exclude : array-like (int)
+        Rows never returned, e.g. the query movies themselves.
+
+    Returns
+    -------
+    numpy.ndarray
+        Table rows of the top-n merged neighbours, best first.
+
+    """
+    rows = np.asarray(rows)
+    rows = rows[rows >= 0]
+    candidates = np.asarray(neighbours[rows]).ravel()
+    weights = np.asarray(scores[rows], dtype=np.float32).ravel()
+    keep = (candidates >= 0) & ~np.isin(candidates, np.asarray(exclude))
+    candidates, weights = candidates[keep], weights[keep]
+    if candidates.size == 0:
+        return candidates
+    unique, inverse = np.unique(candidates, return_inverse=True)
+    totals = np.bincount(inverse, weights=weights)
+    n = min(top_n, unique.size)
+    top = np.argpartition(-totals, n - 1)[:n]
+    return unique[top[np.argsort(-totals[top], kind='stable')]]
+
+class NeighbourTables:
+    """Memory-mapped view of the current published neighbour tables.
+
+    The `CURRENT` pointer is re-read at most every `check_interval`
+    seconds, so a newly published version is picked up without a restart.
+
+    """
+
+    def __init__(self, root=NEIGHBOURS_ROOT, check_interval=5.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._state = (None, None, None)
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        self.get()
+        return self._state[0]
+
+    def get(self):
+        """Current columns (with a `movie_lookup` array), or None."""
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            version = current_version(self.root)
+            if version != self._state[0]:
+                with self._lock:
+                    version, columns = open_columns(self.root)
+                    if columns is not None:
+                        columns['movie_lookup'] = build_id_lookup(columns['movie_ids'])
+                    self._state = (version, columns, now)
+        return self._state[1]
+
+    def recommend(self, kind, movie_ids, top_n=10, catalogue=None, model_key=None):
+        """Merge the favourites' neighbour lists from one table.
+
+        Parameters
+        ----------
+        kind : str
+            'content' or 'collab'.
+        movie_ids : array-like (int)
+            MovieLens IDs of the favourites.
+        top_n : int
+            Number of recommendations.
+        catalogue : str, optional
+            Hash of the served `movies.csv`; the table must match it.
+        model_key : str, optional
+            Registry key of the served SVD model; the table must match it.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            MovieLens IDs of the recommendations, or None when no matching
+            table of that kind is published.
+
+        """
+        columns = self.get()
+        if columns is None or kind + '_neighbours' not in columns:
+            return None
+        for name, expected in (('catalogue', catalogue), ('model_key', model_key)):
+            if expected is not None and (name not in columns
+                                         or str(columns[name][()]) != expected):
+                return None
+        rows = lookup_ids(columns['movie_lookup'], movie_ids)
+        top = merge_neighbours(columns[kind + '_neighbours'],
+                               columns[kind + '_scores'], rows, top_n,
+                               exclude=rows[rows >= 0])
+        return np.asarray(columns['movie_ids'])[top]
+
+# Neighbour tables served to the recommenders of this process
+neighbour_tables = NeighbourTables(os.environ.get('RECOMMENDER_NEIGHBOURS_DIR',
+                                                  NEIGHBOURS_ROOT))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute top-K neighbour tables.')
+    parser.add_argument('--k', type=int, default=50)
+    parser.add_argument('--root', default=NEIGHBOURS_ROOT)
+    parser.add_argument('--movies', default='resources/data/movies.csv')
+    parser.add_argument('--no-collab', action='store_true',
+                        help='Skip the SVD item-factor table.')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    factors, model_key = None, ''
+    if not args.no_collab:
+        from recommenders.model_registry import svd_registry
+        factors, model_key = svd_registry.factors(), svd_registry.model_key()
+    columns = build_neighbour_tables(load_movies(args.movies), factors,
+                                     args.k, args.workers,
+                                     catalogue=file_hash(args.movies),
+                                     model_key=model_key)
+    version = publish_columns(args.root, columns)
+    print(f"Published neighbour tables {version} to {args.root} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+"""
+
+    Popularity and per-genre aggregates for cold start and prefiltering.
+
+    Author: Explore Data Science Academy.
+
+    Description: An offline aggregation over `ratings.csv` computes, for
+    every movie in the catalogue, its rating count, mean rating and a
+    Bayesian-damped score (the mean shrunk towards the global mean by a
+    prior of `prior_count` ratings, so a movie with two 5-star ratings
+    does not outrank one with thousands of 4.5s). The aggregation is a
+    pair of `np.bincount` calls over catalogue rows. From the scores it
+    derives the catalogue order by score and, for every genre, the top-N
+    movies of that genre.
+
+    The tables are published as a versioned columnar artifact (see
+    `utils.columnar`), like the neighbour tables. When none is published
+    they are built in-process from the shared data frames on first use.
+    The recommenders use them as an O(K) fallback when a model has
+    nothing (or too little) to say about the chosen movies, and as a
+    candidate pre-filter so that only the most plausible few thousand
+    movies are fully scored.
+
+    Usage (from the repository root):
+
+        python -m recommenders.popularity --top-n 100
+
+"""
+# Script dependencies
+import argparse
+import os
+import threading
+import time
+import numpy as np
+from recommenders.factor_model import build_id_lookup, lookup_ids
+from recommenders.genre_bitset import popcount
+from utils.columnar import current_version, open_columns, publish_columns
+from utils.data_store import file_hash, load_movies, load_ratings
+
+POPULARITY_ROOT = 'resources/models/popularity'
+GENRE_TOP_N = 100
+
+def movie_aggregates(movie_ids, rated_ids, ratings, prior_count=None):
+    """Rating count, mean and Bayesian-damped score of every movie.
+
+    Parameters
+    ----------
+    movie_ids : array-like (int)
+        MovieLens IDs of the catalogue rows.
+    rated_ids : array-like (int)
+        MovieLens ID of every rating.
+    ratings : array-like (float)
+        The ratings.
+    prior_count : float, optional
+        Weight, in ratings, of the global-mean prior; defaults to the mean
+        number of ratings of a rated movie.
+
+    Returns
+    -------
+    dict
+        int32 `count`, float32 `mean` (0 when unrated) and float32 `score`
+        per catalogue row, plus the `global_mean` and `prior_count` used.
+
+    """
+    rows = lookup_ids(build_id_lookup(movie_ids), rated_ids)
+    known = rows >= 0
+    rows = rows[known]
+    ratings = np.asarray(ratings, dtype=np.float64)[known]
+    n = len(movie_ids)
+    counts = np.bincount(rows, minlength=n)
+    sums = np.bincount(rows, weights=ratings, minlength=n)
+    global_mean = float(ratings.mean()) if ratings.size else 0.0
+    if prior_count is None:
+        prior_count = float(counts[counts > 0].mean()) if rows.size else 1.0
+    mean = np.divide(sums, counts, out=np.zeros(n), where=counts > 0)
+    score = (prior_count * global_mean + sums) / (prior_count + counts)
+    return {'count': counts.astype(np.int32), 'mean': mean.astype(np.float32),
+            'score': score.astype(np.float32),
+            'global_mean': np.float64(global_mean),
+            'prior_count': np.float64(prior_count)}
+
+def genre_top_lists(masks, score, n_genres, top_n=GENRE_TOP_N):
+    """Top-n catalogue rows by score of every genre.
+
+    Parameters
+    ----------
+    masks : numpy.ndarray
+        uint32 genre mask per catalogue row.
+    score : numpy.ndarray
+        Score per catalogue row.
+    n_genres : int
+        Number of genre bits.
+    top_n : int
+        Rows kept per genre.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n_genres, top_n) int32 rows, best first and -1 padded.
+
+    """
+    masks = np.asarray(masks, dtype=np.uint32)
+    # Best-first order of the whole catalogue, ties broken by row
+    order = np.lexsort((np.arange(score.size), -score))
+    ordered_masks = masks[order]
+    lists = np.full((n_genres, top_n), -1, dtype=np.int32)
+    for bit in range(n_genres):
+        rows = order[(ordered_masks & np.uint32(1 << bit)) != 0][:top_n]
+        lists[bit, :rows.size] = rows
+    return lists
+
+def build_popularity(movies, ratings, top_n=GENRE_TOP_N, prior_count=None):
+    """Compute the popularity tables of a catalogue.
+
+    Parameters
+    ----------
+    movies : Pandas Dataframe
+        Catalogue with `movieId` and `genre_mask` columns (as returned by
+        `utils.data_store.load_movies`).
+    ratings : Pandas Dataframe
+        Ratings with `movieId` and `rating` columns.
+    top_n : int
+        Movies kept per genre.
+    prior_count : float, optional
+        See `movie_aggregates`.
+
+    Returns
+    -------
+    dict
+        Columns ready for `utils.columnar.publish_columns`.
+
+    """
+    movie_ids = movies['movieId'].to_numpy(dtype=np.int32)
+    columns = movie_aggregates(movie_ids, ratings['movieId'].to_numpy(),
+                               ratings['rating'].to_numpy(), prior_count)
+    score = columns['score']
+    columns['movie_ids'] = movie_ids
+    columns['by_score'] = np.lexsort((np.arange(score.size), -score)).astype(np.int32)
+    columns['genre_mask'] = movies['genre_mask'].to_numpy(dtype=np.uint32)
+    columns['genre_top'] = genre_top_lists(columns['genre_mask'], score,
+                                           len(movies.attrs['genre_vocabulary']),
+                                           top_n)
+    return columns
+
+class PopularityTables:
+    """Current popularity tables: published, or built in-process.
+
+    The `CURRENT` pointer of `root` is re-read at most every
+    `check_interval` seconds. Without a published version the tables are
+    computed from the shared movie and rating frames, and rebuilt when
+    those are reloaded.
+
+    """
+
+    def __init__(self, root=POPULARITY_ROOT, movies_path='resources/data/movies.csv',
+                 ratings_path='resources/data/ratings.csv', check_interval=5.0):
+        self.root = root
+        self.movies_path = movies_path
+        self.ratings_path = ratings_path
+        self.check_interval = check_interval
+        self._state = (None, None, None)
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        return self.get()['version']
+
+    def get(self):
+        """Current columns, with a `movie_lookup` array and a `version`."""
+        now = time.monotonic()
+        if self._state[1] is None or now - self._last_check >= self.check_interval:
+            self._last_check = now
+            with self._lock:
+                self._state = self._refresh()
+        return self._state[1]
+
+    def _refresh(self):
+        version = current_version(self.root)
+        if version is not None:
+            if version != self._state[0]:
+                version, columns = open_columns(self.root)
+                return self._finish(version, columns, None)
+            return self._state
+        movies = load_movies(self.movies_path)
+        ratings = load_ratings(self.ratings_path)
+        frames = self._state[2]
+        if frames is not None and frames[0] is movies and frames[1] is ratings:
+            return self._state
+        columns = build_popularity(movies, ratings)
+        version = 'local-{:.12}-{:.12}'.format(file_hash(self.movies_path),
+                                               file_hash(self.ratings_path))
+        return self._finish(version, columns, (movies, ratings))
+
+    @staticmethod
+    def _finish(version, columns, frames):
+        columns['movie_lookup'] = build_id_lookup(columns['movie_ids'])
+        columns['version'] = version
+        return (version, columns, frames)
+
+    def candidates(self, k):
+        """MovieLens IDs of the `k` best-scored movies, best first."""
+        columns = self.get()
+        return np.asarray(columns['movie_ids'])[columns['by_score'][:k]]
+
+    def recommend(self, movie_ids, top_n=10, exclude=()):
+        """Popular movies sharing the favourites' genres.
+
+        Candidates are the per-genre top lists of the favourites' genres,
+        ranked by how many of those genres they share, then by score. When
+        no favourite is in the catalogue, the most popular movies overall
+        are returned.
+
+        Parameters
+        ----------
+        movie_ids : array-like (int)
+            MovieLens IDs of the favourites (-1 entries are ignored).
+        top_n : int
+            Number of recommendations.
+        exclude : array-like (int)
+            MovieLens IDs never returned; the favourites always are.
+
+        Returns
+        -------
+        numpy.ndarray
+            MovieLens IDs of the recommendations, best first.
+
+        """
+        columns = self.get()
+        all_ids = np.asarray(columns['movie_ids'])
+        rows = lookup_ids(columns['movie_lookup'], movie_ids)
+        rows = rows[rows >= 0]
+        excluded = lookup_ids(columns['movie_lookup'],
+                              np.concatenate([np.asarray(movie_ids, dtype=np.int64),
+                                              np.asarray(exclude, dtype=np.int64)]))
+        excluded = excluded[excluded >= 0]
+        masks = np.asarray(columns['genre_mask'])
+        wanted = np.bitwise_or.reduce(masks[rows]) if rows.size else np.uint32(0)
+        bits = [b for b in range(columns['genre_top'].shape[0]) if wanted >> b & 1]
+        if bits:
+            candidates = np.unique(np.asarray(columns['genre_top'])[bits].ravel())
+            candidates = candidates[candidates >= 0]
+        else:
+            candidates = np.asarray(columns['by_score'][:top_n + excluded.size])
+        candidates = candidates[~np.isin(candidates, excluded)]
+        shared = popcount(masks[candidates] & wanted).astype(np.int64)
+        order = np.lexsort((candidates, -np.asarray(columns['score'])[candidates],
+                            -shared))
+        return all_ids[candidates[order[:top_n]]]
+
+# Popularity tables served to the recommenders of this process
+popularity_tables = PopularityTables(os.environ.get('RECOMMENDER_POPULARITY_DIR',
+                                                    POPULARITY_ROOT))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompute popularity tables.')
+    parser.add_argument('--top-n', type=int, default=GENRE_TOP_N,
+                        help='Movies kept per genre.')
+    parser.add_argument('--prior-count', type=float, default=None,
+                        help='Weight of the global-mean prior, in ratings.')
+    parser.add_argument('--root', default=POPULARITY_ROOT)
+    parser.add_argument('--movies', default='resources/data/movies.csv')
+    parser.add_argument('--ratings', default='resources/data/ratings.csv')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    columns = build_popularity(load_movies(args.movies), load_ratings(args.ratings),
+                               args.top_n, args.prior_count)
+    version = publish_columns(args.root, columns)
+    print(f"Published popularity tables {version} to {args.root} "
+          f"in {time.perf_counter() - start:.2f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+"""
+
+    Local HTTP recommendation service with micro-batching.
+
+    Author: Explore Data Science Academy.
+
+    Description: A standalone asyncio HTTP/1.1 server (standard library
+    only) that loads the recommenders once and serves them to any number
+    of app sessions, so the Streamlit processes no longer hold the models
+    themselves (see `recommenders.service_client`).
+
+    Requests for the same algorithm that arrive within a few milliseconds
+    of each other are coalesced by a `MicroBatcher` into a single call of
+    a batch function, run on a worker thread so the event loop keeps
+    accepting connections. For the content model the batch is one sparse
+    product over the content index (`content_model_batch`); the
+    collaborative model scores the users of all coalesced lists in one
+    matrix product (`collab_model_batch`).
+    Hybrid requests are split into a content and a collaborative request,
+    which join those engines' batches concurrently and are blended as in
+    `recommenders.hybrid` (per-engine latency budgets, graceful
+    degradation). A batch that fails is retried list by list, so one bad
+    request cannot fail its neighbours. Malformed requests (request line,
+    Content-Length) are answered with 400 and the connection is closed.
+
+    Endpoints:
+      - `POST /recommend/<algorithm>` with a JSON body
+        `{"movies": [...], "top_n": 10}` (hybrid also accepts
+        `"weights": {"content": w, "collab": w}` and per-engine latency
+        budgets in seconds as `"timeouts"`); answers
+        `{"recommendations": [...]}`. Algorithms: content, collab, hybrid.
+      - `GET /health`: status and per-algorithm batching counters.
+      - `GET /metrics`: the service's stage timings, counters and recent
+        request traces (see `utils.metrics`; recorded when the service runs
+        with `RECOMMENDER_METRICS=1`).
+
+    Usage (from the repository root):
+
+        python -m recommenders.service --port 8765
+
+"""
+# Script dependencies
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import metrics
+
+HOST = '127.0.0.1'
+PORT = 8765
+# Coalescing window (s) and largest batch per algorithm
+BATCH_WINDOW = 0.005
+MAX_BATCH = 64
+# Largest accepted request body (bytes)
+MAX_BODY = 64 * 1024
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class MicroBatcher:
+    """Coalesce concurrent requests into calls of a batch function.
+
+    Parameters
+    ----------
+    batch_fn : callable
+        `batch_fn(movie_lists, top_n)` returning one result per list.
+    single_fn : callable
+        `single_fn(movie_list, top_n)`, used to isolate failures when a
+        batch raises.
+    executor : concurrent.futures.Executor
+        Runs the (blocking) batch calls.
+    window : float
+        Seconds to wait for more requests after the first of a batch.
+    max_batch : int
+        Batch size that triggers an immediate flush.
+
+    """
+
+    def __init__(self, batch_fn, single_fn, executor, window=BATCH_WINDOW,
+                 max_batch=MAX_BATCH):
+        self.batch_fn = batch_fn
+        self.single_fn = single_fn
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self.stats = {'requests': 0, 'batches': 0, 'largest_batch': 0}
+
+    async def submit(self, movie_list, top_n):
+        """Queue one request and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((movie_list, top_n, future))
+        self.stats['requests'] += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.stats['batches'] += 1
+            self.stats['largest_batch'] = max(self.stats['largest_batch'], len(batch))
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        lists = [movie_list for movie_list, _, _ in batch]
+        # One call at the largest requested size; shorter requests are cut
+        top_n = max(n for _, n, _ in batch)
+        try:
+            results = await loop.run_in_executor(self.executor, self.batch_fn,
+                                                 lists, top_n)
+        except Exception:
+            results = await loop.run_in_executor(self.executor, self._isolate,
+                                                 lists, top_n)
+        for (_, n, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(list(result)[:n])
+
+    def _isolate(self, lists, top_n):
+        results = []
+        for movie_list in lists:
+            try:
+                results.append(self.single_fn(movie_list, top_n))
+            except Exception as error:
+                results.append(error)
+        return results
+
+def build_batchers(executor, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+    """Load the recommenders and wrap each in a `MicroBatcher`."""
+    from recommenders.content_based import content_model, content_model_batch
+    from recommenders.collaborative_based import collab_model, collab_model_batch
+    return {
+        'content': MicroBatcher(content_model_batch, content_model, executor,
+                                window, max_batch),
+        'collab': MicroBatcher(collab_model_batch, collab_model, executor,
+                               window, max_batch),
+    }
+
+class RecommenderService:
+    """asyncio HTTP front end over a set of `MicroBatcher`s.
+
+    Parameters
+    ----------
+    batchers : dict
+        Algorithm name to `MicroBatcher`.
+
+    """
+
+    def __init__(self, batchers):
+        self.batchers = batchers
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one (keep-alive) connection."""
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as error:
+                    # The rest of the stream cannot be framed: answer and close
+                    self._write_response(writer, 400, {
+                        'error': 'Malformed request: {}'.format(error)}, False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, payload = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self._write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body):
+        """Status code and JSON payload of one request."""
+        if method == 'GET' and path == '/health':
+            return 200, {'status': 'ok',
+                         'batching': {name: batcher.stats
+                                      for name, batcher in self.batchers.items()}}
+        if method == 'GET' and path == '/metrics':
+            return 200, metrics.snapshot()
+        algorithm = path[len('/recommend/'):] if path.startswith('/recommend/') else None
+        if method != 'POST' or (algorithm not in self.batchers and
+                                algorithm != 'hybrid'):
+            return 404, {'error': 'Unknown endpoint {} {}'.format(method, path)}
+        if body is None:
+            return 413, {'error': 'Request body too large'}
+        try:
+            request = json.loads(body or b'{}')
+            movies = [str(title) for title in request['movies']]
+            top_n = int(request.get('top_n', 10))
+            weights = {str(name): float(w)
+                       for name, w in (request.get('weights') or {}).items()}
+            timeouts = {str(name): float(t)
+                        for name, t in (request.get('timeouts') or {}).items()}
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return 400, {'error': 'Invalid request: {!r}'.format(error)}
+        try:
+            if algorithm == 'hybrid':
+                result = await self.hybrid(movies, top_n, weights or None,
+                                           timeouts or None)
+            else:
+                result = await self.batchers[algorithm].submit(movies, top_n)
+        except KeyError as error:
+            return 400, {'error': 'Unknown movie: {}'.format(error)}
+        except Exception as error:
+            return 500, {'error': repr(error)}
+        return 200, {'recommendations': result}
+
+    async def hybrid(self, movies, top_n=10, weights=None, timeouts=None):
+        """Blend the batched engines' candidates, as `hybrid_model` does."""
+        from recommenders.hybrid import (CANDIDATE_FACTOR, HYBRID_TIMEOUTS,
+                                         HYBRID_WEIGHTS, blend, rank_scores)
+        weights = weights or HYBRID_WEIGHTS
+        timeouts = timeouts or HYBRID_TIMEOUTS
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        tasks = {name: asyncio.ensure_future(
+                     batcher.submit(movies, top_n * CANDIDATE_FACTOR))
+                 for name, batcher in self.batchers.items()
+                 if weights.get(name, 0.0) > 0}
+        results, errors = {}, []
+        # Shortest budget first, so each wait ends at that engine's deadline
+        for name in sorted(tasks, key=lambda n: timeouts.get(n, float('inf'))):
+            remaining = start + timeouts.get(name, float('inf')) - loop.time()
+            try:
+                # Shielded: a late batch result still completes normally
+                results[name] = await asyncio.wait_for(asyncio.shield(tasks[name]),
+                                                       max(0.0, remaining))
+            except asyncio.TimeoutError:
+                errors.append(RuntimeError('{} timed out'.format(name)))
+            except Exception as error:
+                errors.append(error)
+        if not results:
+            raise errors[0] if errors else RuntimeError('No recommender selected')
+        candidates = {name: rank_scores(titles) for name, titles in results.items()}
+        return blend(candidates, weights, top_n)
+
+    async def _read_request(self, reader):
+        """Method, path, headers and body of the next request.
+
+        Returns None at the end of the stream, and a None body when the
+        body is too large. Raises ValueError when the request line or
+        Content-Length is malformed.
+
+        """
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        parts = line.decode('latin-1').split(' ', 2)
+        if len(parts) != 3:
+            raise ValueError('bad request line {!r}'.format(line[:100]))
+        method, path, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError('negative Content-Length')
+        if length > MAX_BODY:
+            return method, path, dict(headers, connection='close'), None
+        body = await reader.readexactly(length) if length else b''
+        return method, path, headers, body
+
+    @staticmethod
+    def _write_response(writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = ('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                'Content-Length: {}\r\nConnection: {}\r\n\r\n').format(
+                    status, _REASONS[status], len(body),
+                    'keep-alive' if keep_alive else 'close')
+        writer.write(head.encode('latin-1') + body)
+
+async def serve(host=HOST, port=PORT, window=BATCH_WINDOW, max_batch=MAX_BATCH,
+                workers=None):
+    """Load the models and serve until cancelled."""
+    executor = ThreadPoolExecutor(max_workers=workers or min(4, os.cpu_count() or 1),
+                                  thread_name_prefix='service')
+    service = RecommenderService(build_batchers(executor, window, max_batch))
+    server = await asyncio.start_server(service.handle, host, port)
+    print('Serving recommendations on http://{}:{}'.format(host, port), flush=True)
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recommendation HTTP service.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--window-ms', type=float, default=1000 * BATCH_WINDOW,
+                        help='Micro-batching window in milliseconds.')
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.window_ms / 1000,
+                          args.max_batch, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
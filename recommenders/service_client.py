@@ -0,0 +1,102 @@
+"""
+
+    Client of the local recommendation HTTP service.
+
+    Author: Explore Data Science Academy.
+
+    Description: Drop-in replacements for `content_model`, `collab_model`
+    and `hybrid_model` that call a running `recommenders.service` instead
+    of loading the models in-process. Importing this module loads no model
+    or data, so app sessions using it start fast and stay small.
+
+    The app switches to the service when `RECOMMENDER_SERVICE_URL` is set,
+    e.g. `RECOMMENDER_SERVICE_URL=http://127.0.0.1:8765`.
+
+"""
+# Script dependencies
+import json
+import os
+import urllib.error
+import urllib.request
+
+SERVICE_URL = os.environ.get('RECOMMENDER_SERVICE_URL')
+TIMEOUT = float(os.environ.get('RECOMMENDER_SERVICE_TIMEOUT', 30))
+
+class RecommenderClient:
+    """Calls the recommendation endpoints of a service.
+
+    Parameters
+    ----------
+    base_url : str
+        Service root, e.g. 'http://127.0.0.1:8765'.
+    timeout : float
+        Seconds to wait for a response.
+
+    """
+
+    def __init__(self, base_url, timeout=TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def recommend(self, algorithm, movie_list, top_n=10, **options):
+        """Recommendations of one algorithm for a list of favourite movies.
+
+        Extra keyword arguments (e.g. hybrid `weights`) are sent with the
+        request.
+
+        Raises
+        ------
+        KeyError
+            If the service does not know one of the movies.
+        RuntimeError
+            If the service fails or cannot be reached.
+
+        """
+        body = json.dumps(dict(options, movies=list(movie_list), top_n=top_n))
+        request = urllib.request.Request(
+            '{}/recommend/{}'.format(self.base_url, algorithm),
+            data=body.encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.load(response)['recommendations']
+        except urllib.error.HTTPError as error:
+            try:
+                message = json.load(error).get('error', str(error))
+            except (ValueError, AttributeError):
+                # Not the service's JSON, e.g. the error page of a proxy
+                message = str(error)
+            if error.code == 400 and message.startswith('Unknown movie'):
+                raise KeyError(message) from None
+            raise RuntimeError(message) from None
+        except urllib.error.URLError as error:
+            raise RuntimeError('Recommendation service unavailable: {}'.format(
+                error.reason)) from None
+
+    def health(self):
+        """Status and batching counters of the service."""
+        with urllib.request.urlopen(self.base_url + '/health',
+                                    timeout=self.timeout) as response:
+            return json.load(response)
+
+    def metrics(self):
+        """Metrics snapshot of the service (see `utils.metrics`)."""
+        with urllib.request.urlopen(self.base_url + '/metrics',
+                                    timeout=self.timeout) as response:
+            return json.load(response)
+
+# Client of the service configured for this process
+client = RecommenderClient(SERVICE_URL) if SERVICE_URL else None
+
+def content_model(movie_list, top_n=10):
+    """`recommenders.content_based.content_model`, served remotely."""
+    return client.recommend('content', movie_list, top_n)
+
+def collab_model(movie_list, top_n=10):
+    """`recommenders.collaborative_based.collab_model`, served remotely."""
+    return client.recommend('collab', movie_list, top_n)
+
+def hybrid_model(movie_list, top_n=10, weights=None, timeouts=None):
+    """`recommenders.hybrid.hybrid_model`, served remotely."""
+    return client.recommend('hybrid', movie_list, top_n, weights=weights,
+                            timeouts=timeouts)
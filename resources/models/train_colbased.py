@@ -4,36 +4,252 @@
 
     Author: Explore Data Science Academy.
 
-    Description: Simple script to train and save an instance of the
-    SVDpp algorithm on MovieLens data.
+    Description: Script to tune, train and save an instance of the SVD
+    algorithm on MovieLens data.
+
+    A grid (or random) search over the number of factors, epochs,
+    learning rate and regularisation is cross-validated across folds on
+    a process pool with one worker per core. The ratings are written once
+    as memory-mapped columns that every worker opens read-only, instead of
+    being pickled into each task. RMSE, MAE and wall-clock time are
+    reported per configuration, and the best configuration is refit on
+    all ratings and saved to the path the app loads its model from. With
+    `--metrics`, the time spent in each stage (loading, search, refit,
+    saving) is printed at the end.
+
+    Usage (from the repository root):
+
+        python resources/models/train_colbased.py --folds 3 \\
+            --n-factors 50 100 200 --n-epochs 20 40
 
 """
 # Script dependencies
+import argparse
+import itertools
+import json
+import os
+import pickle
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-import pandas as pd
 from surprise import SVD
-import surprise
-import pickle
 
-# Importing datasets
-ratings = pd.read_csv('ratings.csv')
-ratings.drop('timestamp',axis=1,inplace=True)
+# Make the repository's helper packages importable when run as a script
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from recommenders.factor_model import FactorModel
+from utils.columnar import load_columns, save_columns
+from utils.metrics import metrics
+from utils.ratings_matrix import RatingsMatrix, load_ratings_matrix
+
+MODEL_PATH = 'resources/models/SVD.pkl'
+RATINGS_PATH = 'resources/data/ratings.csv'
+
+# Per-worker state, set up once by `_init_worker`
+_worker = {}
+
+def parameter_grid(n_factors, n_epochs, lr_all, reg_all, n_iter=None, seed=0):
+    """List the SVD configurations to evaluate.
+
+    Parameters
+    ----------
+    n_factors, n_epochs, lr_all, reg_all : list
+        Candidate values of each SVD hyperparameter.
+    n_iter : int, optional
+        When given, sample this many configurations at random from the
+        full grid instead of evaluating all of them.
+    seed : int
+        Seed for the random sample.
+
+    Returns
+    -------
+    list (dict)
+        SVD keyword arguments, one dict per configuration.
+
+    """
+    grid = [dict(n_factors=f, n_epochs=e, lr_all=lr, reg_all=reg)
+            for f, e, lr, reg in itertools.product(n_factors, n_epochs, lr_all, reg_all)]
+    if n_iter is not None and n_iter < len(grid):
+        grid = random.Random(seed).sample(grid, n_iter)
+    return grid
+
+def fit_svd(ratings, params, rating_scale, seed=0):
+    """Fit an SVD on a `RatingsMatrix`.
+
+    Parameters
+    ----------
+    ratings : RatingsMatrix
+        Training ratings.
+    params : dict
+        SVD keyword arguments.
+    rating_scale : tuple
+        (min, max) rating.
+    seed : int
+        Random state of the factor initialisation.
 
-def svd_pp(save_path):
+    Returns
+    -------
+    surprise.SVD
+        Trained model.
+
+    """
+    method = SVD(init_std_dev=0.05, random_state=seed, **params)
+    return method.fit(ratings.to_surprise_trainset(rating_scale=rating_scale))
+
+def _init_worker(data_dir, rating_scale, seed):
+    columns = load_columns(data_dir, mmap_mode='r')
+    _worker['ratings'] = RatingsMatrix.from_columns(columns)
+    _worker['folds'] = columns['folds']
+    _worker['rating_scale'] = rating_scale
+    _worker['seed'] = seed
+
+def _evaluate(config_id, params, fold):
+    start = time.perf_counter()
+    ratings, folds = _worker['ratings'], _worker['folds']
+    test = folds == fold
+    model = fit_svd(ratings.subset(~test), params, _worker['rating_scale'],
+                    _worker['seed'])
+    factors = FactorModel.from_surprise(model)
+    users, items, truth = ratings.entries()
+    est = factors.score_pairs(factors.user_index(users[test]),
+                              factors.item_index(items[test]))
+    error = est - truth[test]
+    return {'config': config_id, 'fold': fold,
+            'rmse': float(np.sqrt(np.mean(error ** 2))),
+            'mae': float(np.mean(np.abs(error))),
+            'seconds': time.perf_counter() - start}
+
+def cross_validate(ratings, grid, folds=3, workers=None, seed=0):
+    """Cross-validate every configuration of `grid` on a process pool.
+
+    Parameters
+    ----------
+    ratings : RatingsMatrix
+        All ratings.
+    grid : list (dict)
+        Configurations from `parameter_grid`.
+    folds : int
+        Number of cross-validation folds.
+    workers : int, optional
+        Pool size; defaults to the number of cores.
+    seed : int
+        Seed for the fold assignment and model initialisation.
+
+    Returns
+    -------
+    list (dict)
+        Per-configuration mean/std RMSE and MAE, and fit wall-clock
+        seconds, sorted by mean RMSE.
+
+    """
+    rng = np.random.default_rng(seed)
+    fold_of = (rng.permutation(ratings.nnz) % folds).astype(np.int8)
+    rating_scale = (float(ratings.csr.data.min()), float(ratings.csr.data.max()))
+    workers = workers or os.cpu_count() or 1
+    results = []
+    with tempfile.TemporaryDirectory(prefix='svd-cv-') as data_dir:
+        save_columns(data_dir, dict(ratings.to_columns(), folds=fold_of))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(data_dir, rating_scale, seed)) as pool:
+            tasks = [pool.submit(_evaluate, config_id, params, fold)
+                     for config_id, params in enumerate(grid)
+                     for fold in range(folds)]
+            for task in as_completed(tasks):
+                result = task.result()
+                results.append(result)
+                print('config {config} fold {fold}: rmse={rmse:.4f} '
+                      'mae={mae:.4f} ({seconds:.1f}s)'.format(**result), flush=True)
+    report = []
+    for config_id, params in enumerate(grid):
+        runs = [r for r in results if r['config'] == config_id]
+        report.append(dict(params,
+                           rmse=float(np.mean([r['rmse'] for r in runs])),
+                           rmse_std=float(np.std([r['rmse'] for r in runs])),
+                           mae=float(np.mean([r['mae'] for r in runs])),
+                           seconds=float(np.sum([r['seconds'] for r in runs]))))
+    return sorted(report, key=lambda r: r['rmse'])
+
+def save_model(model, save_path):
+    """Pickle a model, replacing `save_path` atomically.
+
+    The app's model registry watches this file, so it must never observe
+    a partially written pickle.
+
+    """
+    tmp_path = '{}.{}.tmp'.format(save_path, os.getpid())
+    with metrics.stage('train.save'), open(tmp_path, 'wb') as f:
+        pickle.dump(model, f)
+    os.replace(tmp_path, save_path)
+
+def svd_pp(save_path, ratings_path=RATINGS_PATH, n_factors=200, n_epochs=40,
+           lr_all=0.005, reg_all=0.02, seed=0):
+    # Streaming the ratings into a compact CSR matrix
+    with metrics.stage('train.load_ratings'):
+        ratings = load_ratings_matrix(ratings_path)
     # Check the range of the rating
-    min_rat = ratings['rating'].min()
-    max_rat = ratings['rating'].max()
-    # Changing ratings to their standard form
-    reader = surprise.Reader(rating_scale = (min_rat,max_rat))
-    # Loading the data frame using surprice
-    data_load = surprise.Dataset.load_from_df(ratings, reader)
-    # Insatntiating surpricce
-    method = SVD(n_factors = 200 , lr_all = 0.005 , reg_all = 0.02 , n_epochs = 40 , init_std_dev = 0.05)
-    # Loading a trainset into the model
-    model = method.fit(data_load.build_full_trainset())
+    rating_scale = (float(ratings.csr.data.min()), float(ratings.csr.data.max()))
+    # Fitting the model on every rating
+    with metrics.stage('train.fit'):
+        model = fit_svd(ratings, dict(n_factors=n_factors, n_epochs=n_epochs,
+                                      lr_all=lr_all, reg_all=reg_all),
+                        rating_scale, seed)
     print (f"Training completed. Saving model to: {save_path}")
+    save_model(model, save_path)
+    return model
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', default=RATINGS_PATH)
+    parser.add_argument('--save-path', default=MODEL_PATH)
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes (default: one per core).')
+    parser.add_argument('--n-factors', type=int, nargs='+', default=[50, 100, 200])
+    parser.add_argument('--n-epochs', type=int, nargs='+', default=[20, 40])
+    parser.add_argument('--lr', type=float, nargs='+', default=[0.005])
+    parser.add_argument('--reg', type=float, nargs='+', default=[0.02, 0.05])
+    parser.add_argument('--n-iter', type=int, default=None,
+                        help='Random search: sample this many configurations.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', default=None,
+                        help='Optional path of a JSON report.')
+    parser.add_argument('--metrics', action='store_true',
+                        help='Print the time spent in each stage.')
+    args = parser.parse_args(argv)
+    if args.metrics:
+        metrics.enable()
+
+    with metrics.stage('train.load_ratings'):
+        ratings = load_ratings_matrix(args.ratings)
+    grid = parameter_grid(args.n_factors, args.n_epochs, args.lr, args.reg,
+                          args.n_iter, args.seed)
+    print(f"Evaluating {len(grid)} configurations x {args.folds} folds "
+          f"on {ratings.nnz} ratings")
+    start = time.perf_counter()
+    with metrics.stage('train.cross_validate'):
+        report = cross_validate(ratings, grid, args.folds, args.workers, args.seed)
+    print(f"Search completed in {time.perf_counter() - start:.1f}s")
+    print('rank  rmse    mae     seconds  params')
+    for rank, row in enumerate(report, 1):
+        print('{:<5d} {rmse:.4f}  {mae:.4f}  {seconds:7.1f}  n_factors={n_factors} '
+              'n_epochs={n_epochs} lr_all={lr_all} reg_all={reg_all}'.format(rank, **row))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
 
-    return pickle.dump(model, open(save_path,'wb'))
+    best = {k: report[0][k] for k in ('n_factors', 'n_epochs', 'lr_all', 'reg_all')}
+    rating_scale = (float(ratings.csr.data.min()), float(ratings.csr.data.max()))
+    with metrics.stage('train.fit'):
+        model = fit_svd(ratings, best, rating_scale, args.seed)
+    print (f"Training completed. Saving model to: {args.save_path}")
+    save_model(model, args.save_path)
+    if args.metrics:
+        print('stage                     seconds')
+        for name, stage in metrics.snapshot()['stages'].items():
+            print('{:<25} {:7.2f}'.format(name, stage['total_seconds']))
 
 if __name__ == '__main__':
-    svd_pp('SVD.pkl')
+    main()
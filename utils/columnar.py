@@ -0,0 +1,201 @@
+"""
+
+    Helper functions for columnar `.npy` artifacts.
+
+    Author: Explore Data Science Academy.
+
+    Description: A columnar artifact is a directory holding one `.npy`
+    file per column. Opened with `mmap_mode='r'`, every process on a host
+    maps the same page-cache copy of the data, so additional app workers
+    add close to zero resident memory for it. Artifacts are published as
+    versioned sub-directories of a root, with a `CURRENT` pointer file
+    that is replaced atomically; readers therefore only ever open a
+    complete version.
+
+"""
+# Data handling dependencies
+import os
+import re
+import shutil
+import time
+import numpy as np
+
+CURRENT_FILE = 'CURRENT'
+# Names of published versions: '<time_ns>-<pid>'
+VERSION_PATTERN = re.compile(r'^(\d+)-(\d+)$')
+# Seconds a replaced version is kept after its successor was published, so
+# a reader that resolved `CURRENT` just before the swap can still open it
+PRUNE_GRACE = 60.0
+# Bytes of a string buffer copied out at a time while iterating
+STRING_BLOCK = 1 << 20
+
+def save_columns(directory, columns):
+    """Write each array of `columns` to `<directory>/<name>.npy`.
+
+    Parameters
+    ----------
+    directory : str
+        Destination directory, created if missing.
+    columns : dict
+        Column name to array.
+
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name, values in columns.items():
+        np.save(os.path.join(directory, name + '.npy'), np.asarray(values))
+
+def load_columns(directory, mmap_mode='r'):
+    """Open every `.npy` column of a directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory written by `save_columns`.
+    mmap_mode : str or None
+        Passed to `numpy.load`; 'r' maps the files read-only and shared.
+
+    Returns
+    -------
+    dict
+        Column name to (memory-mapped) array.
+
+    """
+    columns = {}
+    for filename in os.listdir(directory):
+        if filename.endswith('.npy'):
+            path = os.path.join(directory, filename)
+            columns[filename[:-4]] = np.load(path, mmap_mode=mmap_mode)
+    return columns
+
+def publish_columns(root, columns, keep=2):
+    """Write a new version of an artifact and make it current atomically.
+
+    Parameters
+    ----------
+    root : str
+        Artifact root directory.
+    columns : dict
+        Column name to array.
+    keep : int
+        Number of most recent versions to retain on disk (at least the
+        current and previous one). Older versions are removed once they
+        have been replaced for `PRUNE_GRACE` seconds; processes that
+        already map them keep valid mappings until they close them.
+
+    Returns
+    -------
+    str
+        Name of the published version.
+
+    """
+    os.makedirs(root, exist_ok=True)
+    version = '{:d}-{:d}'.format(time.time_ns(), os.getpid())
+    tmp_dir = os.path.join(root, '.tmp-' + version)
+    save_columns(tmp_dir, columns)
+    os.replace(tmp_dir, os.path.join(root, version))
+    pointer = os.path.join(root, CURRENT_FILE)
+    with open(pointer + '.tmp-' + version, 'w') as f:
+        f.write(version)
+    os.replace(pointer + '.tmp-' + version, pointer)
+    _prune_versions(root, keep)
+    return version
+
+def current_version(root):
+    """Name of the current version of an artifact, or None if unpublished."""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def open_columns(root, mmap_mode='r'):
+    """Open the current version of an artifact.
+
+    Parameters
+    ----------
+    root : str
+        Artifact root directory.
+    mmap_mode : str or None
+        Passed to `numpy.load`.
+
+    Returns
+    -------
+    tuple
+        The version name and its columns, or (None, None) if nothing has
+        been published.
+
+    """
+    version = current_version(root)
+    if version is None:
+        return None, None
+    return version, load_columns(os.path.join(root, version), mmap_mode)
+
+def _prune_versions(root, keep):
+    # Only directories named like versions; anything else is left alone
+    versions = sorted((d for d in os.listdir(root)
+                       if VERSION_PATTERN.match(d) and
+                       os.path.isdir(os.path.join(root, d))),
+                      key=lambda d: tuple(map(int, VERSION_PATTERN.match(d).groups())))
+    keep = max(keep, 2)
+    now = time.time_ns()
+    for old, successor in zip(versions[:-keep], versions[1:]):
+        replaced = int(VERSION_PATTERN.match(successor).group(1))
+        if now - replaced >= PRUNE_GRACE * 1e9:
+            shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+def encode_strings(values):
+    """Pack strings into UTF-8 bytes plus offsets for columnar storage.
+
+    Parameters
+    ----------
+    values : iterable (str)
+        Strings to pack.
+
+    Returns
+    -------
+    tuple
+        int64 offsets of length n + 1 and the uint8 byte buffer.
+
+    """
+    encoded = [str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return offsets, data
+
+class StringColumn:
+    """Read-only sequence of strings over (possibly mapped) offset/byte arrays."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(*encode_strings(values))
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def __iter__(self):
+        # Strings are decoded from blocks of about `STRING_BLOCK` bytes, so
+        # a mapped buffer is never copied out as a whole
+        offsets, n, i = self.offsets, len(self), 0
+        while i < n:
+            j = int(np.searchsorted(offsets, offsets[i] + STRING_BLOCK, side='right')) - 1
+            j = min(max(j, i + 1), n)
+            base = int(offsets[i])
+            block = bytes(self.data[base:int(offsets[j])])
+            bounds = (np.asarray(offsets[i:j + 1]) - base).tolist()
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                yield block[start:end].decode('utf-8')
+            i = j
+
+    def tolist(self):
+        return list(self)
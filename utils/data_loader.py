@@ -8,6 +8,8 @@
 # Data handling dependencies
 import pandas as pd
 import numpy as np
+from utils.data_store import load_movies
+from utils.metrics import metrics
 
 def load_movie_titles(path_to_movies):
     """Load movie titles from database records.
@@ -24,7 +26,7 @@ def load_movie_titles(path_to_movies):
         Movie titles.
 
     """
-    df = pd.read_csv(path_to_movies)
-    df = df.dropna()
-    movie_list = df['title'].to_list()
+    with metrics.stage('data.load_movie_titles'):
+        df = load_movies(path_to_movies)
+        movie_list = df['title'].to_list()
     return movie_list
@@ -0,0 +1,282 @@
+"""
+
+    Shared, compact in-memory store for the MovieLens data files.
+
+    Author: Explore Data Science Academy.
+
+    Description: Each CSV is parsed at most once per process and handed
+    to every module as the same DataFrame object, with compact dtypes
+    (int32 ids, float32 ratings, categorical genres and a uint32 genre
+    bitmask). A binary columnar copy of each parsed file is cached next to
+    the data, keyed on the source file's content hash, so later processes
+    skip CSV parsing entirely. When a CSV changes, both the in-process
+    frame and the cache are rebuilt on the next load, and the caches of
+    its earlier contents are removed.
+
+    In shared-artifact mode (`RECOMMENDER_SHARED_DIR` set, see
+    `recommenders.model_registry`) the cached columns are opened
+    memory-mapped and the numeric columns of the frames are views of the
+    mapping, so every app process on the host shares one page-cache copy
+    of them. Only the title strings are private to each process.
+
+    The returned frames are shared: callers must treat them as read-only
+    and take a copy before adding or altering columns.
+
+"""
+# Data handling dependencies
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from utils.columnar import StringColumn, encode_strings, load_columns, save_columns
+from utils.metrics import metrics
+
+CACHE_DIR = os.path.join('resources', 'data', '.cache')
+# Whether frames are built over read-only memory-mapped cache columns
+SHARED = bool(os.environ.get('RECOMMENDER_SHARED_DIR'))
+
+_frames = {}
+_hashes = {}
+_lock = threading.Lock()
+
+def file_hash(path):
+    """SHA-1 of a file's contents, memoised on its size and mtime.
+
+    Parameters
+    ----------
+    path : str
+        File to hash.
+
+    Returns
+    -------
+    str
+        Hex digest.
+
+    """
+    stat = os.stat(path)
+    prefix = '{}:'.format(os.path.abspath(path))
+    key = '{}{}:{}'.format(prefix, stat.st_size, stat.st_mtime_ns)
+    if key in _hashes:
+        return _hashes[key]
+    memo_path = os.path.join(CACHE_DIR, 'hashes.json')
+    try:
+        with open(memo_path) as f:
+            memo = json.load(f)
+    except (OSError, ValueError):
+        memo = {}
+    if key in memo:
+        _hashes[key] = memo[key]
+        return memo[key]
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    # Entries of the file's earlier contents are no longer needed
+    memo = {k: v for k, v in memo.items() if not k.startswith(prefix)}
+    memo[key] = _hashes[key] = digest.hexdigest()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(memo_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(memo, f)
+        os.replace(tmp_path, memo_path)
+    except OSError:
+        pass
+    return memo[key]
+
+def genre_vocabulary(genres):
+    """Sorted list of the distinct genre tags in a `|`-separated column."""
+    tags = set()
+    for value in pd.unique(genres):
+        tags.update(value.split('|'))
+    return sorted(tags)
+
+def genre_masks(genres, vocabulary):
+    """Encode `|`-separated genre strings as uint32 bitmasks.
+
+    Parameters
+    ----------
+    genres : Pandas Series
+        Genre strings, e.g. 'Adventure|Children|Fantasy'.
+    vocabulary : list (str)
+        Genre tags; tag `k` sets bit `k`. At most 32 tags are supported.
+
+    Returns
+    -------
+    numpy.ndarray
+        uint32 bitmask per row.
+
+    """
+    if len(vocabulary) > 32:
+        raise ValueError('At most 32 genre tags fit in a uint32 bitmask.')
+    bits = {tag: np.uint32(1) << np.uint32(k) for k, tag in enumerate(vocabulary)}
+    codes, uniques = pd.factorize(genres)
+    unique_masks = np.array([np.bitwise_or.reduce([bits[t] for t in u.split('|')
+                                                  if t in bits] or [np.uint32(0)])
+                             for u in uniques], dtype=np.uint32)
+    return unique_masks[codes]
+
+def _parse_movies(path):
+    df = pd.read_csv(path, dtype={'movieId': np.int32, 'title': object,
+                                  'genres': object})
+    df = df.dropna().reset_index(drop=True)
+    vocabulary = genre_vocabulary(df['genres'])
+    df['genre_mask'] = genre_masks(df['genres'], vocabulary)
+    df['genres'] = df['genres'].astype('category')
+    df.attrs['genre_vocabulary'] = vocabulary
+    return df
+
+def _movies_to_columns(df):
+    title_offsets, title_data = encode_strings(df['title'])
+    category_offsets, category_data = encode_strings(df['genres'].cat.categories)
+    vocab_offsets, vocab_data = encode_strings(df.attrs['genre_vocabulary'])
+    return {'movieId': df['movieId'].to_numpy(),
+            'title_offsets': title_offsets, 'title_data': title_data,
+            'genre_codes': df['genres'].cat.codes.to_numpy(),
+            'genre_category_offsets': category_offsets,
+            'genre_category_data': category_data,
+            'genre_mask': df['genre_mask'].to_numpy(),
+            'vocabulary_offsets': vocab_offsets, 'vocabulary_data': vocab_data}
+
+def _movies_from_columns(columns):
+    titles = StringColumn(columns['title_offsets'], columns['title_data'])
+    categories = StringColumn(columns['genre_category_offsets'],
+                              columns['genre_category_data'])
+    vocabulary = StringColumn(columns['vocabulary_offsets'],
+                              columns['vocabulary_data'])
+    df = pd.DataFrame({
+        'movieId': columns['movieId'],
+        'title': pd.Series(titles.tolist(), dtype=object),
+        'genres': pd.Categorical.from_codes(columns['genre_codes'],
+                                            categories=categories.tolist()),
+        'genre_mask': columns['genre_mask'],
+    }, copy=False)
+    df.attrs['genre_vocabulary'] = vocabulary.tolist()
+    return df
+
+def _parse_ratings(path):
+    return pd.read_csv(path, dtype={'userId': np.int32, 'movieId': np.int32,
+                                    'rating': np.float32, 'timestamp': np.int64})
+
+def _ratings_to_columns(df):
+    return {name: df[name].to_numpy() for name in df.columns}
+
+def _ratings_from_columns(columns):
+    order = ['userId', 'movieId', 'rating', 'timestamp']
+    return pd.DataFrame({name: columns[name] for name in order if name in columns},
+                        copy=False)
+
+_KINDS = {
+    'movies': (_parse_movies, _movies_to_columns, _movies_from_columns),
+    'ratings': (_parse_ratings, _ratings_to_columns, _ratings_from_columns),
+}
+
+def _load(kind, path, use_cache):
+    key = (kind, os.path.abspath(path))
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        cached = _frames.get(key)
+        if cached is not None and cached[0] == signature:
+            metrics.count('data.frames.hit')
+            return cached[1]
+        metrics.count('data.frames.miss')
+        parse, to_columns, from_columns = _KINDS[kind]
+        frame = None
+        if use_cache:
+            name = os.path.splitext(os.path.basename(path))[0]
+            cache_path = os.path.join(CACHE_DIR, '{}-{}'.format(name, file_hash(path)))
+            frame = _load_cache(kind, cache_path, from_columns)
+        if frame is None:
+            with metrics.stage('data.parse_csv.' + kind):
+                frame = parse(path)
+            if use_cache:
+                with metrics.stage('data.write_cache.' + kind):
+                    _write_cache(cache_path, to_columns(frame))
+                if SHARED:
+                    # Serve the mapped copy, shared with the other processes
+                    mapped = _load_cache(kind, cache_path, from_columns)
+                    frame = frame if mapped is None else mapped
+        _frames[key] = (signature, frame)
+        return frame
+
+def _load_cache(kind, cache_path, from_columns):
+    if not os.path.isdir(cache_path):
+        return None
+    try:
+        with metrics.stage('data.load_cache.' + kind):
+            return from_columns(load_columns(cache_path,
+                                             mmap_mode='r' if SHARED else None))
+    except (OSError, ValueError, KeyError):
+        # Pruned or damaged meanwhile: parse the CSV instead
+        return None
+
+def _write_cache(cache_path, columns):
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+        save_columns(tmp_path, columns)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # E.g. another process published the same cache first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+    _prune_caches(cache_path)
+
+def _prune_caches(cache_path):
+    """Remove the caches of a file's other contents."""
+    directory, current = os.path.split(cache_path)
+    name = current[:-41]
+    pattern = re.compile(re.escape(name) + r'-[0-9a-f]{40}$')
+    for entry in os.listdir(directory):
+        if entry != current and pattern.match(entry):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+def load_movies(path='resources/data/movies.csv', use_cache=True):
+    """Shared movie catalogue.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+    use_cache : bool
+        Whether to read/write the binary columnar cache.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Read-only frame with int32 `movieId`, `title`, categorical
+        `genres` and uint32 `genre_mask` columns, rows with missing values
+        dropped. The genre tag of each mask bit is listed in
+        `df.attrs['genre_vocabulary']`.
+
+    """
+    return _load('movies', path, use_cache)
+
+def load_ratings(path='resources/data/ratings.csv', use_cache=True):
+    """Shared ratings table.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to ratings stored in .csv format.
+    use_cache : bool
+        Whether to read/write the binary columnar cache.
+
+    Returns
+    -------
+    Pandas Dataframe
+        Read-only frame with int32 `userId`/`movieId`, float32 `rating`
+        and int64 `timestamp` columns.
+
+    """
+    return _load('ratings', path, use_cache)
+
+def clear():
+    """Drop the in-process frames so the next load re-reads the files."""
+    with _lock:
+        _frames.clear()
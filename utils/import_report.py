@@ -0,0 +1,137 @@
+"""
+
+    Import-time report of the app and its recommenders.
+
+    Author: Explore Data Science Academy.
+
+    Description: Imports each target module in a fresh interpreter run
+    with `-X importtime`, and reports the wall-clock import time, the
+    resident memory afterwards and the target's direct imports that cost
+    the most. With `--budget`, the exit status is 1 when a target takes
+    longer, so a cold-start budget can be enforced in CI or before a
+    deploy.
+
+    Usage (from the repository root):
+
+        python -m utils.import_report edsa_recommender --budget 3
+        python -m utils.import_report recommenders.content_based \\
+            recommenders.collaborative_based --json report.json
+
+"""
+# Script dependencies
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_PROBE = ('import time; start = time.perf_counter(); import {module}; '
+          'seconds = time.perf_counter() - start; '
+          'from utils.metrics import rss_mb; '
+          'print("IMPORT_REPORT", seconds, rss_mb())')
+
+def import_profile(module, cwd=None, env=None):
+    """Import a module in a fresh interpreter and profile the import.
+
+    Parameters
+    ----------
+    module : str
+        Dotted module name.
+    cwd : str, optional
+        Working directory of the interpreter (relative data paths resolve
+        against it); defaults to the current one.
+    env : dict, optional
+        Environment of the interpreter; defaults to the current one.
+
+    Returns
+    -------
+    dict
+        `module`, wall-clock `seconds`, `rss_mb` after the import, and
+        `imports`: (name, self seconds, cumulative seconds, depth, root)
+        of every module imported, where depth 0 modules are imported by
+        the interpreter or the probe itself and `root` is the depth 0
+        module an import happened under.
+
+    Raises
+    ------
+    RuntimeError
+        If the import fails.
+
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+        cwd=cwd, env=env, capture_output=True, text=True)
+    result = [line for line in completed.stdout.splitlines()
+              if line.startswith('IMPORT_REPORT')]
+    if completed.returncode != 0 or not result:
+        lines = completed.stderr.strip().splitlines() or ['no output']
+        raise RuntimeError('Importing {} failed: {}'.format(module, lines[-1]))
+    _, seconds, rss = result[-1].split()
+    imports, pending = [], []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        pending.append([name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6,
+                        depth])
+        # Imports are listed after everything they imported
+        if depth == 0:
+            imports.extend(tuple(entry + [pending[-1][0]]) for entry in pending)
+            pending = []
+    return {'module': module, 'seconds': float(seconds),
+            'rss_mb': None if rss == 'None' else float(rss), 'imports': imports}
+
+def heaviest(profile, top=15):
+    """The `top` direct imports of the target by cumulative import time.
+
+    These are what deferring an import would save; modules already
+    imported by an earlier direct import are counted there.
+
+    """
+    parts = profile['module'].split('.')
+    roots = {'.'.join(parts[:i]) for i in range(1, len(parts) + 1)}
+    direct = [entry for entry in profile['imports']
+              if entry[3] == 1 and entry[4] in roots]
+    return sorted(direct, key=lambda entry: -entry[2])[:top]
+
+def format_profile(profile, top=15):
+    """Human-readable report of one `import_profile`."""
+    lines = ['{}: {:.2f}s, {} MB resident'.format(
+        profile['module'], profile['seconds'],
+        '?' if profile['rss_mb'] is None else '{:.0f}'.format(profile['rss_mb']))]
+    own = [entry[1] for entry in profile['imports'] if entry[0] == profile['module']]
+    if own:
+        lines.append('  {:8.3f}s  (module-level code of {})'.format(
+            own[0], profile['module']))
+    for name, _, cumulative, _, _ in heaviest(profile, top):
+        lines.append('  {:8.3f}s  {}'.format(cumulative, name))
+    return '\n'.join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report module import times.')
+    parser.add_argument('modules', nargs='*', default=['edsa_recommender'])
+    parser.add_argument('--top', type=int, default=15,
+                        help='Heaviest dependencies listed per module.')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='Seconds allowed per import; exit 1 when exceeded.')
+    parser.add_argument('--json', default=None, help='Optional JSON report path.')
+    args = parser.parse_args(argv)
+
+    profiles, over_budget = [], []
+    for module in args.modules:
+        profile = import_profile(module, cwd=os.getcwd())
+        profiles.append(profile)
+        print(format_profile(profile, args.top))
+        if args.budget is not None and profile['seconds'] > args.budget:
+            over_budget.append(module)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(profiles, f, indent=2)
+    if over_budget:
+        print('Over the {:.2f}s budget: {}'.format(args.budget, ', '.join(over_budget)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
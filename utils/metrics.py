@@ -0,0 +1,224 @@
+"""
+
+    Toggleable stage timers and counters for the recommendation hot paths.
+
+    Author: Explore Data Science Academy.
+
+    Description: Code marks its expensive stages with `metrics.stage(name)`
+    (a context manager) or `metrics.timed(name)` (a decorator), and counts
+    events such as cache hits with `metrics.count(name)`. Stage names are
+    dotted, e.g. 'data.parse_csv.ratings' or 'collab.score'.
+
+    While metrics are off (the default) a stage is a shared no-op object
+    and a count returns immediately, so the instrumentation costs a flag
+    check. They are switched on with `RECOMMENDER_METRICS=1` or
+    `metrics.enable()`, after which every stage feeds per-stage aggregates
+    (count, total, max) and, inside `metrics.request(name)`, the trace of
+    the current request. The last `RECENT_REQUESTS` traces are kept with
+    their stage breakdown, counters and the process memory at the end of
+    the request. `metrics.snapshot()` returns all of it as a JSON-ready
+    dict, including the hit rate of every `<name>.hit`/`<name>.miss`
+    counter pair.
+
+    The current request is tracked in a context variable: work handed to
+    other threads joins it when submitted with `contextvars.copy_context()`.
+
+"""
+# Script dependencies
+import contextvars
+import functools
+import os
+import resource
+import sys
+import threading
+import time
+from collections import deque
+
+RECENT_REQUESTS = 50
+
+def rss_mb():
+    """Current resident memory of this process in MB (None if unknown)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+class _NullContext:
+    """Context manager doing nothing, returned while metrics are off."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL = _NullContext()
+
+class _Stage:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class _Request:
+    __slots__ = ('metrics', 'trace', 'token', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.trace = {'name': name, 'time': time.time(), 'stages': {},
+                      'counters': {}}
+
+    def __enter__(self):
+        self.token = self.metrics._trace.set(self.trace)
+        self.start = time.perf_counter()
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        self.trace['seconds'] = time.perf_counter() - self.start
+        self.trace['rss_mb'] = rss_mb()
+        if exc is not None:
+            self.trace['error'] = repr(exc)
+        self.metrics._trace.reset(self.token)
+        self.metrics._finish(self.trace)
+        return False
+
+class Metrics:
+    """Stage timings, counters and recent request traces of a process.
+
+    Parameters
+    ----------
+    enabled : bool
+        Whether stages and counts are recorded.
+    recent : int
+        Number of request traces kept.
+
+    """
+
+    def __init__(self, enabled=False, recent=RECENT_REQUESTS):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._trace = contextvars.ContextVar('metrics_trace', default=None)
+        self._requests = deque(maxlen=recent)
+        self._stages = {}
+        self._counters = {}
+        self._since = time.time()
+
+    def enable(self, enabled=True):
+        """Switch recording on (or off with `enabled=False`)."""
+        self.enabled = bool(enabled)
+
+    def reset(self):
+        """Forget all aggregates, counters and request traces."""
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._requests.clear()
+            self._since = time.time()
+
+    def stage(self, name):
+        """Context manager timing the enclosed block as stage `name`."""
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as stage `name`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Stage(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def request(self, name):
+        """Context manager tracing the enclosed block as one request.
+
+        Stages and counts inside it are added to the request's trace. A
+        request opened inside another one joins the outer request.
+
+        """
+        if not self.enabled or self._trace.get() is not None:
+            return _NULL
+        return _Request(self, name)
+
+    def count(self, name, n=1):
+        """Add `n` to counter `name`."""
+        if not self.enabled:
+            return
+        trace = self._trace.get()
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+            if trace is not None:
+                trace['counters'][name] = trace['counters'].get(name, 0) + n
+
+    def record(self, name, seconds):
+        """Add one timing of stage `name`."""
+        trace = self._trace.get()
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            if trace is not None:
+                trace['stages'][name] = trace['stages'].get(name, 0.0) + seconds
+
+    def _finish(self, trace):
+        with self._lock:
+            self._requests.append(trace)
+
+    def snapshot(self):
+        """All metrics of this process as a JSON-serialisable dict.
+
+        Returns
+        -------
+        dict
+            `enabled`, `pid`, `since` (epoch of the last reset), `stages`
+            (name to count, total seconds, mean and max ms), `counters`,
+            `hit_rates` (prefix of each hit/miss counter pair to its hit
+            rate), `memory` (current and peak RSS in MB) and `requests`
+            (recent request traces, newest first).
+
+        """
+        with self._lock:
+            stages = {name: {'count': n, 'total_seconds': total,
+                             'mean_ms': 1000 * total / n, 'max_ms': 1000 * peak}
+                      for name, (n, total, peak) in sorted(self._stages.items())}
+            counters = dict(sorted(self._counters.items()))
+            requests = [dict(trace, stages=dict(trace['stages']),
+                             counters=dict(trace['counters']))
+                        for trace in reversed(self._requests)]
+        hit_rates = {}
+        for name, hits in counters.items():
+            if name.endswith('.hit'):
+                prefix = name[:-len('.hit')]
+                lookups = hits + counters.get(prefix + '.miss', 0)
+                hit_rates[prefix] = hits / lookups if lookups else 0.0
+        return {'enabled': self.enabled, 'pid': os.getpid(), 'since': self._since,
+                'stages': stages, 'counters': counters, 'hit_rates': hit_rates,
+                'memory': {'rss_mb': rss_mb(), 'peak_rss_mb': peak_rss_mb()},
+                'requests': requests}
+
+# Metrics of this process
+metrics = Metrics(enabled=os.environ.get('RECOMMENDER_METRICS', '0') not in ('', '0'))
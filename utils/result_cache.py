@@ -0,0 +1,195 @@
+"""
+
+    Request-level cache of recommendation results.
+
+    Author: Explore Data Science Academy.
+
+    Description: Streamlit reruns the app script on every widget
+    interaction, and identical favourite triples are otherwise recomputed
+    each time the Recommend button is pressed. Results are cached on
+    (algorithm, order-normalised movie list, top_n, model version) in a
+    bounded LRU with a time-to-live, optionally backed by an SQLite file
+    so results survive restarts and are shared between app processes.
+    Because the model version is part of the key, a reloaded model never
+    serves results computed with its predecessor.
+
+"""
+# Data handling dependencies
+import functools
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from utils.metrics import metrics
+
+class ResultCache:
+    """Bounded LRU + TTL cache with an optional on-disk tier.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries held in memory.
+    ttl : float
+        Seconds an entry stays valid, in memory and on disk.
+    disk_path : str, optional
+        SQLite file for the persistent tier. Values must be JSON
+        serialisable.
+
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600.0, disk_path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = dict(hits=0, misses=0, disk_hits=0, evictions=0,
+                              expirations=0)
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` on a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters['hits'] += 1
+                    return entry[1]
+                del self._entries[key]
+                self._counters['expirations'] += 1
+        if self.disk_path:
+            entry = self._disk_get(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._counters['disk_hits'] += 1
+                    self._insert(key, entry[0], entry[1])
+                return entry[1]
+        with self._lock:
+            self._counters['misses'] += 1
+        return default
+
+    def put(self, key, value):
+        """Store `value` under `key` in memory and, if enabled, on disk."""
+        now = time.time()
+        with self._lock:
+            self._insert(key, now, value)
+        if self.disk_path:
+            self._disk_put(key, now, value)
+
+    def invalidate(self, predicate=None):
+        """Drop entries whose key satisfies `predicate` (all when None)."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate is None or predicate(k)]:
+                del self._entries[key]
+        if self.disk_path:
+            db = self._db()
+            with db:
+                if predicate is None:
+                    db.execute('DELETE FROM results')
+                else:
+                    rows = db.execute('SELECT key FROM results').fetchall()
+                    stale = [(k,) for (k,) in rows if predicate(tuple(json.loads(k)))]
+                    db.executemany('DELETE FROM results WHERE key = ?', stale)
+
+    def stats(self):
+        """Hit/miss counters, current size and hit rate."""
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries),
+                         maxsize=self.maxsize)
+        lookups = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _insert(self, key, stamp, value):
+        self._entries[key] = (stamp, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._counters['evictions'] += 1
+
+    def _db(self):
+        # sqlite3 connections are not shareable across threads
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.disk_path, timeout=5)
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key TEXT PRIMARY KEY, stamp REAL, value TEXT)')
+            self._local.db = db
+        return db
+
+    def _disk_get(self, key, now):
+        try:
+            row = self._db().execute('SELECT stamp, value FROM results WHERE key = ?',
+                                     (json.dumps(key),)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or now - row[0] > self.ttl:
+            return None
+        return row[0], _freeze(json.loads(row[1]))
+
+    def _disk_put(self, key, stamp, value):
+        try:
+            db = self._db()
+            with db:
+                db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)',
+                           (json.dumps(key), stamp, json.dumps(value)))
+        except sqlite3.Error:
+            pass
+
+def _freeze(value):
+    """Convert JSON lists back to the tuples stored in memory."""
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+def cached_recommender(algorithm, version, cache=None):
+    """Cache a `*_model(movie_list, top_n)` function's results.
+
+    Parameters
+    ----------
+    algorithm : str
+        Name of the recommender, part of the cache key.
+    version : callable
+        Returns the current model/data version; part of the cache key so
+        a reloaded model invalidates earlier results.
+    cache : ResultCache, optional
+        Defaults to the shared `recommendation_cache`.
+
+    Returns
+    -------
+    callable
+        Decorator preserving the wrapped function's name and signature.
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(movie_list, top_n=10):
+            with metrics.request(algorithm):
+                store = cache or recommendation_cache
+                key = (algorithm, tuple(sorted(movie_list)), top_n, str(version()))
+                result = store.get(key)
+                if result is None:
+                    metrics.count('cache.{}.miss'.format(algorithm))
+                    with metrics.stage(algorithm + '.compute'):
+                        result = tuple(func(movie_list, top_n))
+                    store.put(key, result)
+                else:
+                    metrics.count('cache.{}.hit'.format(algorithm))
+                return list(result)
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+# Cache shared by the recommenders of this process
+recommendation_cache = ResultCache(
+    maxsize=int(os.environ.get('RECOMMENDER_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('RECOMMENDER_CACHE_TTL', 3600)),
+    disk_path=os.environ.get('RECOMMENDER_CACHE_DB'))
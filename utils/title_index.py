@@ -0,0 +1,303 @@
+"""
+
+    Title search index over the movie catalogue.
+
+    Author: Explore Data Science Academy.
+
+    Description: Resolves and searches movie titles without scanning the
+    catalogue:
+
+      - exact lookup: a dict from title to the row of its first
+        occurrence, so recommenders resolve titles in O(1);
+      - prefix lookup: a sorted array of normalised title keys searched
+        with bisection, for type-ahead;
+      - fuzzy lookup: an inverted index of character trigrams, ranked by
+        trigram Jaccard similarity, for typos and partial words.
+
+    Keys are case- and accent-folded, a trailing article is moved to the
+    front ('Matrix, The (1999)' is found as 'the matrix' and 'matrix'),
+    and a release year in the query ('matrix 1999', 'matrix (1999)')
+    restricts the matches to that year.
+
+"""
+# Script dependencies
+import bisect
+import re
+import threading
+import unicodedata
+import numpy as np
+from utils.data_store import load_movies
+
+_YEAR = re.compile(r'\s*\(((?:18|19|20)\d\d)(?:[-–]\d*)?\)\s*$')
+_QUERY_YEAR = re.compile(r'(?:^|\s)\(?((?:18|19|20)\d\d)\)?\s*$')
+_ARTICLE = re.compile(r"^(.*), (the|a|an|les|la|le|l'|il|el|los|las|die|der|das)$",
+                      re.IGNORECASE)
+_NON_WORD = re.compile(r'[^\w]+')
+
+_indexes = {}
+_lock = threading.Lock()
+
+def split_year(title):
+    """Split a catalogue title into its name and release year.
+
+    Parameters
+    ----------
+    title : str
+        Title such as 'Toy Story (1995)'.
+
+    Returns
+    -------
+    tuple
+        The title without its year, and the year as an int (or None).
+
+    """
+    match = _YEAR.search(title)
+    if match is None:
+        return title.strip(), None
+    return title[:match.start()].strip(), int(match.group(1))
+
+def normalise(text):
+    """Lower-case, accent-free, single-spaced form of a title or query."""
+    if text.isascii():
+        text = text.lower()
+    else:
+        text = unicodedata.normalize('NFKD', text.casefold())
+        text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+def title_keys(name):
+    """Normalised search keys of a title name (without its year).
+
+    Titles listed as 'Name, The' (optionally followed by an alternative
+    title in parentheses) get the key 'the name' as well as 'name'.
+
+    """
+    main, _, rest = name.partition(' (')
+    match = _ARTICLE.match(main.strip())
+    if match is None:
+        return [normalise(name)]
+    suffix = ' (' + rest if rest else ''
+    return [normalise('{} {}{}'.format(match.group(2), match.group(1), suffix)),
+            normalise(match.group(1) + suffix)]
+
+def _codepoints(text):
+    return np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+
+def _pack(codes):
+    """int64 code of every trigram of a codepoint array (21 bits a char)."""
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+def trigram_codes(key):
+    """Sorted distinct trigram codes of a normalised key, space-padded."""
+    return np.unique(_pack(_codepoints('  {} '.format(key))))
+
+def parse_query(query):
+    """Normalised query text and the year it ends with, if any."""
+    match = _QUERY_YEAR.search(query)
+    if match is None or not query[:match.start()].strip():
+        return normalise(query), None
+    return normalise(query[:match.start()]), int(match.group(1))
+
+class TitleIndex:
+    """Exact, prefix and trigram search over catalogue titles.
+
+    Parameters
+    ----------
+    titles : list (str)
+        Catalogue titles in row order.
+    movie_ids : array-like (int), optional
+        MovieLens ID of each row.
+
+    Attributes
+    ----------
+    first_rows : numpy.ndarray
+        Ascending rows holding the first occurrence of each distinct title.
+    years : numpy.ndarray
+        Release year parsed from each title (0 when absent).
+
+    """
+
+    def __init__(self, titles, movie_ids=None):
+        self.titles = list(titles)
+        self.movie_ids = None if movie_ids is None else np.asarray(movie_ids)
+        self._rows = {}
+        years = np.zeros(len(self.titles), dtype=np.int16)
+        entries = []
+        gram_keys = []
+        for row, title in enumerate(self.titles):
+            self._rows.setdefault(title, row)
+            name, year = split_year(title)
+            years[row] = year or 0
+            keys = title_keys(name)
+            entries.extend((key, row) for key in keys)
+            gram_keys.append('  {} '.format(keys[-1]))
+        self.years = years
+        # Rows are visited in order, so first occurrences are ascending
+        self.first_rows = np.fromiter(self._rows.values(), dtype=np.int64,
+                                      count=len(self._rows))
+        entries.sort()
+        self._prefix_keys = [key for key, _ in entries]
+        self._prefix_rows = np.array([row for _, row in entries], dtype=np.int32)
+        self._build_trigrams(gram_keys)
+
+    def _build_trigrams(self, padded_keys):
+        """Inverted index from trigram code to the rows containing it."""
+        lengths = np.array([len(key) for key in padded_keys], dtype=np.int64)
+        ends = np.cumsum(lengths)
+        codes = _pack(_codepoints(''.join(padded_keys)))
+        # Keep the trigrams that lie within one key
+        rows = np.repeat(np.arange(lengths.size), lengths)[:codes.size]
+        inside = np.arange(codes.size) + 2 < ends[rows]
+        self._gram_codes, grams = np.unique(codes[inside], return_inverse=True)
+        pairs = np.sort(rows[inside] * self._gram_codes.size + grams.ravel())
+        pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+        rows, grams = pairs // self._gram_codes.size, pairs % self._gram_codes.size
+        self._gram_counts = np.bincount(rows, minlength=lengths.size)
+        order = np.argsort(grams, kind='stable')
+        self._posting_rows = rows[order].astype(np.int32)
+        self._posting_offsets = np.zeros(self._gram_codes.size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(grams, minlength=self._gram_codes.size),
+                  out=self._posting_offsets[1:])
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __contains__(self, title):
+        return title in self._rows
+
+    def row(self, title):
+        """Row of the first occurrence of an exact title.
+
+        Raises
+        ------
+        KeyError
+            If the title is not in the catalogue.
+
+        """
+        return self._rows[title]
+
+    def get(self, title, default=None):
+        """Row of an exact title, or `default`."""
+        return self._rows.get(title, default)
+
+    def rows(self, titles):
+        """Rows of several exact titles (KeyError if one is unknown)."""
+        return [self._rows[title] for title in titles]
+
+    def movie_id(self, title, default=-1):
+        """MovieLens ID of an exact title, or `default`."""
+        row = self._rows.get(title)
+        return default if row is None else int(self.movie_ids[row])
+
+    def prefix(self, query, limit=20):
+        """Rows whose title starts with the query, alphabetically.
+
+        Parameters
+        ----------
+        query : str
+            Start of a title; a trailing year filters on release year.
+        limit : int
+            Maximum number of rows.
+
+        Returns
+        -------
+        list (int)
+            Matching rows, each at most once.
+
+        """
+        text, year = parse_query(query)
+        start = bisect.bisect_left(self._prefix_keys, text)
+        rows, seen = [], set()
+        for i in range(start, len(self._prefix_keys)):
+            if not self._prefix_keys[i].startswith(text) or len(rows) >= limit:
+                break
+            row = int(self._prefix_rows[i])
+            if row not in seen and (year is None or self.years[row] == year):
+                seen.add(row)
+                rows.append(row)
+        return rows
+
+    def fuzzy(self, query, limit=20, min_score=0.2):
+        """Rows most similar to the query by trigram Jaccard similarity.
+
+        Parameters
+        ----------
+        query : str
+            Approximate title; a trailing year filters on release year.
+        limit : int
+            Maximum number of rows.
+        min_score : float
+            Smallest similarity returned.
+
+        Returns
+        -------
+        list (int)
+            Matching rows, most similar first.
+
+        """
+        text, year = parse_query(query)
+        codes = trigram_codes(text)
+        grams = np.minimum(np.searchsorted(self._gram_codes, codes),
+                           self._gram_codes.size - 1)
+        grams = grams[self._gram_codes[grams] == codes]
+        if grams.size == 0:
+            return []
+        offsets = self._posting_offsets
+        candidates = np.concatenate([self._posting_rows[offsets[g]:offsets[g + 1]]
+                                     for g in grams.tolist()])
+        shared = np.bincount(candidates, minlength=len(self.titles))
+        scores = shared / (codes.size + self._gram_counts - shared)
+        if year is not None:
+            scores[self.years != year] = 0
+        n = min(limit, int(np.count_nonzero(scores >= min_score)))
+        if n == 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        return top[np.argsort(-scores[top], kind='stable')].tolist()
+
+    def search(self, query, limit=20):
+        """Type-ahead matches: exact, then prefix, then fuzzy.
+
+        Returns
+        -------
+        list (str)
+            Matching titles, best first, without duplicates.
+
+        """
+        if not query.strip():
+            return []
+        rows = []
+        if query in self._rows:
+            rows.append(self._rows[query])
+        rows.extend(self.prefix(query, limit))
+        if len(set(rows)) < limit:
+            rows.extend(self.fuzzy(query, limit))
+        titles = []
+        for row in rows:
+            title = self.titles[row]
+            if title not in titles:
+                titles.append(title)
+        return titles[:limit]
+
+def load_title_index(path='resources/data/movies.csv'):
+    """Title index of a catalogue, built once per loaded catalogue frame.
+
+    Parameters
+    ----------
+    path : str
+        Relative or absolute path to movie database stored
+        in .csv format.
+
+    Returns
+    -------
+    TitleIndex
+        Index whose rows are the rows of `load_movies(path)`.
+
+    """
+    movies = load_movies(path)
+    with _lock:
+        cached = _indexes.get(path)
+        if cached is None or cached[0] is not movies:
+            cached = (movies, TitleIndex(movies['title'], movies['movieId']))
+            _indexes[path] = cached
+        return cached[1]